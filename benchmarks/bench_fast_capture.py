@@ -0,0 +1,96 @@
+"""
+Benchmark `fast` keyframe-only capture of thumbnails against `accurate` capture on a long-GOP source.
+
+Usage::
+
+    python benchmarks/bench_fast_capture.py --gop 10 --loops 8 --repeat 3
+
+The test fixture is looped and re-encoded with a keyframe every `--gop` seconds, unless `--file` is set.
+Accurate capture decodes every frame from the keyframe before a position up to it,
+fast capture decodes only the keyframe, so the difference grows with GOP length.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import tempfile
+from time import perf_counter
+
+from flask import Flask
+
+from videoserver import settings
+from videoserver.lib.video_editor import get_video_editor
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'storage', 'fixtures', 'sample_0.mp4')
+
+
+def make_long_gop(path_output, gop, loops):
+    # https://trac.ffmpeg.org/wiki/Encode/H.264
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-stream_loop', str(loops - 1), '-i', FIXTURE_PATH,
+         '-c:v', 'libx264', '-preset', 'veryfast', '-r', '25',
+         '-x264-params', f'keyint={gop * 25}:min-keyint={gop * 25}:scenecut=0', '-c:a', 'copy', path_output],
+        check=True
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--editors', default='ffmpeg,pyav', help='comma separated video editor backends')
+    parser.add_argument('--gop', type=int, default=10, help='seconds between keyframes of generated source')
+    parser.add_argument('--loops', type=int, default=8, help='number of fixture loops in generated source')
+    parser.add_argument('--amount', type=int, default=40, help='number of timeline thumbnails')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of every operation')
+    parser.add_argument('--file', default=None, help='video file to benchmark on')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(settings)
+    app.config['METADATA_CACHE_ENABLED'] = False
+
+    with tempfile.TemporaryDirectory() as path_dir:
+        path = args.file
+        if not path:
+            path = os.path.join(path_dir, 'long_gop.mp4')
+            make_long_gop(path, args.gop, args.loops)
+        with open(path, 'rb') as f:
+            stream = f.read()
+
+        with app.app_context():
+            editors = {name: get_video_editor(name) for name in args.editors.split(',')}
+            metadata, keyframe_index = next(iter(editors.values())).get_meta(stream, keyframe_index=True)
+            duration = metadata['duration']
+            timestamps = keyframe_index.timestamps
+            gop = max((b - a for a, b in zip(timestamps, timestamps[1:])), default=duration)
+            print(f"{os.path.basename(path)}: {metadata['width']}x{metadata['height']} {metadata['codec_name']}, "
+                  f"{duration}s, max GOP {gop:.1f}s, {args.repeat} runs, median ms")
+            print(f"{'operation':<40}" + ''.join(f'{name:>12}' for name in editors))
+
+            # a position at the end of a GOP is the worst case for accurate capture
+            position = min(duration - 1, timestamps[0] + gop * 0.9)
+            operations = []
+            for fast in (False, True):
+                mode = 'fast' if fast else 'accurate'
+                operations.extend((
+                    (f'capture_thumbnail {mode}', lambda editor, fast=fast: editor.capture_thumbnail(
+                        stream, 'sample.mp4', duration, position, fast=fast
+                    )),
+                    (f'capture_timeline_thumbnails x{args.amount} {mode}', lambda editor, fast=fast: list(
+                        editor.capture_timeline_thumbnails(stream, 'sample.mp4', duration, args.amount, fast=fast)
+                    )),
+                ))
+
+            for operation, run in operations:
+                timings = []
+                for editor in editors.values():
+                    runs = []
+                    for _ in range(args.repeat):
+                        start = perf_counter()
+                        run(editor)
+                        runs.append(perf_counter() - start)
+                    timings.append(statistics.median(runs) * 1000)
+                print(f'{operation:<40}' + ''.join(f'{timing:>12.1f}' for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
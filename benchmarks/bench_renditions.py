@@ -0,0 +1,73 @@
+"""
+Benchmark single-pass rendition ladder against encoding every rendition separately.
+
+Usage::
+
+    python benchmarks/bench_renditions.py --heights 720,480,360 --repeat 3
+
+Single pass decodes the video once and feeds every encoder from a `split` filter,
+separate encodes decode it once per rendition. Encoder settings are the same in both cases.
+"""
+import argparse
+import os
+import statistics
+from time import perf_counter
+
+from flask import Flask
+
+from videoserver import settings
+from videoserver.lib.video_editor import get_video_editor
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'storage', 'fixtures', 'sample_0.mp4')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--heights', default=None,
+                        help='comma separated rendition heights, RENDITION_LADDER heights by default')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs')
+    parser.add_argument('--file', default=FIXTURE_PATH, help='video file to benchmark on')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(settings)
+    app.config['METADATA_CACHE_ENABLED'] = False
+
+    with open(args.file, 'rb') as f:
+        stream = f.read()
+    filename = os.path.basename(args.file)
+
+    with app.app_context():
+        editor = get_video_editor('ffmpeg')
+        metadata = editor.get_meta(stream)
+        ladder = [rendition for rendition in app.config['RENDITION_LADDER']
+                  if rendition['height'] <= metadata['height']]
+        if args.heights:
+            heights = [int(height) for height in args.heights.split(',')]
+            bitrates = {rendition['height']: rendition['bitrate'] for rendition in app.config['RENDITION_LADDER']}
+            ladder = [{'height': height, 'bitrate': bitrates.get(height, 2000000)} for height in heights]
+
+        print(f"{filename}: {metadata['width']}x{metadata['height']} {metadata['codec_name']}, "
+              f"{metadata['duration']}s, renditions {', '.join(str(r['height']) for r in ladder)}, "
+              f"{args.repeat} runs, median s")
+
+        operations = (
+            ('single pass', lambda: editor.create_renditions(stream, filename, ladder)),
+            (f'{len(ladder)} separate encodes', lambda: [
+                editor.create_renditions(stream, filename, [rendition]) for rendition in ladder
+            ]),
+        )
+        timings = []
+        for operation, run in operations:
+            runs = []
+            for _ in range(args.repeat):
+                start = perf_counter()
+                run()
+                runs.append(perf_counter() - start)
+            timings.append(statistics.median(runs))
+            print(f'{operation:<24}{timings[-1]:>10.2f}')
+        print(f"{'speedup':<24}{timings[1] / timings[0]:>10.2f}x")
+
+
+if __name__ == '__main__':
+    main()
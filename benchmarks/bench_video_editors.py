@@ -0,0 +1,73 @@
+"""
+Benchmark video editor backends on the test fixtures.
+
+Usage::
+
+    python benchmarks/bench_video_editors.py --editors ffmpeg,pyav --repeat 5
+
+Metadata cache is disabled, so every call probes a file.
+"""
+import argparse
+import os
+import statistics
+from time import perf_counter
+
+from flask import Flask
+
+from videoserver import settings
+from videoserver.lib.video_editor import get_video_editor
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'storage', 'fixtures', 'sample_0.mp4')
+
+
+def get_operations(stream, metadata):
+    duration = metadata['duration']
+    return (
+        ('get_meta', lambda editor: editor.get_meta(stream)),
+        ('get_meta + keyframe index', lambda editor: editor.get_meta(stream, keyframe_index=True)),
+        ('capture_thumbnail', lambda editor: editor.capture_thumbnail(stream, 'sample.mp4', duration, duration / 3)),
+        ('capture_thumbnail crop+rotate', lambda editor: editor.capture_thumbnail(
+            stream, 'sample.mp4', duration, duration / 3,
+            crop={'width': 720, 'height': 360, 'x': 0, 'y': 0}, rotate=90
+        )),
+        ('capture_timeline_thumbnails x40', lambda editor: list(
+            editor.capture_timeline_thumbnails(stream, 'sample.mp4', duration, 40)
+        )),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--editors', default='ffmpeg,pyav', help='comma separated video editor backends')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of every operation')
+    parser.add_argument('--file', default=FIXTURE_PATH, help='video file to benchmark on')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(settings)
+    app.config['METADATA_CACHE_ENABLED'] = False
+
+    with open(args.file, 'rb') as f:
+        stream = f.read()
+
+    with app.app_context():
+        editors = {name: get_video_editor(name) for name in args.editors.split(',')}
+        metadata = next(iter(editors.values())).get_meta(stream)
+        print(f"{os.path.basename(args.file)}: {metadata['width']}x{metadata['height']} "
+              f"{metadata['codec_name']}, {metadata['duration']}s, {args.repeat} runs, median ms")
+        print(f"{'operation':<34}" + ''.join(f'{name:>12}' for name in editors))
+
+        for operation, run in get_operations(stream, metadata):
+            timings = []
+            for editor in editors.values():
+                runs = []
+                for _ in range(args.repeat):
+                    start = perf_counter()
+                    run(editor)
+                    runs.append(perf_counter() - start)
+                timings.append(statistics.median(runs) * 1000)
+            print(f'{operation:<34}' + ''.join(f'{timing:>12.1f}' for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
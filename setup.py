@@ -26,6 +26,14 @@ dev_requirements = (
     'tox-pyenv==1.1.0'
 )
 
+pyav_requirements = (
+    'av>=9.0',
+)
+
+waveform_requirements = (
+    'numpy>=1.16',
+)
+
 setup(
     name='videoserver',
     version='1.0.1',
@@ -50,7 +58,9 @@ setup(
     license='GPLv3',
     install_requires=requirements,
     extras_require={
-        'dev': dev_requirements
+        'dev': dev_requirements,
+        'pyav': pyav_requirements,
+        'waveform': waveform_requirements
     },
     packages=find_packages('src'),
     package_dir={'': 'src'},
@@ -18,6 +18,7 @@ from werkzeug.exceptions import HTTPException, default_exceptions
 
 from . import settings
 from .lib.logging import configure_logging
+from .lib.scratch import sweep_scratch
 from .lib.storage import get_media_storage
 from .celery_app import init_celery
 
@@ -79,6 +80,11 @@ def get_app(config=None):
 
     init_celery(app)
 
+    #: remove work files leaked by killed web and worker processes
+    if app.config.get('SCRATCH_SWEEP_ON_STARTUP'):
+        with app.app_context():
+            sweep_scratch()
+
     def make_json_error(ex):
         message = ex.description if hasattr(ex, 'description') else ex
 
@@ -1,25 +1,36 @@
 import copy
+import hashlib
+import json
 import logging
 import os
 import re
+import uuid
 from datetime import datetime
+from functools import reduce
 
 import bson
 from flask import current_app as app
-from flask import request
+from flask import make_response, request
 from pymongo import ReturnDocument
 from pymongo.errors import ServerSelectionTimeoutError
 from werkzeug.exceptions import BadRequest, Conflict, InternalServerError, NotFound
 
+from videoserver.lib.cache import cache_frame, frame_key, get_cached_frame
+from videoserver.lib.cost import estimate_edit_time, shortest_job_priority
 from videoserver.lib.video_editor import get_video_editor
+from videoserver.lib.video_editor.edits import apply_edit, compose_edits
+from videoserver.lib.video_editor.keyframes import snap_to_keyframes
 from videoserver.lib.views import MethodView
 from videoserver.lib.utils import (
-    add_urls, create_file_name, get_request_address, json_response, paginate, save_activity_log, storage2response,
-    validate_document
+    add_urls, create_file_name, get_keyframe_index, get_request_address, get_source_stream, json_response, media_url,
+    paginate, save_activity_log, save_keyframe_index, storage2response, validate_document
 )
 
 from . import bp
-from .tasks import edit_video, generate_preview_thumbnail, generate_timeline_thumbnails
+from .tasks import (_proxy_required, edit_video, generate_animated_thumbnail, generate_preview_candidates,
+                    generate_preview_thumbnail, generate_proxy,
+                    generate_renditions, generate_timeline_thumbnails, generate_waveform,
+                    package_stream)
 
 logger = logging.getLogger(__name__)
 
@@ -91,6 +102,10 @@ class ListUploadProject(MethodView):
                       size:
                         type: int
                         example: 14567890
+                      faststart:
+                        type: boolean
+                        description: mp4/mov `moov` box is at the beginning of the file, null for other formats
+                        example: True
                   url:
                     type: string
                     example: http://localhost:5050/projects/5cbd5acfe24f6045607e51aa/raw/video
@@ -112,6 +127,91 @@ class ListUploadProject(MethodView):
                   parent:
                     type: string
                     example: 5d2c8078fe985e7587b50de7
+                  proxy:
+                    type: object
+                    description: low resolution proxy of the video, null until it is created
+                    properties:
+                      url:
+                        type: string
+                        example: http://localhost:5050/projects/5cbd5acfe24f6045607e51aa/raw/proxy
+                      width:
+                        type: int
+                        example: 854
+                      height:
+                        type: int
+                        example: 480
+                      version:
+                        type: integer
+                        example: 1
+                  renditions:
+                    type: array
+                    description: adaptive bitrate renditions of the video, empty until they are created
+                    items:
+                      type: object
+                      properties:
+                        url:
+                          type: string
+                          example: http://localhost:5050/projects/5cbd5acfe24f6045607e51aa/raw/renditions/720
+                        height:
+                          type: int
+                          example: 720
+                        max_bitrate:
+                          type: int
+                          example: 2800000
+                        metadata:
+                          type: object
+                        version:
+                          type: integer
+                          example: 1
+                  streaming:
+                    type: object
+                    description: adaptive streaming playlists by format (hls, dash), empty until they are packaged
+                    properties:
+                      hls:
+                        type: object
+                        properties:
+                          url:
+                            type: string
+                            example: http://localhost:5050/projects/5cbd5acfe24f6045607e51aa/raw/hls/v1.m3u8
+                          playlist:
+                            type: string
+                            example: v1.m3u8
+                          version:
+                            type: integer
+                            example: 1
+                  waveform:
+                    type: object
+                    description: >
+                      audio min/max peaks, null until they are generated or if the video has no audio.
+                      Levels follow each other in one binary blob of interleaved min/max pairs,
+                      a level is fetched with `Range: bytes=<offset>-<offset + length * 2 * bits / 8 - 1>`
+                    properties:
+                      url:
+                        type: string
+                        example: http://localhost:5050/projects/5cbd5acfe24f6045607e51aa/raw/waveform
+                      sample_rate:
+                        type: int
+                        example: 8000
+                      bits:
+                        type: int
+                        example: 8
+                      levels:
+                        type: array
+                        items:
+                          type: object
+                          properties:
+                            samples_per_peak:
+                              type: int
+                              example: 64
+                            offset:
+                              type: int
+                              example: 0
+                            length:
+                              type: int
+                              example: 1875
+                      version:
+                        type: integer
+                        example: 1
                   processing:
                     type: object
                     properties:
@@ -143,10 +243,16 @@ class ListUploadProject(MethodView):
 
         # validate codec
         file_stream = document['file'].stream.read()
-        metadata = get_video_editor().get_meta(file_stream)
+        video_editor = get_video_editor()
+        metadata, keyframe_index = video_editor.get_meta(file_stream, keyframe_index=True)
         if metadata.get('codec_name') not in app.config.get('CODEC_SUPPORT_VIDEO'):
             raise BadRequest({'file': [f"Codec: '{metadata.get('codec_name')}' is not supported."]})
 
+        # `moov` at the end of mp4 makes players read the end of a file before playback starts
+        if metadata.get('faststart') is False:
+            file_stream = video_editor.faststart(file_stream, document['file'].filename)
+            metadata, keyframe_index = video_editor.get_meta(file_stream, keyframe_index=True)
+
         # add record to database
         project = {
             '_id': bson.ObjectId(),
@@ -159,6 +265,11 @@ class ListUploadProject(MethodView):
             'original_filename': document['file'].filename,
             'version': 1,
             'parent': None,
+            'proxy': None,
+            'renditions': [],
+            'streaming': {},
+            'waveform': None,
+            'edits': [],
             'processing': {
                 'video': False,
                 'thumbnail_preview': False,
@@ -183,6 +294,7 @@ class ListUploadProject(MethodView):
         try:
             # save project
             app.mongo.db.projects.insert_one(project)
+            save_keyframe_index(project['_id'], project['version'], keyframe_index)
         except ServerSelectionTimeoutError as e:
             # delete project dir
             app.fs.delete_dir(storage_id)
@@ -190,6 +302,14 @@ class ListUploadProject(MethodView):
 
         logger.info(f"New project was created. ID: {project['_id']}")
         save_activity_log('UPLOAD', project['_id'], project)
+        if _proxy_required(project):
+            generate_proxy.delay(project)
+        if app.config.get('RENDITIONS_ENABLED'):
+            generate_renditions.delay(project)
+        if app.config.get('STREAMING_FORMATS'):
+            package_stream.delay(project)
+        if app.config.get('WAVEFORM_ENABLED'):
+            generate_waveform.delay(project)
         add_urls(project)
 
         return json_response(project, status=201)
@@ -331,7 +451,10 @@ class ListUploadProject(MethodView):
         )
 
 
-class RetrieveEditDestroyProject(MethodView):
+class EditRulesMethodView(MethodView):
+    """
+    Validate edit rules of a project's video
+    """
 
     @property
     def schema_edit(self):
@@ -343,6 +466,12 @@ class RetrieveEditDestroyProject(MethodView):
                 'min_trim_start': 0,
                 'min_trim_end': 1
             },
+            'trim_mode': {
+                'type': 'string',
+                'required': False,
+                'allowed': ['accurate', 'copy', 'smart'],
+                'dependencies': ['trim']
+            },
             'rotate': {
                 'type': 'integer',
                 'required': False,
@@ -360,9 +489,115 @@ class RetrieveEditDestroyProject(MethodView):
                 'coerce': 'crop_to_dict',
                 'allow_crop_width': [app.config.get('MIN_VIDEO_WIDTH'), app.config.get('MAX_VIDEO_WIDTH')],
                 'allow_crop_height': [app.config.get('MIN_VIDEO_HEIGHT'), app.config.get('MAX_VIDEO_HEIGHT')]
+            },
+            'encoding_tier': {
+                'type': 'string',
+                'required': False,
+                'allowed': list(app.config.get('ENCODING_TIERS'))
             }
         }
 
+    def _get_edits_metadata(self):
+        """
+        Get metadata of project's video as it will be after pending edits are rendered
+        :return: metadata
+        :rtype: dict
+        """
+
+        return reduce(apply_edit, self.project.get('edits', []), self.project['metadata'])
+
+    def _get_edit_document(self, schema):
+        """
+        Validate edit rules from request's json against project's video with pending edits applied
+        :param schema: validation schema, `schema_edit` or its extension
+        :type schema: dict
+        :return: validated edit rules, trim is aligned to keyframes if `trim_mode` is `copy`
+                 and there are no pending edits, otherwise it is aligned when edits are rendered
+        :rtype: dict
+        :raise: `BadRequest` if edit rules are not valid
+        """
+
+        request_json = request.get_json()
+        document = validate_document(
+            request_json if request_json else {},
+            schema
+        )
+
+        # trim mode and encoding tier are not edits by themselves
+        if not any(rule in document for rule in ('trim', 'crop', 'rotate', 'scale')):
+            raise BadRequest({
+                'edit': [f"At least one of the edit rules is required. "
+                         f"Available edit rules are: {', '.join(self.schema_edit.keys())}"]
+            })
+
+        metadata = self._get_edits_metadata()
+
+        # validate trim
+        if 'trim' in document:
+            if document['trim']['start'] >= document['trim']['end']:
+                raise BadRequest({"trim": ["'start' value must be less than 'end' value"]})
+            elif (document['trim']['end'] - document['trim']['start'] < app.config.get('MIN_TRIM_DURATION')) \
+                    or (metadata['duration'] - document['trim']['start'] < app.config.get('MIN_TRIM_DURATION')):
+                raise BadRequest({"trim": [
+                    f"Trimmed video duration must be at least {app.config.get('MIN_TRIM_DURATION')} seconds"
+                ]})
+            elif document['trim']['end'] > metadata['duration']:
+                document['trim']['end'] = metadata['duration']
+                logger.info(
+                    f"Trimmed video endtime is greater than video duration, update it to equal duration, "
+                    f"ID: {self.project['_id']}")
+            elif document['trim']['start'] == 0 and document['trim']['end'] == metadata['duration']:
+                raise BadRequest({"trim": ["'end' value of trim is duplicating an entire video"]})
+        # validate crop
+        if 'crop' in document:
+            if metadata['width'] - document['crop']['x'] < app.config.get('MIN_VIDEO_WIDTH'):
+                raise BadRequest({"crop": ["x is less than minimum allowed crop width"]})
+            elif metadata['height'] - document['crop']['y'] < app.config.get('MIN_VIDEO_HEIGHT'):
+                raise BadRequest({"crop": ["y is less than minimum allowed crop height"]})
+            elif document['crop']['x'] + document['crop']['width'] > metadata['width']:
+                raise BadRequest({"crop": ["width of crop's frame is outside a video's frame"]})
+            elif document['crop']['y'] + document['crop']['height'] > metadata['height']:
+                raise BadRequest({"crop": ["height of crop's frame is outside a video's frame"]})
+        # validate scale
+        if 'scale' in document:
+            width = metadata['width']
+            if 'crop' in document:
+                width = document['crop']['width']
+            if document['scale'] == width:
+                raise BadRequest({"trim": ["video and crop option have exactly the same width"]})
+            elif not app.config.get('ALLOW_INTERPOLATION') and document['scale'] > width:
+                raise BadRequest({"trim": ["interpolation of pixels is not allowed"]})
+            elif app.config.get('ALLOW_INTERPOLATION') \
+                    and document['scale'] > width \
+                    and width >= app.config.get('INTERPOLATION_LIMIT'):
+                raise BadRequest({"trim": [
+                    f"interpolation is permitted only for videos which have width less than "
+                    f"{app.config.get('INTERPOLATION_LIMIT')}px"
+                ]})
+        # validate trim mode
+        if 'trim' in document:
+            has_filters = any(rule in document for rule in ('crop', 'rotate', 'scale'))
+            if 'trim_mode' not in document:
+                document['trim_mode'] = 'accurate' if has_filters else app.config.get('DEFAULT_TRIM_MODE')
+            elif document['trim_mode'] != 'accurate' and has_filters:
+                raise BadRequest({"trim_mode": [
+                    f"'{document['trim_mode']}' trim mode can't be combined with crop, rotate or scale"
+                ]})
+
+            if document['trim_mode'] == 'copy' and not self.project.get('edits'):
+                start, end = snap_to_keyframes(
+                    get_keyframe_index(self.project).timestamps,
+                    document['trim']['start'], document['trim']['end'], metadata['duration']
+                )
+                if start == 0 and end == metadata['duration']:
+                    raise BadRequest({"trim": ["keyframe aligned trim is duplicating an entire video"]})
+                document['trim'] = {'start': start, 'end': end}
+
+        return document
+
+
+class RetrieveEditDestroyProject(EditRulesMethodView):
+
     def get(self, project_id):
         """
         Retrieve project details
@@ -448,6 +683,40 @@ class RetrieveEditDestroyProject(MethodView):
                       video:
                         type: boolean
                         example: False
+                      video_progress:
+                        type: object
+                        description: Present only while video is processing
+                        properties:
+                          percent:
+                            type: float
+                            example: 42.5
+                          eta:
+                            type: float
+                            description: Estimated seconds left
+                            example: 12.3
+                          speed:
+                            type: float
+                            description: Encoding speed relative to realtime
+                            example: 2.1
+                          fps:
+                            type: float
+                            example: 52.4
+                          update_time:
+                            type: string
+                            example: 2019-07-02T15:02:32+00:00
+                      video_estimate:
+                        type: object
+                        description: Estimated editing time, present only while video is processing
+                        properties:
+                          seconds:
+                            type: float
+                            example: 12.5
+                          samples:
+                            type: integer
+                            example: 50
+                          start_time:
+                            type: string
+                            example: 2019-07-02T15:02:32+00:00
                       thumbnail_preview:
                         type: boolean
                         example: False
@@ -490,6 +759,12 @@ class RetrieveEditDestroyProject(MethodView):
               trim:
                 type: string
                 example: 5.1,10.5
+              trim_mode:
+                type: string
+                enum: [accurate, copy, smart]
+                example: smart
+                description: '`copy` cuts video without re-encoding, trim is snapped to the closest keyframes.
+                              `smart` re-encodes only GOPs at the cut points.'
               crop:
                 type: string
                 example: 480,360,10,10
@@ -500,6 +775,12 @@ class RetrieveEditDestroyProject(MethodView):
               scale:
                 type: integer
                 example: 800
+              encoding_tier:
+                type: string
+                enum: [draft, standard, archive]
+                example: draft
+                description: '`draft` encodes several times faster at the cost of a bigger file,
+                              `archive` encodes slower and keeps the best quality.'
         responses:
           202:
             description: Editing started
@@ -509,6 +790,27 @@ class RetrieveEditDestroyProject(MethodView):
                 processing:
                   type: boolean
                   example: True
+                estimate:
+                  type: object
+                  description: Estimated editing time
+                  properties:
+                    seconds:
+                      type: float
+                      example: 12.5
+                    samples:
+                      type: integer
+                      description: Number of finished edits the estimate is calibrated by, 0 for defaults
+                      example: 50
+                trim:
+                  type: object
+                  description: Keyframe aligned trim, returned only when `trim_mode` is `copy`
+                  properties:
+                    start:
+                      type: float
+                      example: 4.0
+                    end:
+                      type: float
+                      example: 12.0
           409:
             description: Previous editing was not finished yet
             schema:
@@ -526,79 +828,27 @@ class RetrieveEditDestroyProject(MethodView):
         if self.project['version'] == 1:
             raise BadRequest({"project_id": ["Video with version 1 is not editable, use duplicated project instead."]})
 
-        request_json = request.get_json()
-        document = validate_document(
-            request_json if request_json else {},
-            self.schema_edit
-        )
-
-        if not document:
-            raise BadRequest({
-                'edit': [f"At least one of the edit rules is required. "
-                         f"Available edit rules are: {', '.join(self.schema_edit.keys())}"]
-            })
-
-        metadata = self.project['metadata']
-
-        # validate trim
-        if 'trim' in document:
-            if document['trim']['start'] >= document['trim']['end']:
-                raise BadRequest({"trim": ["'start' value must be less than 'end' value"]})
-            elif (document['trim']['end'] - document['trim']['start'] < app.config.get('MIN_TRIM_DURATION')) \
-                    or (metadata['duration'] - document['trim']['start'] < app.config.get('MIN_TRIM_DURATION')):
-                raise BadRequest({"trim": [
-                    f"Trimmed video duration must be at least {app.config.get('MIN_TRIM_DURATION')} seconds"
-                ]})
-            elif document['trim']['end'] > metadata['duration']:
-                document['trim']['end'] = metadata['duration']
-                logger.info(
-                    f"Trimmed video endtime is greater than video duration, update it to equal duration, "
-                    f"ID: {self.project['_id']}")
-            elif document['trim']['start'] == 0 and document['trim']['end'] == metadata['duration']:
-                raise BadRequest({"trim": ["'end' value of trim is duplicating an entire video"]})
-        # validate crop
-        if 'crop' in document:
-            if metadata['width'] - document['crop']['x'] < app.config.get('MIN_VIDEO_WIDTH'):
-                raise BadRequest({"crop": ["x is less than minimum allowed crop width"]})
-            elif metadata['height'] - document['crop']['y'] < app.config.get('MIN_VIDEO_HEIGHT'):
-                raise BadRequest({"crop": ["y is less than minimum allowed crop height"]})
-            elif document['crop']['x'] + document['crop']['width'] > metadata['width']:
-                raise BadRequest({"crop": ["width of crop's frame is outside a video's frame"]})
-            elif document['crop']['y'] + document['crop']['height'] > metadata['height']:
-                raise BadRequest({"crop": ["height of crop's frame is outside a video's frame"]})
-        # validate scale
-        if 'scale' in document:
-            width = metadata['width']
-            if 'crop' in document:
-                width = document['crop']['width']
-            if document['scale'] == width:
-                raise BadRequest({"trim": ["video and crop option have exactly the same width"]})
-            elif not app.config.get('ALLOW_INTERPOLATION') and document['scale'] > width:
-                raise BadRequest({"trim": ["interpolation of pixels is not allowed"]})
-            elif app.config.get('ALLOW_INTERPOLATION') \
-                    and document['scale'] > width \
-                    and width >= app.config.get('INTERPOLATION_LIMIT'):
-                raise BadRequest({"trim": [
-                    f"interpolation is permitted only for videos which have width less than "
-                    f"{app.config.get('INTERPOLATION_LIMIT')}px"
-                ]})
+        document = self._get_edit_document(self.schema_edit)
+        response = {"processing": True}
+        if document.get('trim_mode') == 'copy' and not self.project.get('edits'):
+            response['trim'] = document['trim']
 
-        # set processing flag
+        # set processing flag, edit is rendered along with pending edits
         self.project = app.mongo.db.projects.find_one_and_update(
             {'_id': self.project['_id']},
-            {'$set': {'processing.video': True}},
+            {
+                '$set': {'processing.video': True},
+                '$push': {'edits': {'id': uuid.uuid4().hex, **document}},
+            },
             return_document=ReturnDocument.AFTER
         )
         logger.info(f"New project editing task was started. ID: {self.project['_id']}")
         save_activity_log("EDIT", self.project['_id'], document)
 
         # run task
-        edit_video.delay(
-            self.project,
-            changes=document
-        )
+        response['estimate'] = _dispatch_edit(self.project, _get_changes(self.project, self.project['edits']))
 
-        return json_response({"processing": True}, status=202)
+        return json_response(response, status=202)
 
     def delete(self, project_id):
         """
@@ -620,65 +870,471 @@ class RetrieveEditDestroyProject(MethodView):
         logger.info(f"Project was deleted. ID: {self.project['_id']}")
         save_activity_log("DELETE", self.project['_id'])
         app.mongo.db.projects.delete_one({'_id': self.project['_id']})
+        app.mongo.db.keyframes.delete_one({'_id': self.project['_id']})
+        app.mongo.db.scenes.delete_one({'_id': self.project['_id']})
+        app.mongo.db.edit_previews.delete_many({'project_id': self.project['_id']})
+        app.mongo.db.streaming.delete_many({'project_id': self.project['_id']})
+        app.mongo.db.frame_cache.delete_many({'project_id': self.project['_id']})
 
         return json_response(status=204)
 
 
-class DuplicateProject(MethodView):
+class PreviewEditProject(EditRulesMethodView):
 
     def post(self, project_id):
         """
-        Duplicate project
+        Render a low resolution preview of project's video with edit rules applied, video is not changed.
+        Preview is a short sample from the beginning of edited video, or a single frame if `position` is set.
+        Previews are cached by edit rules until the next edit of the video.
         ---
+        consumes:
+        - application/json
         parameters:
-            - name: project_id
-              in: path
-              type: string
-              required: true
-              description: Unique project id
+        - in: path
+          name: project_id
+          type: string
+          required: True
+          description: Unique project id
+        - in: body
+          name: action
+          description: Edit rules, the same as for editing, and an optional position of a frame
+          required: True
+          schema:
+            type: object
+            properties:
+              trim:
+                type: string
+                example: 5.1,10.5
+              trim_mode:
+                type: string
+                enum: [accurate, copy, smart]
+                example: copy
+              crop:
+                type: string
+                example: 480,360,10,10
+              rotate:
+                type: integer
+                enum: [-270, -180, -90, 90, 180, 270]
+                example: 90
+              scale:
+                type: integer
+                example: 800
+              position:
+                type: float
+                example: 1.5
+                description: position of a frame in edited video
         responses:
-          201:
-            description: Project was duplicated
+          200:
+            description: Edit preview
             schema:
-                type: object
-                properties:
-                  _id:
-                    type: string
-                    example: 5cbd5acfe24f6045607e51aa
-                  filename:
-                    type: string
-                    example: fa5079a38e0a4197864aa2ccb07f3bea.mp4
-                  storage_id:
-                    type: string
-                    example: 2019/7/2/5cbd5acfe24f6045607e51aa/9c8e970807104c848afceea44fa07d1a.mp4
-                  metadata:
-                    type: object
-                    properties:
-                      codec_name:
-                        type: string
-                        example: h264
-                      codec_long_name:
-                        type: string
-                        example: H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10
-                      width:
-                        type: int
-                        example: 640
-                      height:
-                        type: int
-                        example: 360
-                      duration:
-                        type: float
-                        example: 300.014000
-                      bit_rate:
-                        type: int
-                        example: 287654
-                      nb_frames:
-                        type: int
-                        example: 7654
-                      r_frame_rate:
-                        type: string
-                        example: 24/1
-                      format_name:
+              type: object
+              properties:
+                url:
+                  type: string
+                  example: http://localhost:5050/projects/5cbd5acfe24f6045607e51aa/raw/edit_preview/8a1c...
+                mimetype:
+                  type: string
+                  example: video/mp4
+                width:
+                  type: integer
+                  example: 426
+                height:
+                  type: integer
+                  example: 240
+                duration:
+                  type: float
+                  example: 3.0
+          409:
+            description: Previous editing was not finished yet
+            schema:
+              type: object
+              properties:
+                processing:
+                  type: array
+                  example:
+                    - Task edit video is still processing
+        """
+
+        if self.project['processing']['video']:
+            raise Conflict({"processing": ["Task edit video is still processing"]})
+
+        document = self._get_edit_document({
+            **self.schema_edit,
+            'position': {
+                'type': 'number',
+                'min': 0,
+                'required': False
+            }
+        })
+        position = document.pop('position', None)
+        if position is not None and position >= apply_edit(self._get_edits_metadata(), document)['duration']:
+            raise BadRequest({"position": ["position is outside of edited video"]})
+
+        # preview shows the edit on top of pending edits
+        changes = _get_changes(self.project, [*self.project.get('edits', []), document])
+        # preview is always encoded fast
+        changes.pop('trim_mode', None)
+        changes.pop('encoding_tier', None)
+        key = hashlib.sha256(json.dumps({
+            'project_id': str(self.project['_id']),
+            'version': self.project['version'],
+            'changes': changes,
+            'position': position
+        }, sort_keys=True).encode()).hexdigest()
+        preview = app.mongo.db.edit_previews.find_one({'_id': key})
+        if not preview:
+            preview = self._render_preview(key, changes, position)
+            logger.info(f"Rendered edit preview {key} in project {self.project['_id']}")
+
+        preview['url'] = media_url('projects.get_raw_edit_preview', project_id=self.project['_id'], preview_id=key)
+        return json_response(preview)
+
+    def _render_preview(self, key, changes, position):
+        """
+        Render edit preview and save it into `edit_previews` collection and a storage.
+        Proxy is rendered instead of the original video if it is up to date, edit rules are scaled to its size.
+        :param key: preview's cache key
+        :type key: str
+        :param changes: composed edits, see `compose_edits`
+        :type changes: dict
+        :param position: position of a frame in edited video, None for a sample
+        :type position: float
+        :return: preview doc
+        :rtype: dict
+        """
+
+        storage_id = self.project['storage_id']
+        proxy = self.project.get('proxy')
+        if proxy and proxy['version'] == self.project['version']:
+            storage_id = proxy['storage_id']
+            factor = proxy['height'] / self.project['metadata']['height']
+            filters = []
+            for rules in changes.get('filters', []):
+                rules = dict(rules)
+                if 'crop' in rules:
+                    rules['crop'] = {name: int(value * factor) for name, value in rules['crop'].items()}
+                if 'scale' in rules:
+                    rules['scale'] = int(rules['scale'] * factor)
+                filters.append(rules)
+            changes = dict(changes, filters=filters)
+
+        video_editor = get_video_editor()
+        content, metadata = video_editor.preview_edit(
+            stream_file=app.fs.get(storage_id),
+            filename=self.project['filename'],
+            height=app.config.get('EDIT_PREVIEW_HEIGHT'),
+            duration=app.config.get('EDIT_PREVIEW_DURATION'),
+            position=position,
+            **changes
+        )
+        extension = 'png' if metadata['mimetype'] == 'image/png' else 'mp4'
+        preview = {
+            '_id': key,
+            'project_id': self.project['_id'],
+            'version': self.project['version'],
+            'storage_id': app.fs.put(
+                content=content,
+                filename=f'{key}.{extension}',
+                project_id=None,
+                asset_type='edit_previews',
+                storage_id=self.project['storage_id'],
+                content_type=metadata['mimetype']
+            ),
+            'mimetype': metadata['mimetype'],
+            'width': metadata['width'],
+            'height': metadata['height'],
+            'duration': metadata['duration'],
+            'size': metadata['size'],
+        }
+        # the same preview could be rendered by a concurrent request
+        app.mongo.db.edit_previews.replace_one({'_id': key}, preview, upsert=True)
+
+        return preview
+
+
+class CreateDestroyEdits(EditRulesMethodView):
+
+    def post(self, project_id):
+        """
+        Add an edit to project's pending edits, video is not rendered.
+        Pending edits are rendered in one pass on the first access to the video or thumbnails,
+        or when rendering is requested explicitly. Edits can be added while video is rendering.
+        ---
+        consumes:
+        - application/json
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+          description: Unique project id
+        - in: body
+          name: action
+          description: Changes to apply for the video with pending edits applied, the same as for editing
+          required: True
+          schema:
+            type: object
+            properties:
+              trim:
+                type: string
+                example: 5.1,10.5
+              trim_mode:
+                type: string
+                enum: [accurate, copy, smart]
+                example: smart
+              crop:
+                type: string
+                example: 480,360,10,10
+              rotate:
+                type: integer
+                enum: [-270, -180, -90, 90, 180, 270]
+                example: 90
+              scale:
+                type: integer
+                example: 800
+              encoding_tier:
+                type: string
+                enum: [draft, standard, archive]
+                example: draft
+        responses:
+          201:
+            description: Edit was added
+            schema:
+              type: object
+              properties:
+                edits:
+                  type: array
+                  description: pending edits in order they were added
+                metadata:
+                  type: object
+                  description: metadata of video as it will be after pending edits are rendered
+        """
+
+        if self.project['version'] == 1:
+            raise BadRequest({"project_id": ["Video with version 1 is not editable, use duplicated project instead."]})
+
+        document = self._get_edit_document(self.schema_edit)
+        self.project = app.mongo.db.projects.find_one_and_update(
+            {'_id': self.project['_id']},
+            {'$push': {'edits': {'id': uuid.uuid4().hex, **document}}},
+            return_document=ReturnDocument.AFTER
+        )
+        logger.info(f"New edit was added to project. ID: {self.project['_id']}")
+        save_activity_log("EDIT", self.project['_id'], document)
+
+        return json_response({
+            'edits': self.project['edits'],
+            'metadata': self._get_edits_metadata()
+        }, status=201)
+
+    def delete(self, project_id):
+        """
+        Discard pending edits, edits which are rendering already are applied anyway.
+        ---
+        parameters:
+        - name: project_id
+          in: path
+          type: string
+          required: true
+          description: Unique project id
+        responses:
+          204:
+            description: NO CONTENT
+        """
+
+        app.mongo.db.projects.update_one({'_id': self.project['_id']}, {'$set': {'edits': []}})
+        logger.info(f"Pending edits were discarded. ID: {self.project['_id']}")
+
+        return json_response(status=204)
+
+
+class RenderProject(MethodView):
+
+    def post(self, project_id):
+        """
+        Render project's pending edits in one pass
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+          description: Unique project id
+        responses:
+          202:
+            description: Rendering started
+            schema:
+              type: object
+              properties:
+                processing:
+                  type: boolean
+                  example: True
+                estimate:
+                  type: object
+                  description: Estimated editing time
+                  properties:
+                    seconds:
+                      type: float
+                      example: 12.5
+                    samples:
+                      type: integer
+                      description: Number of finished edits the estimate is calibrated by, 0 for defaults
+                      example: 50
+          400:
+            description: There are no pending edits
+          409:
+            description: Previous editing was not finished yet
+            schema:
+              type: object
+              properties:
+                processing:
+                  type: array
+                  example:
+                    - Task edit video is still processing
+        """
+
+        if self.project['processing']['video']:
+            raise Conflict({"processing": ["Task edit video is still processing"]})
+
+        if not self.project.get('edits'):
+            raise BadRequest({"edits": ["There are no pending edits to render"]})
+
+        estimate = _render_edits(self.project)
+        if not estimate:
+            raise Conflict({"processing": ["Task edit video is still processing"]})
+
+        return json_response({"processing": True, "estimate": estimate}, status=202)
+
+
+def _get_changes(project, edits):
+    """
+    Compose edits into changes for `edit_video`, composed `copy` trim is aligned to keyframes
+    :param project: project doc
+    :type project: dict
+    :param edits: edits to compose
+    :type edits: list
+    :return: changes
+    :rtype: dict
+    """
+
+    changes = compose_edits(edits)
+    if changes.get('trim_mode') == 'copy':
+        start, end = snap_to_keyframes(
+            get_keyframe_index(project).timestamps,
+            changes['trim']['start'], changes['trim']['end'], project['metadata']['duration']
+        )
+        changes['trim'] = {'start': start, 'end': end}
+
+    return changes
+
+
+def _render_edits(project):
+    """
+    Start `edit_video` task for project's pending edits, unless video is processing already
+    :param project: project doc
+    :type project: dict
+    :return: estimated editing time if rendering was started, see `estimate_edit_time`
+    :rtype: dict
+    """
+
+    if not project.get('edits'):
+        return None
+
+    # set processing flag
+    project = app.mongo.db.projects.find_one_and_update(
+        {'_id': project['_id'], 'processing.video': False, 'edits.0': {'$exists': True}},
+        {'$set': {'processing.video': True}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not project:
+        return None
+
+    logger.info(f"Rendering of {len(project['edits'])} pending edits was started. ID: {project['_id']}")
+    return _dispatch_edit(project, _get_changes(project, project['edits']))
+
+
+def _dispatch_edit(project, changes):
+    """
+    Start `edit_video` task and save its estimated time into project's `processing.video_estimate`.
+    Shorter edits get higher celery priority if `EDIT_PRIORITY_LEVELS` is set.
+    :param project: project doc
+    :type project: dict
+    :param changes: changes for `edit_video`
+    :type changes: dict
+    :return: estimated editing time, see `estimate_edit_time`
+    :rtype: dict
+    """
+
+    estimate = estimate_edit_time(project['metadata'], changes)
+    app.mongo.db.projects.update_one(
+        {'_id': project['_id'], 'processing.video': True},
+        {'$set': {'processing.video_estimate': {**estimate, 'start_time': datetime.utcnow()}}}
+    )
+
+    options = {}
+    levels = app.config.get('EDIT_PRIORITY_LEVELS')
+    if levels:
+        options['priority'] = shortest_job_priority(estimate['seconds'], levels)
+    edit_video.apply_async((project,), {'changes': changes}, **options)
+
+    return estimate
+
+
+class DuplicateProject(MethodView):
+
+    def post(self, project_id):
+        """
+        Duplicate project
+        ---
+        parameters:
+            - name: project_id
+              in: path
+              type: string
+              required: true
+              description: Unique project id
+        responses:
+          201:
+            description: Project was duplicated
+            schema:
+                type: object
+                properties:
+                  _id:
+                    type: string
+                    example: 5cbd5acfe24f6045607e51aa
+                  filename:
+                    type: string
+                    example: fa5079a38e0a4197864aa2ccb07f3bea.mp4
+                  storage_id:
+                    type: string
+                    example: 2019/7/2/5cbd5acfe24f6045607e51aa/9c8e970807104c848afceea44fa07d1a.mp4
+                  metadata:
+                    type: object
+                    properties:
+                      codec_name:
+                        type: string
+                        example: h264
+                      codec_long_name:
+                        type: string
+                        example: H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10
+                      width:
+                        type: int
+                        example: 640
+                      height:
+                        type: int
+                        example: 360
+                      duration:
+                        type: float
+                        example: 300.014000
+                      bit_rate:
+                        type: int
+                        example: 287654
+                      nb_frames:
+                        type: int
+                        example: 7654
+                      r_frame_rate:
+                        type: string
+                        example: 24/1
+                      format_name:
                         type: string
                         example: mov,mp4,m4a,3gp,3g2,mj2
                       size:
@@ -751,6 +1407,10 @@ class DuplicateProject(MethodView):
             'timeline': [],
             'preview': {}
         }
+        child_project['proxy'] = None
+        child_project['renditions'] = []
+        child_project['streaming'] = {}
+        child_project['waveform'] = None
         app.mongo.db.projects.insert_one(child_project)
 
         # put a video file stream into storage
@@ -773,6 +1433,8 @@ class DuplicateProject(MethodView):
                 {'$set': {'storage_id': storage_id}},
                 return_document=ReturnDocument.AFTER
             )
+            # video file is copied as is, so is its keyframe index
+            save_keyframe_index(child_project['_id'], child_project['version'], get_keyframe_index(self.project))
 
             # save preview thumbnail
             if self.project['thumbnails']['preview']:
@@ -795,6 +1457,75 @@ class DuplicateProject(MethodView):
                     return_document=ReturnDocument.AFTER
                 )
 
+            # save proxy if it is up to date
+            proxy = self.project.get('proxy')
+            if proxy and proxy['version'] == self.project['version']:
+                filename = proxy['filename'].replace(f"_v{proxy['version']}.", f"_v{child_project['version']}.")
+                storage_id = app.fs.put(
+                    content=app.fs.get(proxy['storage_id']),
+                    filename=filename,
+                    project_id=None,
+                    asset_type='proxy',
+                    storage_id=child_project['storage_id'],
+                    content_type=proxy['mimetype']
+                )
+                child_project = app.mongo.db.projects.find_one_and_update(
+                    {'_id': child_project['_id']},
+                    {"$set": {
+                        'proxy': dict(proxy, filename=filename, storage_id=storage_id,
+                                      version=child_project['version'])
+                    }},
+                    return_document=ReturnDocument.AFTER
+                )
+
+            # save waveform if it is up to date
+            waveform = self.project.get('waveform')
+            if waveform and waveform['version'] == self.project['version']:
+                filename = waveform['filename'].replace(
+                    f"_v{waveform['version']}.", f"_v{child_project['version']}."
+                )
+                storage_id = app.fs.put(
+                    content=app.fs.get(waveform['storage_id']),
+                    filename=filename,
+                    project_id=None,
+                    asset_type='waveform',
+                    storage_id=child_project['storage_id'],
+                    content_type=waveform['mimetype']
+                )
+                child_project = app.mongo.db.projects.find_one_and_update(
+                    {'_id': child_project['_id']},
+                    {"$set": {
+                        'waveform': dict(waveform, filename=filename, storage_id=storage_id,
+                                         version=child_project['version'])
+                    }},
+                    return_document=ReturnDocument.AFTER
+                )
+
+            # save renditions if they are up to date
+            renditions = []
+            for rendition in self.project.get('renditions', []):
+                if rendition['version'] != self.project['version']:
+                    continue
+                filename = rendition['filename'].replace(
+                    f"_v{rendition['version']}.", f"_v{child_project['version']}."
+                )
+                storage_id = app.fs.put(
+                    content=app.fs.get(rendition['storage_id']),
+                    filename=filename,
+                    project_id=None,
+                    asset_type='renditions',
+                    storage_id=child_project['storage_id'],
+                    content_type=rendition['mimetype']
+                )
+                renditions.append(dict(rendition, filename=filename, storage_id=storage_id,
+                                       version=child_project['version']))
+            if renditions:
+                child_project = app.mongo.db.projects.find_one_and_update(
+                    {'_id': child_project['_id']},
+                    {"$set": {'renditions': renditions}},
+                    return_document=ReturnDocument.AFTER
+                )
+
             # save timeline thumbnails
             timeline_thumbnails = []
             for thumbnail in self.project['thumbnails']['timeline']:
@@ -814,11 +1545,15 @@ class DuplicateProject(MethodView):
                     'height': thumbnail['height'],
                     'size': thumbnail['size']
                 })
+                if 'position' in thumbnail:
+                    timeline_thumbnails[-1]['position'] = thumbnail['position']
             if timeline_thumbnails:
+                timeline_options = self.project['thumbnails'].get('timeline_options')
                 child_project = app.mongo.db.projects.find_one_and_update(
                     {'_id': child_project['_id']},
                     {"$set": {
-                        'thumbnails.timeline': timeline_thumbnails
+                        'thumbnails.timeline': timeline_thumbnails,
+                        **({'thumbnails.timeline_options': timeline_options} if timeline_options else {}),
                     }},
                     return_document=ReturnDocument.AFTER
                 )
@@ -826,12 +1561,15 @@ class DuplicateProject(MethodView):
         except Exception as e:
             # delete child_project dir
             app.fs.delete_dir(storage_id)
-            # remove record from db
+            # remove records from db
             app.mongo.db.projects.delete_one({'_id': child_project['_id']})
+            app.mongo.db.keyframes.delete_one({'_id': child_project['_id']})
             raise InternalServerError(str(e))
 
         logger.info(f"Project was duplicated. Parent ID: {self.project['_id']}. Child ID: {child_project['_id']}")
         save_activity_log('DUPLICATE', self.project['_id'], child_project)
+        if app.config.get('STREAMING_FORMATS'):
+            package_stream.delay(child_project)
         add_urls(child_project)
 
         return json_response(child_project, status=201)
@@ -865,7 +1603,11 @@ class RetrieveOrCreateThumbnails(MethodView):
                     {
                         'allowed': ['preview'],
                         'dependencies': ['position'],
-                        'excludes': 'amount',
+                        'excludes': ['amount', 'mode'],
+                    },
+                    {
+                        'allowed': ['animated'],
+                        'excludes': ['amount', 'mode', 'position', 'crop', 'rotate', 'capture_mode'],
                     }
                 ],
             },
@@ -874,6 +1616,14 @@ class RetrieveOrCreateThumbnails(MethodView):
                 'coerce': int,
                 'min': 1,
             },
+            'mode': {
+                'type': 'string',
+                'allowed': ['interval', 'scenes'],
+            },
+            'capture_mode': {
+                'type': 'string',
+                'allowed': app.config.get('CAPTURE_MODES'),
+            },
             'position': {
                 'type': 'float',
                 'coerce': float,
@@ -898,6 +1648,7 @@ class RetrieveOrCreateThumbnails(MethodView):
         Get or create thumbnail for preview or thumbnails for timeline.
         If `type` is `timeline` - return a list of thumbnails for timeline or start task to generate thumbnails.
         If `type` is `preview` - return a preview thumbnail or start task to generate it.
+        If `type` is `animated` - return an animated WebP thumbnail or start task to generate it.
         ---
         parameters:
         - in: path
@@ -908,11 +1659,25 @@ class RetrieveOrCreateThumbnails(MethodView):
         - name: type
           in: query
           type: string
-          enum: [preview, timeline]
+          enum: [preview, timeline, animated]
         - name: amount
           in: query
           type: integer
           description: Amount of thumbnails to generate for a timeline. Used only when `type` is `timeline`.
+        - name: mode
+          in: query
+          type: string
+          enum: [interval, scenes]
+          default: interval
+          description: Capture timeline thumbnails at fixed intervals, or at up to `amount` most distinct scene changes.
+                       Used only when `type` is `timeline`.
+        - name: capture_mode
+          in: query
+          type: string
+          enum: [accurate, fast]
+          description: '`fast` captures keyframes at or before positions, it is much faster for long GOP videos.
+                        `DEFAULT_CAPTURE_MODE` if not set. Used only when `type` is `preview`,
+                        or `timeline` in `interval` mode.'
         - name: position
           in: query
           type: float
@@ -980,14 +1745,31 @@ class RetrieveOrCreateThumbnails(MethodView):
                     - Task get preview thumbnails is still processing
         """
         document = validate_document(request.args.to_dict(), self.schema_thumbnails)
+        # pending edits are rendered on first access
+        if _render_edits(self.project):
+            self.project = self._get_project_or_404(project_id)
         add_urls(self.project)
 
+        capture_mode = document.get('capture_mode', app.config.get('DEFAULT_CAPTURE_MODE'))
         if document['type'] == 'timeline':
+            mode = document.get('mode', 'interval')
+            if mode == 'scenes':
+                if document.get('capture_mode') == 'fast':
+                    raise BadRequest({"capture_mode": ["'fast' capture mode can't be used in 'scenes' mode"]})
+                # scenes are detected in every frame
+                capture_mode = 'accurate'
             return self._get_timeline_thumbnails(
-                amount=document.get('amount', app.config.get('DEFAULT_TOTAL_TIMELINE_THUMBNAILS'))
+                amount=document.get('amount', app.config.get('DEFAULT_TOTAL_TIMELINE_THUMBNAILS')),
+                mode=mode,
+                capture_mode=capture_mode
             )
 
-        return self._get_preview_thumbnail(document['position'], document.get('crop'), document.get('rotate', 0))
+        if document['type'] == 'animated':
+            return self._get_animated_thumbnail()
+
+        return self._get_preview_thumbnail(
+            document['position'], document.get('crop'), document.get('rotate', 0), capture_mode
+        )
 
     def post(self, project_id):
         """
@@ -1101,11 +1883,15 @@ class RetrieveOrCreateThumbnails(MethodView):
 
         return json_response(self.project['thumbnails']['preview'])
 
-    def _get_timeline_thumbnails(self, amount):
+    def _get_timeline_thumbnails(self, amount, mode='interval', capture_mode='accurate'):
         """
         Get list or create thumbnails for timeline
-        :param amount: amount of thumbnails
+        :param amount: amount of thumbnails, max amount in `scenes` mode
         :type amount: int
+        :param mode: 'interval' captures thumbnails at fixed intervals, 'scenes' at scene changes
+        :type mode: str
+        :param capture_mode: 'accurate' captures frames at positions, 'fast' captures keyframes before them
+        :type capture_mode: str
         :return: json response
         :rtype: flask.wrappers.Response
         """
@@ -1115,7 +1901,7 @@ class RetrieveOrCreateThumbnails(MethodView):
         if self.project['processing']['video']:
             raise Conflict({"processing": ["Task get video is still processing"]})
         # no need to generate thumbnails
-        elif amount == len(self.project['thumbnails']['timeline']):
+        elif self._timeline_thumbnails_match(amount, mode, capture_mode):
             return json_response({
                 "processing": False,
                 "thumbnails": self.project['thumbnails']['timeline'],
@@ -1130,35 +1916,67 @@ class RetrieveOrCreateThumbnails(MethodView):
             # run task
             generate_timeline_thumbnails.delay(
                 self.project,
-                amount
+                amount,
+                mode,
+                capture_mode
             )
         return json_response({
             "processing": True,
             "thumbnails": [],
         }, status=202)
 
-    def _get_preview_thumbnail(self, position, crop, rotate):
+    def _timeline_thumbnails_match(self, amount, mode, capture_mode):
         """
-        Get or create thumbnail for preview
-        :param position: video position to capture a frame
-        :type position: int
-        :param crop: crop editing rules
-        :type crop: dict
-        :param rotate: rotate degree
+        Check if existing timeline thumbnails were captured with the same `amount`, `mode` and `capture_mode`,
+        thumbnails captured before modes were introduced are `interval` and `accurate` ones
+        :rtype: bool
+        """
+
+        timeline = self.project['thumbnails']['timeline']
+        options = {
+            'capture_mode': 'accurate',
+            **self.project['thumbnails'].get('timeline_options', {'mode': 'interval', 'amount': len(timeline)})
+        }
+        return bool(timeline) and options == {'mode': mode, 'amount': amount, 'capture_mode': capture_mode}
+
+    def _get_animated_thumbnail(self):
+        """
+        Get or create animated thumbnail, it is removed when video is edited
+        :return: json response
+        :rtype: flask.wrappers.Response
+        """
+
+        if self.project['thumbnails'].get('animated'):
+            return json_response(self.project['thumbnails']['animated'])
+        # thumbnail would be captured from the video which is being replaced
+        if self.project['processing']['video']:
+            raise Conflict({"processing": ["Task get video is still processing"]})
+        if not self.project['processing'].get('thumbnail_animated'):
+            self.project = app.mongo.db.projects.find_one_and_update(
+                {'_id': self.project['_id']},
+                {'$set': {'processing.thumbnail_animated': True}},
+                return_document=ReturnDocument.AFTER
+            )
+            generate_animated_thumbnail.delay(self.project)
+        return json_response({"processing": True}, status=202)
+
+    def _get_preview_thumbnail(self, position, crop, rotate, capture_mode='accurate'):
+        """
+        Get or create thumbnail for preview
+        :param position: video position to capture a frame
+        :type position: int
+        :param crop: crop editing rules
+        :type crop: dict
+        :param rotate: rotate degree
         :type rotate: int
+        :param capture_mode: 'accurate' captures the frame at position, 'fast' captures the keyframe before it
+        :type capture_mode: str
         :return: json response
         :rtype: flask.wrappers.Response
         """
         # validate crop param
         if crop:
-            if self.project['metadata']['width'] - crop['x'] < app.config.get('MIN_VIDEO_WIDTH'):
-                raise BadRequest({"crop": ["x is less than minimum allowed crop width"]})
-            elif self.project['metadata']['height'] - crop['y'] < app.config.get('MIN_VIDEO_HEIGHT'):
-                raise BadRequest({"crop": ["y is less than minimum allowed crop height"]})
-            elif crop['x'] + crop['width'] > self.project['metadata']['width']:
-                raise BadRequest({"crop": ["width of crop's frame is outside a video's frame"]})
-            elif crop['y'] + crop['height'] > self.project['metadata']['height']:
-                raise BadRequest({"crop": ["height of crop's frame is outside a video's frame"]})
+            _validate_thumbnail_crop(self.project['metadata'], crop)
         # validate position param
         if self.project['metadata']['duration'] < position:
             position = self.project['metadata']['duration']
@@ -1179,10 +1997,359 @@ class RetrieveOrCreateThumbnails(MethodView):
                 position,
                 crop,
                 rotate,
+                capture_mode,
             )
             return json_response({"processing": True}, status=202)
 
 
+class RetrieveCreateSelectPreviewCandidates(MethodView):
+
+    @property
+    def schema_candidates(self):
+        return {
+            'candidates': {
+                'type': 'list',
+                'required': True,
+                'minlength': 1,
+                'maxlength': app.config.get('MAX_PREVIEW_CANDIDATES'),
+                'schema': {
+                    'type': 'dict',
+                    'schema': {
+                        'position': {
+                            'type': 'float',
+                            'required': True,
+                            'coerce': float,
+                            'min': 0,
+                        },
+                        'crop': {
+                            'required': False,
+                            'regex': r'^\d+,\d+,\d+,\d+$',
+                            'coerce': 'crop_to_dict',
+                            'allow_crop_width': [app.config.get('MIN_VIDEO_WIDTH'), app.config.get('MAX_VIDEO_WIDTH')],
+                            'allow_crop_height': [app.config.get('MIN_VIDEO_HEIGHT'),
+                                                  app.config.get('MAX_VIDEO_HEIGHT')]
+                        },
+                        'rotate': {
+                            'type': 'integer',
+                            'required': False,
+                            'coerce': int,
+                            'allowed': [-270, -180, -90, 90, 180, 270]
+                        }
+                    }
+                }
+            }
+        }
+
+    SCHEMA_SELECT = {
+        'index': {
+            'type': 'integer',
+            'required': True,
+            'coerce': int,
+            'min': 0,
+        }
+    }
+
+    def get(self, project_id):
+        """
+        Get preview thumbnail candidates captured for the current version of the video.
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+          description: Unique project id
+        responses:
+          200:
+            description: Preview thumbnail candidates
+            schema:
+              type: object
+              properties:
+                processing:
+                  type: boolean
+                  example: False
+                candidates:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      url:
+                        type: string
+                        example: http://localhost:5050/projects/5cbd5acfe24f6045607e51aa/raw/thumbnails/candidates/0
+                      width:
+                        type: integer
+                        example: 1280
+                      height:
+                        type: integer
+                        example: 720
+                      size:
+                        type: integer
+                        example: 654321
+                      position:
+                        type: float
+                        example: 4.5
+                      crop:
+                        type: object
+                      rotate:
+                        type: integer
+                        example: 0
+        """
+
+        add_urls(self.project)
+        return json_response({
+            'processing': self.project['processing'].get('thumbnail_candidates', False),
+            'candidates': self.project['thumbnails'].get('candidates', []),
+        })
+
+    def post(self, project_id):
+        """
+        Capture preview thumbnail candidates at several positions, all of them in one task and one ffmpeg run.
+        Previous candidates are replaced, pick one of them as a preview thumbnail with `PUT`.
+        ---
+        consumes:
+        - application/json
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+          description: Unique project id
+        - in: body
+          name: body
+          required: True
+          schema:
+            type: object
+            properties:
+              candidates:
+                type: array
+                description: up to `MAX_PREVIEW_CANDIDATES` positions to capture, with optional crop and rotate
+                items:
+                  type: object
+                  properties:
+                    position:
+                      type: float
+                      example: 4.5
+                    crop:
+                      type: string
+                      example: 0,0,720,360
+                    rotate:
+                      type: integer
+                      enum: [-270, -180, -90, 90, 180, 270]
+                      example: 90
+        responses:
+          202:
+            description: Capturing task was started
+            schema:
+              type: object
+              properties:
+                processing:
+                  type: boolean
+                  example: True
+          409:
+            description: Video or preview candidates task is still processing
+            schema:
+              type: object
+              properties:
+                processing:
+                  type: array
+                  example:
+                    - Task get preview candidates is still processing
+        """
+
+        request_json = request.get_json()
+        document = validate_document(request_json if request_json else {}, self.schema_candidates)
+        for candidate in document['candidates']:
+            if candidate.get('crop'):
+                _validate_thumbnail_crop(self.project['metadata'], candidate['crop'])
+
+        # pending edits are rendered first, candidates are captured from the rendered video
+        _render_edits(self.project)
+        project = app.mongo.db.projects.find_one_and_update(
+            {
+                '_id': self.project['_id'],
+                'processing.video': False,
+                'processing.thumbnail_candidates': {'$ne': True},
+            },
+            {'$set': {'processing.thumbnail_candidates': True}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not project:
+            raise Conflict({"processing": ["Task get video or preview candidates is still processing"]})
+
+        generate_preview_candidates.delay(
+            project,
+            [{
+                'position': min(candidate['position'], project['metadata']['duration']),
+                'crop': candidate.get('crop'),
+                'rotate': candidate.get('rotate', 0),
+            } for candidate in document['candidates']]
+        )
+        return json_response({"processing": True}, status=202)
+
+    def put(self, project_id):
+        """
+        Set one of preview thumbnail candidates as a preview thumbnail.
+        ---
+        consumes:
+        - application/json
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+          description: Unique project id
+        - in: body
+          name: body
+          required: True
+          schema:
+            type: object
+            properties:
+              index:
+                type: integer
+                description: index of a candidate
+                example: 2
+        responses:
+          200:
+            description: Preview thumbnail
+          404:
+            description: There is no candidate with the index
+          409:
+            description: There is a running preview thumbnails task
+        """
+
+        request_json = request.get_json()
+        document = validate_document(request_json if request_json else {}, self.SCHEMA_SELECT)
+        try:
+            candidate = self.project['thumbnails'].get('candidates', [])[document['index']]
+        except IndexError:
+            raise NotFound()
+        if self.project['processing']['thumbnail_preview']:
+            raise Conflict({"processing": ["Task get preview thumbnails is still processing"]})
+
+        # candidates are kept, so another one can be picked later
+        filename = candidate['filename'].replace('_candidate-', '_preview-', 1)
+        storage_id = app.fs.put(
+            content=app.fs.get(candidate['storage_id']),
+            filename=filename,
+            project_id=None,
+            asset_type='thumbnails',
+            storage_id=self.project['storage_id'],
+            content_type=candidate['mimetype']
+        )
+        if self.project['thumbnails']['preview']:
+            app.fs.delete(self.project['thumbnails']['preview']['storage_id'])
+        self.project = app.mongo.db.projects.find_one_and_update(
+            {'_id': self.project['_id']},
+            {'$set': {
+                'thumbnails.preview': {
+                    'filename': filename,
+                    'storage_id': storage_id,
+                    'mimetype': candidate['mimetype'],
+                    'width': candidate['width'],
+                    'height': candidate['height'],
+                    'size': candidate['size'],
+                    'position': candidate['position'],
+                }
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        add_urls(self.project)
+
+        return json_response(self.project['thumbnails']['preview'])
+
+
+class RetrieveFrame(MethodView):
+
+    @property
+    def schema_frame(self):
+        return {
+            't': {
+                'type': 'float',
+                'required': True,
+                'coerce': float,
+                'min': 0,
+            },
+            'w': {
+                'type': 'integer',
+                'coerce': int,
+                'min': 2,
+                'max': app.config.get('FRAME_MAX_WIDTH'),
+            },
+            'format': {
+                'type': 'string',
+                'allowed': ['jpeg', 'webp'],
+            },
+        }
+
+    def get(self, project_id):
+        """
+        Get a video frame at a position, for scrubbing.
+        Frame is captured synchronously from the proxy if it is large enough, the original video otherwise,
+        and cached by video version, position rounded to `FRAME_POSITION_STEP` seconds, width and format.
+        Pending edits are not applied, the frame is captured from the current version of the video.
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+          description: Unique project id
+        - name: t
+          in: query
+          type: float
+          required: True
+          description: Position in the video in seconds
+        - name: w
+          in: query
+          type: integer
+          description: Frame's width, video's width by default, at most `FRAME_MAX_WIDTH`. Height keeps aspect ratio.
+        - name: format
+          in: query
+          type: string
+          enum: [jpeg, webp]
+          default: jpeg
+        produces:
+          - image/jpeg
+          - image/webp
+        responses:
+          200:
+            description: Frame image
+          400:
+            description: Invalid position, width or format
+        """
+
+        document = validate_document(request.args.to_dict(), self.schema_frame)
+        metadata = self.project['metadata']
+        width = min(document.get('w', metadata['width']), metadata['width'], app.config.get('FRAME_MAX_WIDTH'))
+        # `scale` requires even width for yuv420p
+        width = max(width - width % 2, 2)
+        step = app.config.get('FRAME_POSITION_STEP')
+        position = round(min(round(document['t'] / step) * step, metadata['duration']), 3)
+        image_format = document.get('format', 'jpeg')
+
+        key = frame_key(self.project['_id'], self.project['version'], position, width, image_format)
+        cached = get_cached_frame(key) if app.config.get('FRAME_CACHE_ENABLED') else None
+        if cached:
+            content, mimetype = cached
+        else:
+            content, frame_metadata = get_video_editor().capture_frame(
+                stream_file=get_source_stream(self.project, round(width * metadata['height'] / metadata['width'])),
+                filename=self.project['filename'],
+                duration=metadata['duration'],
+                position=position,
+                width=width,
+                image_format=image_format
+            )
+            mimetype = frame_metadata['mimetype']
+            if app.config.get('FRAME_CACHE_ENABLED'):
+                cache_frame(key, self.project['_id'], content, mimetype)
+
+        response = make_response(content)
+        response.headers['Content-Type'] = mimetype
+        response.headers['X-Frame-Cache'] = 'hit' if cached else 'miss'
+        return response
+
+
 class GetRawVideo(MethodView):
     def get(self, project_id):
         """
@@ -1222,46 +2389,291 @@ class GetRawVideo(MethodView):
                     - Task edit video is still processing
         """
 
+        # pending edits are rendered on first access
+        if _render_edits(self.project):
+            self.project = self._get_project_or_404(project_id)
+
         # video is processing
         if self.project['processing']['video']:
             raise Conflict({"processing": ["Task edit video is still processing"]})
 
-        # get stream file for video
-        video_range = request.headers.environ.get('HTTP_RANGE')
-        length = self.project['metadata'].get('size')
-        if video_range:
-            # http range bytes=0-
-            _range = re.split('[= | -]', video_range)
-            start = int(_range[1])
-            # TODO doublecheck streaming range
-            end = length - 1
-            # handle end range part in case of bytes=100-200
-            if len(_range) == 3 and _range[2]:
-                end = int(_range[2])
-            chunksize = end - start + 1
-
-            return storage2response(
-                storage_id=self.project['storage_id'],
-                headers={
-                    'Content-Range': f'bytes {start}-{end}/{length}',
-                    'Accept-Ranges': 'bytes',
-                    'Content-Length': chunksize,
-                    'Content-Type': self.project.get("mime_type"),
-                },
-                status=206,
-                start=start,
-                length=chunksize
-            )
+        return _video_response(
+            storage_id=self.project['storage_id'],
+            length=self.project['metadata'].get('size'),
+            content_type=self.project.get("mime_type")
+        )
+
+
+class GetRawProxy(MethodView):
+    def get(self, project_id):
+        """
+        Get low resolution proxy video stream.
+        If `HTTP_RANGE` header is specified - return chunked video stream, else full file.
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+        produces:
+          - video/mp4
+        responses:
+          200:
+            description: Video stream
+            content:
+              video/mp4:
+                schema:
+                  type: string
+                  format: binary
+          206:
+            description: Chunked stream
+            content:
+              video/mp4:
+                schema:
+                  type: string
+                  format: binary
+          404:
+            description: Proxy is not created yet or it is outdated
+        """
+
+        proxy = self.project.get('proxy')
+        if not proxy or proxy['version'] != self.project['version']:
+            raise NotFound()
+
+        return _video_response(
+            storage_id=proxy['storage_id'],
+            length=proxy['size'],
+            content_type=proxy['mimetype']
+        )
+
+
+class GetRawEditPreview(MethodView):
+    def get(self, project_id, preview_id):
+        """
+        Get edit preview file.
+        If `HTTP_RANGE` header is specified - return chunked video stream, else full file.
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+        - in: path
+          name: preview_id
+          type: string
+          required: True
+        produces:
+          - video/mp4
+          - image/png
+        responses:
+          200:
+            description: Edit preview file
+          206:
+            description: Chunked stream
+          404:
+            description: Preview was not found, or it was removed after the video was edited
+        """
+
+        preview = app.mongo.db.edit_previews.find_one({'_id': preview_id, 'project_id': self.project['_id']})
+        if not preview:
+            raise NotFound()
+
+        return _video_response(
+            storage_id=preview['storage_id'],
+            length=preview['size'],
+            content_type=preview['mimetype']
+        )
+
+
+class GetRawRendition(MethodView):
+    def get(self, project_id, height):
+        """
+        Get adaptive bitrate rendition video stream.
+        If `HTTP_RANGE` header is specified - return chunked video stream, else full file.
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+        - in: path
+          name: height
+          type: integer
+          required: True
+        produces:
+          - video/mp4
+        responses:
+          200:
+            description: Video stream
+          206:
+            description: Chunked stream
+          404:
+            description: Rendition is not created yet or it is outdated
+        """
+
+        rendition = next((rendition for rendition in self.project.get('renditions', [])
+                          if rendition['height'] == height), None)
+        if not rendition or rendition['version'] != self.project['version']:
+            raise NotFound()
+
+        return _video_response(
+            storage_id=rendition['storage_id'],
+            length=rendition['metadata']['size'],
+            content_type=rendition['mimetype']
+        )
+
+
+class GetRawWaveform(MethodView):
+    def get(self, project_id):
+        """
+        Get audio waveform peaks, a binary blob of interleaved min/max pairs of all zoom levels.
+        Offsets and lengths of levels are in `waveform` of a project, use `HTTP_RANGE` header to get one level.
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+        produces:
+          - application/octet-stream
+        responses:
+          200:
+            description: Waveform peaks
+          206:
+            description: Chunked peaks
+          404:
+            description: Waveform is not generated yet, it is outdated or video has no audio
+        """
+
+        waveform = self.project.get('waveform')
+        if not waveform or waveform['version'] != self.project['version']:
+            raise NotFound()
+
+        return _video_response(
+            storage_id=waveform['storage_id'],
+            length=waveform['size'],
+            content_type=waveform['mimetype']
+        )
+
+
+class GetRawStream(MethodView):
+    def get(self, project_id, stream_format, filename):
+        """
+        Get adaptive streaming playlist or segment.
+        File names are unique per video version, so responses can be cached for `STREAMING_CACHE_MAX_AGE` seconds.
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+        - in: path
+          name: stream_format
+          type: string
+          enum: [hls, dash]
+          required: True
+        - in: path
+          name: filename
+          type: string
+          required: True
+          description: playlist name from project's `streaming`, or a segment name from a playlist
+        produces:
+          - application/vnd.apple.mpegurl
+          - video/mp2t
+          - application/dash+xml
+          - video/iso.segment
+        responses:
+          200:
+            description: Playlist or segment file
+          404:
+            description: File was not found, or it was removed after the video was edited
+        """
+
+        file = app.mongo.db.streaming.find_one({
+            'project_id': self.project['_id'],
+            'format': stream_format,
+            'name': filename,
+        })
+        if not file:
+            raise NotFound()
 
         return storage2response(
-            storage_id=self.project.get('storage_id'),
+            storage_id=file['storage_id'],
             headers={
-                'Content-Length': length,
-                'Content-Type': self.project.get("mime_type"),
+                'Content-Length': file['size'],
+                'Content-Type': file['mimetype'],
+                'Cache-Control': f"public, max-age={app.config.get('STREAMING_CACHE_MAX_AGE')}, immutable",
             }
         )
 
 
+def _validate_thumbnail_crop(metadata, crop):
+    """
+    Validate crop rules of a thumbnail against video's frame
+    :param metadata: video's metadata
+    :type metadata: dict
+    :param crop: crop editing rules
+    :type crop: dict
+    :raise: `BadRequest` if crop's frame is outside video's frame
+    """
+
+    if metadata['width'] - crop['x'] < app.config.get('MIN_VIDEO_WIDTH'):
+        raise BadRequest({"crop": ["x is less than minimum allowed crop width"]})
+    elif metadata['height'] - crop['y'] < app.config.get('MIN_VIDEO_HEIGHT'):
+        raise BadRequest({"crop": ["y is less than minimum allowed crop height"]})
+    elif crop['x'] + crop['width'] > metadata['width']:
+        raise BadRequest({"crop": ["width of crop's frame is outside a video's frame"]})
+    elif crop['y'] + crop['height'] > metadata['height']:
+        raise BadRequest({"crop": ["height of crop's frame is outside a video's frame"]})
+
+
+def _video_response(storage_id, length, content_type):
+    """
+    Stream a video file, chunked if `HTTP_RANGE` header is specified
+    :param storage_id: video's storage id
+    :type storage_id: str
+    :param length: video's size
+    :type length: int
+    :param content_type: video's mimetype
+    :type content_type: str
+    :return: response
+    :rtype: flask.Response
+    """
+
+    video_range = request.headers.environ.get('HTTP_RANGE')
+    if video_range:
+        # http range bytes=0-
+        _range = re.split('[= | -]', video_range)
+        start = int(_range[1])
+        # TODO doublecheck streaming range
+        end = length - 1
+        # handle end range part in case of bytes=100-200
+        if len(_range) == 3 and _range[2]:
+            end = int(_range[2])
+        chunksize = end - start + 1
+
+        return storage2response(
+            storage_id=storage_id,
+            headers={
+                'Content-Range': f'bytes {start}-{end}/{length}',
+                'Accept-Ranges': 'bytes',
+                'Content-Length': chunksize,
+                'Content-Type': content_type,
+            },
+            status=206,
+            start=start,
+            length=chunksize
+        )
+
+    return storage2response(
+        storage_id=storage_id,
+        headers={
+            'Content-Length': length,
+            'Content-Type': content_type,
+        }
+    )
+
+
 class GetRawPreviewThumbnail(MethodView):
 
     def get(self, project_id):
@@ -1295,6 +2707,42 @@ class GetRawPreviewThumbnail(MethodView):
         )
 
 
+class GetRawAnimatedThumbnail(MethodView):
+
+    def get(self, project_id):
+        """
+        Get animated thumbnail file
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+          description: Unique project id
+        produces:
+          - image/webp
+        responses:
+          200:
+            description: animated thumbnail image
+            content:
+              image/webp:
+                schema:
+                  type: string
+                  format: binary
+          404:
+            description: Animated thumbnail is not created yet, or it was removed after the video was edited
+        """
+
+        animated = self.project['thumbnails'].get('animated')
+        if not animated:
+            raise NotFound()
+
+        return storage2response(
+            storage_id=animated['storage_id'],
+            headers={'Content-Type': animated['mimetype']}
+        )
+
+
 class GetRawTimelineThumbnail(MethodView):
 
     def get(self, project_id, index):
@@ -1335,6 +2783,46 @@ class GetRawTimelineThumbnail(MethodView):
         )
 
 
+class GetRawCandidateThumbnail(MethodView):
+
+    def get(self, project_id, index):
+        """
+        Get preview thumbnail candidate file
+        ---
+        parameters:
+        - in: path
+          name: project_id
+          type: string
+          required: True
+          description: Unique project id
+        - in: path
+          name: index
+          type: integer
+          required: True
+          description: Index of preview thumbnail candidate to read.
+        produces:
+          - image/png
+        responses:
+          200:
+            description: preview thumbnail candidate image
+            content:
+              image/png:
+                schema:
+                  type: string
+                  format: binary
+        """
+
+        try:
+            candidate = self.project['thumbnails'].get('candidates', [])[index]
+        except IndexError:
+            raise NotFound()
+
+        return storage2response(
+            storage_id=candidate['storage_id'],
+            headers={'Content-Type': candidate['mimetype']}
+        )
+
+
 # register all urls
 bp.add_url_rule(
     '/',
@@ -1344,6 +2832,18 @@ bp.add_url_rule(
     '/<project_id>',
     view_func=RetrieveEditDestroyProject.as_view('retrieve_edit_destroy_project')
 )
+bp.add_url_rule(
+    '/<project_id>/edits',
+    view_func=CreateDestroyEdits.as_view('create_destroy_edits')
+)
+bp.add_url_rule(
+    '/<project_id>/render',
+    view_func=RenderProject.as_view('render_project')
+)
+bp.add_url_rule(
+    '/<project_id>/edit_preview',
+    view_func=PreviewEditProject.as_view('preview_edit_project')
+)
 bp.add_url_rule(
     '/<project_id>/duplicate',
     view_func=DuplicateProject.as_view('duplicate_project')
@@ -1352,14 +2852,50 @@ bp.add_url_rule(
     '/<project_id>/thumbnails',
     view_func=RetrieveOrCreateThumbnails.as_view('retrieve_or_create_thumbnails')
 )
+bp.add_url_rule(
+    '/<project_id>/thumbnails/candidates',
+    view_func=RetrieveCreateSelectPreviewCandidates.as_view('retrieve_create_select_preview_candidates')
+)
+bp.add_url_rule(
+    '/<project_id>/frame',
+    view_func=RetrieveFrame.as_view('retrieve_frame')
+)
 bp.add_url_rule(
     '/<project_id>/raw/video',
     view_func=GetRawVideo.as_view('get_raw_video')
 )
+bp.add_url_rule(
+    '/<project_id>/raw/proxy',
+    view_func=GetRawProxy.as_view('get_raw_proxy')
+)
+bp.add_url_rule(
+    '/<project_id>/raw/renditions/<int:height>',
+    view_func=GetRawRendition.as_view('get_raw_rendition')
+)
+bp.add_url_rule(
+    '/<project_id>/raw/waveform',
+    view_func=GetRawWaveform.as_view('get_raw_waveform')
+)
+bp.add_url_rule(
+    '/<project_id>/raw/<any(hls, dash):stream_format>/<filename>',
+    view_func=GetRawStream.as_view('get_raw_stream')
+)
+bp.add_url_rule(
+    '/<project_id>/raw/edit_preview/<preview_id>',
+    view_func=GetRawEditPreview.as_view('get_raw_edit_preview')
+)
 bp.add_url_rule(
     '/<project_id>/raw/thumbnails/preview',
     view_func=GetRawPreviewThumbnail.as_view('get_raw_preview_thumbnail')
 )
+bp.add_url_rule(
+    '/<project_id>/raw/thumbnails/animated',
+    view_func=GetRawAnimatedThumbnail.as_view('get_raw_animated_thumbnail')
+)
+bp.add_url_rule(
+    '/<project_id>/raw/thumbnails/candidates/<int:index>',
+    view_func=GetRawCandidateThumbnail.as_view('get_raw_candidate_thumbnail')
+)
 bp.add_url_rule(
     '/<project_id>/raw/thumbnails/timeline/<int:index>',
     view_func=GetRawTimelineThumbnail.as_view('get_raw_timeline_thumbnail')
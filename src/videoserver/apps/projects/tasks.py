@@ -1,13 +1,25 @@
 import logging
+from datetime import datetime
 from time import time
 
 from bson import ObjectId
+from celery import chord
 from celery.exceptions import MaxRetriesExceededError
 from flask import current_app as app
 from pymongo import ReturnDocument
 
 from videoserver.celery_app import celery
+from videoserver.lib.cache import (cache_render, content_key, delete_cached_frames, drop_cached_render,
+                                   get_cached_render, render_key)
+from videoserver.lib.cost import record_edit_timing
+from videoserver.lib.utils import (delete_edit_previews, delete_streaming_files, get_keyframe_index, get_scenes,
+                                   get_source_stream, save_keyframe_index, save_scenes)
 from videoserver.lib.video_editor import get_video_editor
+from videoserver.lib.video_editor.edits import normalize_changes
+from videoserver.lib.video_editor.interface import STREAMING_MIMETYPES, TIMELINE_THUMBNAIL_HEIGHT
+from videoserver.lib.video_editor.keyframes import KeyframeIndex
+from videoserver.lib.video_editor.process import ProcessCancelledError
+from videoserver.lib.video_editor.waveform import compute_peaks, pack_peaks
 
 logger = logging.getLogger(__name__)
 
@@ -20,72 +32,688 @@ def edit_video(self, project, changes):
     :param changes: changes apply to the video
     """
 
-    video_editor = get_video_editor()
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
 
     try:
-        # Use tool for editing video
-        edited_video_stream, metadata = video_editor.edit_video(
-            stream_file=app.fs.get(project['storage_id']),
+        stream_file = app.fs.get(project['storage_id'])
+        cache_key = None
+        cached = None
+        if app.config.get('RENDER_CACHE_ENABLED'):
+            cache_key = render_key(content_key(stream_file), normalize_changes(changes))
+            cached = get_cached_render(cache_key)
+        cached_stream = None
+        if cached:
+            try:
+                cached_stream = app.fs.get(cached[0])
+            except Exception as e:
+                # evicted by another worker after it was found, render it again
+                logger.warning(f"Cached render {cached[0]} is missing, project {project.get('_id')} is rendered: {e}")
+                drop_cached_render(cache_key)
+
+        if cached_stream is not None:
+            # the same edit of the same video was rendered already
+            storage_id, metadata, packed_index = cached
+            keyframe_index = KeyframeIndex.unpack(*packed_index)
+            app.fs.replace(cached_stream, project['storage_id'], None)
+            logger.info(f"Replaced file {project['storage_id']} with cached render {storage_id} "
+                        f"in project {project.get('_id')}")
+        else:
+            keyframes = get_keyframe_index(project).timestamps
+            start_time = time()
+            if _dispatch_segments(video_editor, project, changes, keyframes, cache_key, start_time):
+                logger.info(f"Dispatched segment encodes for project {project.get('_id')}.")
+                return
+
+            # Use tool for editing video
+            duration = project['metadata']['duration']
+            if changes.get('trim'):
+                duration = changes['trim']['end'] - changes['trim']['start']
+            edited_video_stream, metadata, keyframe_index = video_editor.edit_video(
+                stream_file=stream_file,
+                filename=project['filename'],
+                progress_callback=_progress_reporter(project, duration),
+                keyframes=keyframes,
+                keyframe_index=True,
+                **changes
+            )
+            # calibrate cost model, see `estimate_edit_time`
+            record_edit_timing(project['metadata'], changes, time() - start_time)
+
+            app.fs.replace(
+                edited_video_stream,
+                project['storage_id'],
+                None
+            )
+            logger.info(f"Replaced file {project['storage_id']} in {app.fs.__class__.__name__} "
+                        f"in project {project.get('_id')}")
+            if cache_key:
+                cache_render(
+                    cache_key, edited_video_stream, project['filename'].rsplit('.', 1)[-1],
+                    metadata, keyframe_index.pack()
+                )
+    except ProcessCancelledError:
+        logger.info(f"Editing was cancelled, project {project.get('_id')} was deleted.")
+    except Exception as exc:
+        logger.exception(exc)
+        try:
+            self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            app.mongo.db.projects.update_one(
+                {'_id': ObjectId(project.get('_id'))},
+                {
+                    "$set": {'processing.video': False},
+                    "$unset": {'processing.video_progress': '', 'processing.video_estimate': ''},
+                },
+                upsert=False
+            )
+    else:
+        _finish_edit_video(project, metadata, keyframe_index)
+
+
+@celery.task(bind=True, default_retry_delay=10)
+def encode_segment(self, project, storage_id, changes):
+    """
+    Subtask of `edit_video`, encode one video segment and replace it in a storage.
+    :param project: project doc
+    :param storage_id: storage id of segment
+    :param changes: changes apply to the segment
+    :return: storage id of encoded segment
+    """
+
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
+
+    try:
+        encoded_segment_stream, _ = video_editor.edit_video(
+            stream_file=app.fs.get(storage_id),
             filename=project['filename'],
             **changes
         )
+        app.fs.replace(encoded_segment_stream, storage_id, None)
+    except ProcessCancelledError:
+        logger.info(f"Segment encoding was cancelled, project {project.get('_id')} was deleted.")
+        # fail the chord, so segments are cleaned up by `segments_failed`
+        raise
+    except Exception as exc:
+        logger.exception(exc)
+        raise self.retry(exc=exc, max_retries=app.config.get('MAX_RETRIES', 3))
+
+    return storage_id
 
+
+@celery.task(bind=True, default_retry_delay=10)
+def concat_segments(self, storage_ids, project, cache_key=None, changes=None, start_time=None):
+    """
+    Callback of `encode_segment` subtasks, concatenate encoded segments and finish editing.
+    :param storage_ids: storage ids of encoded segments in order
+    :param project: project doc
+    :param cache_key: render cache key of edited video, it is not cached if not set
+    :param changes: changes applied to the segments
+    :param start_time: unix time when `edit_video` started the edit, its timing is recorded if set
+    """
+
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
+
+    try:
+        edited_video_stream, metadata, keyframe_index = video_editor.concat_videos(
+            streams=[app.fs.get(storage_id) for storage_id in storage_ids],
+            filename=project['filename'],
+            audio_stream=app.fs.get(project['storage_id']),
+            keyframe_index=True
+        )
+        if changes is not None and start_time:
+            # calibrate cost model with the whole edit, from splitting to concatenation
+            record_edit_timing(project['metadata'], changes, time() - start_time)
         app.fs.replace(
             edited_video_stream,
             project['storage_id'],
             None
         )
-        logger.info(f"Replaced file {project['storage_id']} in {app.fs.__class__.__name__} "
-                    f"in project {project.get('_id')}")
+        logger.info(f"Replaced file {project['storage_id']} with {len(storage_ids)} concatenated segments "
+                    f"in {app.fs.__class__.__name__} in project {project.get('_id')}")
+        if cache_key:
+            cache_render(
+                cache_key, edited_video_stream, project['filename'].rsplit('.', 1)[-1], metadata, keyframe_index.pack()
+            )
+    except ProcessCancelledError:
+        logger.info(f"Segments concatenation was cancelled, project {project.get('_id')} was deleted.")
     except Exception as exc:
         logger.exception(exc)
         try:
             self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
         except MaxRetriesExceededError:
-            app.mongo.db.projects.update_one(
-                {'_id': ObjectId(project.get('_id'))},
-                {"$set": {
-                    'processing.video': False,
-                }},
-                upsert=False
-            )
+            segments_failed(project, storage_ids)
     else:
-        # delete old timeline thumbnails
-        old_timeline_thumbnails = project['thumbnails'].get('timeline', [])
-        for old_thumbnail in old_timeline_thumbnails:
-            app.fs.delete(old_thumbnail.get('storage_id'))
-        logger.info(f"Removed {len(old_timeline_thumbnails)} old thumbnails from {app.fs.__class__.__name__} "
-                    f"in project {project.get('_id')}")
+        _delete_segments(project, storage_ids)
+        _finish_edit_video(project, metadata, keyframe_index)
+
+
+@celery.task
+def segments_failed(project, storage_ids):
+    """
+    Errback of segment encodes, clean up segments and release the project.
+    :param project: project doc
+    :param storage_ids: storage ids of segments
+    """
 
-        # update project record
-        app.mongo.db.projects.find_one_and_update(
-            {'_id': project['_id']},
-            {'$set': {
+    _delete_segments(project, storage_ids)
+    app.mongo.db.projects.update_one(
+        {'_id': ObjectId(project.get('_id'))},
+        {
+            "$set": {'processing.video': False},
+            "$unset": {'processing.video_progress': '', 'processing.video_estimate': ''},
+        },
+        upsert=False
+    )
+
+
+def _dispatch_segments(video_editor, project, changes, keyframes, cache_key=None, start_time=None):
+    """
+    Split a long video into segments and dispatch their encodes as celery subtasks,
+    `concat_segments` puts them together when all are done.
+    :param video_editor: video editor
+    :param project: project doc
+    :param changes: changes apply to the video
+    :param keyframes: keyframes timestamps of the video
+    :param cache_key: render cache key of edited video
+    :param start_time: unix time when the edit started, for recording its timing in `concat_segments`
+    :return: True if segments were dispatched, False if video must be edited as a whole
+    :rtype: bool
+    """
+
+    segments_amount = app.config.get('FFMPEG_SEGMENT_WORKERS')
+    if app.config.get('FFMPEG_SEGMENT_DISPATCH') != 'celery' \
+            or segments_amount < 2 \
+            or 'trim' in changes \
+            or project['metadata']['duration'] < app.config.get('FFMPEG_SEGMENT_MIN_DURATION'):
+        return False
+
+    segments = video_editor.split_video(
+        stream_file=app.fs.get(project['storage_id']),
+        filename=project['filename'],
+        segments_amount=segments_amount,
+        keyframes=keyframes
+    )
+    if len(segments) < 2:
+        return False
+
+    storage_ids = []
+    name, ext = project['filename'].rsplit('.', 1)
+    for index, segment in enumerate(segments):
+        storage_ids.append(app.fs.put(
+            content=segment,
+            filename=f"{name}_segment_{index}.{ext}",
+            project_id=None,
+            asset_type='segments',
+            storage_id=project['storage_id'],
+            content_type=project['mime_type']
+        ))
+    logger.info(f"Split video into {len(storage_ids)} segments in project {project.get('_id')}.")
+
+    chord(
+        (encode_segment.s(project, storage_id, changes) for storage_id in storage_ids),
+        concat_segments.s(project, cache_key, changes, start_time).on_error(segments_failed.si(project, storage_ids))
+    ).delay()
+
+    return True
+
+
+def _delete_segments(project, storage_ids):
+    for storage_id in storage_ids:
+        app.fs.delete(storage_id)
+    logger.info(f"Removed {len(storage_ids)} segments from {app.fs.__class__.__name__} "
+                f"in project {project.get('_id')}")
+
+
+def _finish_edit_video(project, metadata, keyframe_index):
+    """
+    Remove outdated thumbnails and rendered edits, save metadata and keyframe index of edited video.
+    :param project: project doc
+    :param metadata: metadata of edited video
+    :param keyframe_index: keyframe index of edited video
+    """
+
+    # delete old timeline thumbnails
+    old_timeline_thumbnails = project['thumbnails'].get('timeline', [])
+    for old_thumbnail in old_timeline_thumbnails:
+        app.fs.delete(old_thumbnail.get('storage_id'))
+    logger.info(f"Removed {len(old_timeline_thumbnails)} old thumbnails from {app.fs.__class__.__name__} "
+                f"in project {project.get('_id')}")
+    # delete outdated proxy and renditions
+    if project.get('proxy'):
+        app.fs.delete(project['proxy']['storage_id'])
+    for rendition in project.get('renditions', []):
+        app.fs.delete(rendition['storage_id'])
+    if project['thumbnails'].get('animated'):
+        app.fs.delete(project['thumbnails']['animated']['storage_id'])
+    for candidate in project['thumbnails'].get('candidates', []):
+        app.fs.delete(candidate['storage_id'])
+    if project.get('waveform'):
+        app.fs.delete(project['waveform']['storage_id'])
+    # edit previews, streaming files and cached frames were rendered from the previous version
+    delete_edit_previews(project['_id'])
+    delete_streaming_files(project['_id'])
+    delete_cached_frames(project['_id'])
+
+    # update project record
+    updated_project = app.mongo.db.projects.find_one_and_update(
+        {'_id': project['_id']},
+        {
+            '$set': {
                 'processing.video': False,
                 'metadata': metadata,
                 'thumbnails.timeline': [],
+                'proxy': None,
+                'renditions': [],
+                'streaming': {},
+                'waveform': None,
                 'version': project['version'] + 1
+            },
+            '$unset': {
+                'processing.video_progress': '',
+                'processing.video_estimate': '',
+                'thumbnails.animated': '',
+                'thumbnails.timeline_options': '',
+                'thumbnails.candidates': '',
+            },
+            # edits made while video was rendering are kept for the next render
+            '$pull': {'edits': {'id': {'$in': [edit['id'] for edit in project.get('edits', [])]}}},
+        },
+        return_document=ReturnDocument.AFTER
+    )
+    # project may be deleted meanwhile
+    if updated_project:
+        save_keyframe_index(updated_project['_id'], updated_project['version'], keyframe_index)
+    logger.info(f"Finished editing for project {project.get('_id')}.")
+    if updated_project and _proxy_required(updated_project):
+        generate_proxy.delay(updated_project)
+    if updated_project and app.config.get('RENDITIONS_ENABLED'):
+        generate_renditions.delay(updated_project)
+    if updated_project and app.config.get('STREAMING_FORMATS'):
+        package_stream.delay(updated_project)
+    if updated_project and app.config.get('WAVEFORM_ENABLED'):
+        generate_waveform.delay(updated_project)
+
+
+def _project_deleted(project):
+    """
+    Create a check used by video editor to kill running ffmpeg when its project was deleted.
+    :param project: project doc
+    :return: cancel check
+    :rtype: callable
+    """
+
+    # check may be called from ffmpeg pool threads, where there is no app context
+    projects = app.mongo.db.projects
+
+    def check():
+        return projects.find_one({'_id': ObjectId(project.get('_id'))}, {'_id': 1}) is None
+
+    return check
+
+
+def _progress_reporter(project, duration):
+    """
+    Create a callback which saves editing progress percentage and ETA into project's `processing.video_progress`.
+    Updates are throttled to one per `PROGRESS_UPDATE_INTERVAL` seconds.
+    :param project: project doc
+    :param duration: expected duration of edited video
+    :return: progress callback
+    :rtype: callable
+    """
+
+    # callback may be called from ffmpeg pool threads, where there is no app context
+    projects = app.mongo.db.projects
+    interval = app.config.get('PROGRESS_UPDATE_INTERVAL')
+    last_update = 0
+
+    def report(progress):
+        nonlocal last_update
+        if not progress['end'] and time() - last_update < interval:
+            return
+        last_update = time()
+
+        percent = min(round(progress['out_time'] / duration * 100, 1), 100.0) if duration else None
+        eta = None
+        if progress['speed']:
+            eta = round(max(duration - progress['out_time'], 0) / progress['speed'], 1)
+        projects.update_one(
+            {'_id': ObjectId(project.get('_id')), 'processing.video': True},
+            {"$set": {
+                'processing.video_progress': {
+                    'percent': 100.0 if progress['end'] else percent,
+                    'eta': 0.0 if progress['end'] else eta,
+                    'speed': progress['speed'],
+                    'fps': progress['fps'],
+                    'update_time': datetime.utcnow(),
+                },
             }},
-            return_document=ReturnDocument.BEFORE
+            upsert=False
         )
-        logger.info(f"Finished editing for project {project.get('_id')}.")
+
+    return report
 
 
 @celery.task(bind=True, default_retry_delay=10)
-def generate_timeline_thumbnails(self, project, amount):
-    timeline_thumbnails = []
-    video_editor = get_video_editor()
+def generate_proxy(self, project):
+    """
+    Create a low resolution proxy of project's video and save it into `proxy` of a project.
+    :param project: project doc
+    """
+
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
+    name = project['filename'].rsplit('.', 1)[0]
+    filename = f"{name}_proxy_v{project['version']}.mp4"
+    storage_id = None
 
     try:
-        thumbnails_generator = video_editor.capture_timeline_thumbnails(
+        stream, meta = video_editor.create_proxy(
             stream_file=app.fs.get(project['storage_id']),
             filename=project['filename'],
-            duration=project['metadata']['duration'],
-            thumbnails_amount=amount)
+            height=app.config.get('PROXY_HEIGHT')
+        )
+        storage_id = app.fs.put(
+            content=stream,
+            filename=filename,
+            project_id=None,
+            asset_type='proxy',
+            storage_id=project['storage_id'],
+            content_type='video/mp4'
+        )
+        # video could be edited meanwhile, then this proxy is outdated
+        result = app.mongo.db.projects.update_one(
+            {'_id': ObjectId(project.get('_id')), 'version': project['version']},
+            {"$set": {
+                'proxy': {
+                    'filename': filename,
+                    'storage_id': storage_id,
+                    'mimetype': 'video/mp4',
+                    'width': meta.get('width'),
+                    'height': meta.get('height'),
+                    'size': meta.get('size'),
+                    'version': project['version'],
+                },
+            }},
+            upsert=False
+        )
+        if not result.modified_count:
+            app.fs.delete(storage_id)
+            logger.info(f"Removed outdated proxy version {project['version']} in project {project.get('_id')}.")
+            return
+        logger.info(f"Created and saved proxy {meta.get('width')}x{meta.get('height')} "
+                    f"to {app.fs.__class__.__name__} in project {project.get('_id')}.")
+    except ProcessCancelledError:
+        logger.info(f"Proxy creating was cancelled, project {project.get('_id')} was deleted.")
+    except Exception as e:
+        if storage_id:
+            app.fs.delete(storage_id)
+        logger.exception(e)
+        try:
+            raise self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            # proxy is optional, original video is used instead
+            logger.error(f"Proxy was not created in project {project.get('_id')}.")
+
+
+@celery.task(bind=True, default_retry_delay=10)
+def generate_renditions(self, project):
+    """
+    Encode project's video into `RENDITION_LADDER` renditions not higher than the video in one ffmpeg pass
+    and save them into `renditions` of a project.
+    :param project: project doc
+    """
+
+    ladder = [rendition for rendition in app.config.get('RENDITION_LADDER')
+              if rendition['height'] <= project['metadata']['height']]
+    if not ladder:
+        return
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
+    name = project['filename'].rsplit('.', 1)[0]
+    renditions = []
+
+    try:
+        results = video_editor.create_renditions(
+            stream_file=app.fs.get(project['storage_id']),
+            filename=project['filename'],
+            ladder=ladder
+        )
+        for rendition, (stream, meta) in zip(ladder, results):
+            filename = f"{name}_{rendition['height']}p_v{project['version']}.mp4"
+            storage_id = app.fs.put(
+                content=stream,
+                filename=filename,
+                project_id=None,
+                asset_type='renditions',
+                storage_id=project['storage_id'],
+                content_type='video/mp4'
+            )
+            renditions.append({
+                'filename': filename,
+                'storage_id': storage_id,
+                'mimetype': 'video/mp4',
+                'height': rendition['height'],
+                'max_bitrate': rendition['bitrate'],
+                'metadata': meta,
+                'version': project['version'],
+            })
+        # video could be edited meanwhile, then these renditions are outdated
+        result = app.mongo.db.projects.update_one(
+            {'_id': ObjectId(project.get('_id')), 'version': project['version']},
+            {"$set": {'renditions': renditions}},
+            upsert=False
+        )
+        if not result.modified_count:
+            for rendition in renditions:
+                app.fs.delete(rendition['storage_id'])
+            logger.info(f"Removed outdated renditions version {project['version']} in project {project.get('_id')}.")
+            return
+        logger.info(f"Created and saved renditions {', '.join(str(r['height']) for r in renditions)} "
+                    f"to {app.fs.__class__.__name__} in project {project.get('_id')}.")
+    except ProcessCancelledError:
+        logger.info(f"Renditions creating was cancelled, project {project.get('_id')} was deleted.")
+    except Exception as e:
+        for rendition in renditions:
+            app.fs.delete(rendition['storage_id'])
+        logger.exception(e)
+        try:
+            raise self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            logger.error(f"Renditions were not created in project {project.get('_id')}.")
+
+
+@celery.task(bind=True, default_retry_delay=10)
+def generate_waveform(self, project):
+    """
+    Decode audio of project's video once and reduce it into min/max peaks of `WAVEFORM_LEVELS` zoom levels.
+    Peaks are saved as one binary blob into a storage, its levels description into `waveform` of a project.
+    :param project: project doc
+    """
+
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
+    sample_rate = app.config.get('WAVEFORM_SAMPLE_RATE')
+    samples_per_peak = app.config.get('WAVEFORM_SAMPLES_PER_PEAK')
+    bits = app.config.get('WAVEFORM_BITS')
+    storage_id = None
+
+    try:
+        pcm = video_editor.decode_audio(
+            stream_file=app.fs.get(project['storage_id']),
+            filename=project['filename'],
+            sample_rate=sample_rate
+        )
+        if pcm is None:
+            logger.info(f"Video has no audio, waveform is not generated in project {project.get('_id')}.")
+            return
+        blob, levels = pack_peaks(
+            compute_peaks(pcm, samples_per_peak, app.config.get('WAVEFORM_LEVELS'), bits),
+            samples_per_peak,
+            bits
+        )
+        filename = f"{project['filename'].rsplit('.', 1)[0]}_waveform_v{project['version']}.dat"
+        storage_id = app.fs.put(
+            content=blob,
+            filename=filename,
+            project_id=None,
+            asset_type='waveform',
+            storage_id=project['storage_id'],
+            content_type='application/octet-stream'
+        )
+        waveform = {
+            'filename': filename,
+            'storage_id': storage_id,
+            'mimetype': 'application/octet-stream',
+            'size': len(blob),
+            'sample_rate': sample_rate,
+            'bits': bits,
+            'levels': levels,
+            'version': project['version'],
+        }
+        # video could be edited meanwhile, then this waveform is outdated
+        result = app.mongo.db.projects.update_one(
+            {'_id': ObjectId(project.get('_id')), 'version': project['version']},
+            {"$set": {'waveform': waveform}},
+            upsert=False
+        )
+        if not result.modified_count:
+            app.fs.delete(storage_id)
+            logger.info(f"Removed outdated waveform version {project['version']} in project {project.get('_id')}.")
+            return
+        logger.info(f"Created and saved waveform of {len(levels)} levels "
+                    f"to {app.fs.__class__.__name__} in project {project.get('_id')}.")
+    except ProcessCancelledError:
+        logger.info(f"Waveform generating was cancelled, project {project.get('_id')} was deleted.")
+    except Exception as e:
+        if storage_id:
+            app.fs.delete(storage_id)
+        logger.exception(e)
+        try:
+            raise self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            logger.error(f"Waveform was not generated in project {project.get('_id')}.")
+
+
+@celery.task(bind=True, default_retry_delay=10)
+def package_stream(self, project):
+    """
+    Package project's video for adaptive streaming in `STREAMING_FORMATS`.
+    Playlists and segments are saved into `streaming` collection and a storage, playlists into `streaming` of a project.
+    :param project: project doc
+    """
+
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
+    prefix = f"v{project['version']}"
+    streaming = {}
+    storage_ids = []
+
+    try:
+        stream_file = app.fs.get(project['storage_id'])
+        for stream_format in app.config.get('STREAMING_FORMATS'):
+            playlist, files = video_editor.package_stream(
+                stream_file=stream_file,
+                filename=project['filename'],
+                stream_format=stream_format,
+                prefix=prefix,
+                segment_duration=app.config.get('STREAMING_SEGMENT_DURATION')
+            )
+            docs = []
+            for name, content in files.items():
+                mimetype = STREAMING_MIMETYPES.get(name.rsplit('.', 1)[-1], 'application/octet-stream')
+                storage_id = app.fs.put(
+                    content=content,
+                    filename=name,
+                    project_id=None,
+                    asset_type=stream_format,
+                    storage_id=project['storage_id'],
+                    content_type=mimetype
+                )
+                storage_ids.append(storage_id)
+                docs.append({
+                    'project_id': ObjectId(project.get('_id')),
+                    'format': stream_format,
+                    'name': name,
+                    'storage_id': storage_id,
+                    'mimetype': mimetype,
+                    'size': len(content),
+                    'version': project['version'],
+                })
+            app.mongo.db.streaming.insert_many(docs)
+            streaming[stream_format] = {
+                'playlist': playlist,
+                'version': project['version'],
+            }
+
+        # video could be edited meanwhile, then these files are outdated
+        result = app.mongo.db.projects.update_one(
+            {'_id': ObjectId(project.get('_id')), 'version': project['version']},
+            {"$set": {'streaming': streaming}},
+            upsert=False
+        )
+        if not result.modified_count:
+            _delete_streaming_version(project, storage_ids)
+            logger.info(f"Removed outdated streaming files version {project['version']} "
+                        f"in project {project.get('_id')}.")
+            return
+        logger.info(f"Packaged {', '.join(streaming)} streaming and saved {len(storage_ids)} files "
+                    f"to {app.fs.__class__.__name__} in project {project.get('_id')}.")
+    except ProcessCancelledError:
+        logger.info(f"Streaming packaging was cancelled, project {project.get('_id')} was deleted.")
+    except Exception as e:
+        _delete_streaming_version(project, storage_ids)
+        logger.exception(e)
+        try:
+            raise self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            # streaming is optional, original video is still served
+            logger.error(f"Streaming files were not packaged in project {project.get('_id')}.")
+
+
+def _delete_streaming_version(project, storage_ids):
+    for storage_id in storage_ids:
+        app.fs.delete(storage_id)
+    app.mongo.db.streaming.delete_many({'project_id': ObjectId(project.get('_id')), 'version': project['version']})
+
+
+def _proxy_required(project):
+    """
+    Check if proxy should be created for a project's video
+    :param project: project doc
+    :rtype: bool
+    """
+
+    return app.config.get('PROXY_ENABLED') and project['metadata']['height'] > app.config.get('PROXY_HEIGHT')
+
+
+@celery.task(bind=True, default_retry_delay=10)
+def generate_timeline_thumbnails(self, project, amount, mode='interval', capture_mode='accurate'):
+    timeline_thumbnails = []
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
+
+    try:
+        stream_file = get_source_stream(project, TIMELINE_THUMBNAIL_HEIGHT)
+        if mode == 'scenes':
+            threshold = app.config.get('SCENE_CHANGE_THRESHOLD')
+            scenes = get_scenes(project, threshold)
+            detected_scenes, thumbnails_generator = video_editor.capture_scene_thumbnails(
+                stream_file=stream_file,
+                filename=project['filename'],
+                amount=amount,
+                threshold=threshold,
+                scenes=scenes
+            )
+            if scenes is None:
+                save_scenes(project['_id'], project['version'], threshold, detected_scenes)
+                logger.info(f"Detected {len(detected_scenes)} scenes in project {project.get('_id')}.")
+        else:
+            thumbnails_generator = video_editor.capture_timeline_thumbnails(
+                stream_file=stream_file,
+                filename=project['filename'],
+                duration=project['metadata']['duration'],
+                thumbnails_amount=amount,
+                fast=capture_mode == 'fast')
 
         for count, (stream, meta) in enumerate(thumbnails_generator, 1):
             ext = app.config.get('CODEC_EXTENSION_MAP')[meta.get('codec_name')]
-            filename = f"{project['filename'].rsplit('.', 1)[0]}_timeline_{count}-{amount}.{ext}"
+            name = 'timeline_scene' if mode == 'scenes' else 'timeline'
+            filename = f"{project['filename'].rsplit('.', 1)[0]}_{name}_{count}-{amount}.{ext}"
             # save to storage
             storage_id = app.fs.put(
                 content=stream,
@@ -105,8 +733,12 @@ def generate_timeline_thumbnails(self, project, amount):
                     'size': meta.get('size')
                 }
             )
+            if 'position' in meta:
+                timeline_thumbnails[-1]['position'] = meta['position']
         logger.info(f"Created and saved {len(timeline_thumbnails)} thumbnails to {app.fs.__class__.__name__} "
                     f"in project {project.get('_id')}.")
+    except ProcessCancelledError:
+        logger.info(f"Timeline thumbnails capturing was cancelled, project {project.get('_id')} was deleted.")
     except Exception as e:
         # delete just saved files
         for thumbnail in timeline_thumbnails:
@@ -138,6 +770,7 @@ def generate_timeline_thumbnails(self, project, amount):
             {'_id': ObjectId(project.get('_id'))},
             {"$set": {
                 'thumbnails.timeline': timeline_thumbnails,
+                'thumbnails.timeline_options': {'mode': mode, 'amount': amount, 'capture_mode': capture_mode},
                 'processing.thumbnails_timeline': False,
             }},
             upsert=False
@@ -146,8 +779,8 @@ def generate_timeline_thumbnails(self, project, amount):
 
 
 @celery.task(bind=True, default_retry_delay=10)
-def generate_preview_thumbnail(self, project, position, crop, rotate):
-    video_editor = get_video_editor()
+def generate_preview_thumbnail(self, project, position, crop, rotate, capture_mode='accurate'):
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
     preview_thumbnail = None
 
     try:
@@ -158,6 +791,7 @@ def generate_preview_thumbnail(self, project, position, crop, rotate):
             position=position,
             crop=crop,
             rotate=rotate,
+            fast=capture_mode == 'fast',
         )
         # Generate _id to ensure filename is unique, avoid fs.put raises error,
         # use of fs.replace will lead to lost original thumbnail if an error is occured
@@ -184,6 +818,8 @@ def generate_preview_thumbnail(self, project, position, crop, rotate):
             'size': meta.get('size'),
             'position': position
         }
+    except ProcessCancelledError:
+        logger.info(f"Preview thumbnail capturing was cancelled, project {project.get('_id')} was deleted.")
     except Exception as e:
         # delete just saved file
         if preview_thumbnail:
@@ -219,3 +855,162 @@ def generate_preview_thumbnail(self, project, position, crop, rotate):
             upsert=False
         )
         logger.info(f"Set preview thumbnail in db for project {project.get('_id')}.")
+
+
+@celery.task(bind=True, default_retry_delay=10)
+def generate_preview_candidates(self, project, captures):
+    """
+    Capture preview thumbnail candidates at several positions in one ffmpeg run and save them
+    into `thumbnails.candidates`, replacing previous candidates.
+    :param project: project doc
+    :param captures: `position` of every candidate with optional `crop` rules and `rotate` degree
+    """
+
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
+    candidates = []
+
+    try:
+        results = video_editor.capture_thumbnails(
+            stream_file=app.fs.get(project['storage_id']),
+            filename=project['filename'],
+            duration=project['metadata']['duration'],
+            captures=captures
+        )
+        # unique file names, previous candidates are removed only after new ones are saved
+        _id = round(time() * 1000)
+        name = project['filename'].rsplit('.', 1)[0]
+        for index, (capture, (stream, meta)) in enumerate(zip(captures, results)):
+            ext = app.config.get('CODEC_EXTENSION_MAP')[meta.get('codec_name')]
+            filename = f"{name}_candidate-{capture['position']}_{_id}_{index}.{ext}"
+            storage_id = app.fs.put(
+                content=stream,
+                filename=filename,
+                project_id=None,
+                asset_type='thumbnails',
+                storage_id=project['storage_id'],
+                content_type=meta.get('mimetype')
+            )
+            candidates.append({
+                'filename': filename,
+                'storage_id': storage_id,
+                'mimetype': meta.get('mimetype'),
+                'width': meta.get('width'),
+                'height': meta.get('height'),
+                'size': meta.get('size'),
+                'position': capture['position'],
+                'crop': capture.get('crop'),
+                'rotate': capture.get('rotate', 0),
+            })
+        # video could be edited meanwhile, then these candidates are outdated
+        old_project = app.mongo.db.projects.find_one_and_update(
+            {'_id': ObjectId(project.get('_id')), 'version': project['version']},
+            {"$set": {
+                'thumbnails.candidates': candidates,
+                'processing.thumbnail_candidates': False,
+            }},
+            return_document=ReturnDocument.BEFORE
+        )
+        if not old_project:
+            for candidate in candidates:
+                app.fs.delete(candidate['storage_id'])
+            app.mongo.db.projects.update_one(
+                {'_id': ObjectId(project.get('_id'))},
+                {"$set": {'processing.thumbnail_candidates': False}},
+                upsert=False
+            )
+            logger.info(f"Removed outdated preview candidates version {project['version']} "
+                        f"in project {project.get('_id')}.")
+            return
+        for old_candidate in old_project['thumbnails'].get('candidates', []):
+            app.fs.delete(old_candidate['storage_id'])
+        logger.info(f"Created and saved {len(candidates)} preview candidates to {app.fs.__class__.__name__} "
+                    f"in project {project.get('_id')}.")
+    except ProcessCancelledError:
+        logger.info(f"Preview candidates capturing was cancelled, project {project.get('_id')} was deleted.")
+    except Exception as e:
+        for candidate in candidates:
+            app.fs.delete(candidate['storage_id'])
+        logger.exception(e)
+        try:
+            raise self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            app.mongo.db.projects.update_one(
+                {'_id': ObjectId(project.get('_id'))},
+                {"$set": {'processing.thumbnail_candidates': False}},
+                upsert=False
+            )
+
+
+@celery.task(bind=True, default_retry_delay=10)
+def generate_animated_thumbnail(self, project):
+    """
+    Make an animated thumbnail of frames sampled across project's video and save it into `thumbnails.animated`.
+    :param project: project doc
+    """
+
+    video_editor = get_video_editor(cancel_check=_project_deleted(project))
+    height = app.config.get('ANIMATED_THUMBNAIL_HEIGHT')
+    animated_thumbnail = None
+
+    try:
+        stream, meta = video_editor.capture_animated_thumbnail(
+            stream_file=get_source_stream(project, height),
+            filename=project['filename'],
+            duration=project['metadata']['duration'],
+            frames_amount=app.config.get('ANIMATED_THUMBNAIL_FRAMES'),
+            height=height,
+            frame_rate=app.config.get('ANIMATED_THUMBNAIL_FRAME_RATE')
+        )
+        filename = f"{project['filename'].rsplit('.', 1)[0]}_animated_v{project['version']}.webp"
+        storage_id = app.fs.put(
+            content=stream,
+            filename=filename,
+            project_id=None,
+            asset_type='thumbnails',
+            storage_id=project['storage_id'],
+            content_type=meta.get('mimetype')
+        )
+        animated_thumbnail = {
+            'filename': filename,
+            'storage_id': storage_id,
+            'mimetype': meta.get('mimetype'),
+            'width': meta.get('width'),
+            'height': meta.get('height'),
+            'size': meta.get('size'),
+            'frames': meta.get('frames'),
+        }
+        # video could be edited meanwhile, then this thumbnail is outdated
+        result = app.mongo.db.projects.update_one(
+            {'_id': ObjectId(project.get('_id')), 'version': project['version']},
+            {"$set": {
+                'thumbnails.animated': animated_thumbnail,
+                'processing.thumbnail_animated': False,
+            }},
+            upsert=False
+        )
+        if not result.modified_count:
+            app.fs.delete(storage_id)
+            app.mongo.db.projects.update_one(
+                {'_id': ObjectId(project.get('_id'))},
+                {"$set": {'processing.thumbnail_animated': False}},
+                upsert=False
+            )
+            logger.info(f"Removed outdated animated thumbnail version {project['version']} "
+                        f"in project {project.get('_id')}.")
+            return
+        logger.info(f"Created and saved animated thumbnail {meta.get('width')}x{meta.get('height')} "
+                    f"to {app.fs.__class__.__name__} in project {project.get('_id')}.")
+    except ProcessCancelledError:
+        logger.info(f"Animated thumbnail capturing was cancelled, project {project.get('_id')} was deleted.")
+    except Exception as e:
+        if animated_thumbnail:
+            app.fs.delete(animated_thumbnail['storage_id'])
+        logger.exception(e)
+        try:
+            raise self.retry(max_retries=app.config.get('MAX_RETRIES', 3))
+        except MaxRetriesExceededError:
+            app.mongo.db.projects.update_one(
+                {'_id': ObjectId(project.get('_id'))},
+                {"$set": {'processing.thumbnail_animated': False}},
+                upsert=False
+            )
@@ -4,6 +4,7 @@ from kombu.serialization import register
 from bson import json_util
 
 from .lib.logging import logger
+from .lib.scratch import scratch_job
 
 celery = Celery(__name__)
 TaskBase = celery.Task
@@ -24,14 +25,15 @@ def init_celery(app):
 
     class ContextTask(TaskBase):
         """
-        Enhance `celery.Task` by wrapping the task execution in a flask application context.
+        Enhance `celery.Task` by wrapping the task execution in a flask application context
+        and a scratch job, which removes work files left by the task.
         """
 
         # https://docs.celeryproject.org/en/latest/reference/celery.app.task.html#celery.app.task.Task.abstract
         abstract = True
 
         def __call__(self, *args, **kwargs):
-            with app.app_context():
+            with app.app_context(), scratch_job():
                 try:
                     return super().__call__(*args, **kwargs)
                 except InternalServerError as e:
@@ -0,0 +1,316 @@
+import hashlib
+import json
+import logging
+import weakref
+from datetime import datetime
+from itertools import count
+
+import bson
+from flask import current_app as app
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# names of collections which have indexes created by this process, by mongo client
+_indexed_collections = weakref.WeakKeyDictionary()
+# frames inserted by this process, eviction is checked every `FRAME_CACHE_EVICT_INTERVAL` of them
+_frame_inserts = count()
+
+
+def content_key(content):
+    """
+    Get cache key of a file content
+    :param content: file content
+    :type content: bytes
+    :return: sha256 hex digest
+    :rtype: str
+    """
+
+    return hashlib.sha256(content).hexdigest()
+
+
+def render_key(source_key, changes):
+    """
+    Get cache key of a rendered video
+    :param source_key: cache key of source video, see `content_key`
+    :type source_key: str
+    :param changes: normalized changes applied to source video, see `normalize_changes`
+    :type changes: dict
+    :return: sha256 hex digest
+    :rtype: str
+    """
+
+    return hashlib.sha256(json.dumps({'source': source_key, 'changes': changes}, sort_keys=True).encode()).hexdigest()
+
+
+def get_cached_metadata(key, keyframe_index=False):
+    """
+    Get metadata from `metadata_cache` collection and refresh its access time
+    :param key: cache key, see `content_key`
+    :type key: str
+    :param keyframe_index: packed keyframe index is required as well
+    :type keyframe_index: bool
+    :return: metadata and packed keyframe index (timestamps, positions), or None if it is not cached
+    :rtype: tuple
+    """
+
+    query = {'_id': key}
+    if keyframe_index:
+        query['keyframe_index'] = {'$exists': True}
+    doc = app.mongo.db.metadata_cache.find_one_and_update(query, {'$set': {'access_time': datetime.utcnow()}})
+    if not doc:
+        return None
+
+    packed_index = doc.get('keyframe_index')
+    if packed_index:
+        packed_index = (bytes(packed_index['timestamps']), bytes(packed_index['positions']))
+    return doc['metadata'], packed_index
+
+
+def cache_metadata(key, metadata, packed_index=None):
+    """
+    Save metadata into `metadata_cache` collection.
+    Entries not accessed for `METADATA_CACHE_TTL` seconds are evicted by mongo TTL index.
+    :param key: cache key, see `content_key`
+    :type key: str
+    :param metadata: metadata
+    :type metadata: dict
+    :param packed_index: packed keyframe index (timestamps, positions)
+    :type packed_index: tuple
+    """
+
+    ensure_index(
+        'metadata_cache', 'access_time', 'metadata cache TTL',
+        expireAfterSeconds=app.config.get('METADATA_CACHE_TTL')
+    )
+    doc = {'metadata': metadata, 'access_time': datetime.utcnow()}
+    if packed_index:
+        doc['keyframe_index'] = {
+            'timestamps': bson.Binary(packed_index[0]),
+            'positions': bson.Binary(packed_index[1]),
+        }
+    app.mongo.db.metadata_cache.update_one({'_id': key}, {'$set': doc}, upsert=True)
+
+
+def ensure_index(collection, keys, description, **kwargs):
+    """
+    Create an index of a collection once per mongo client of the process, not on every write
+    :param collection: collection name
+    :type collection: str
+    :param keys: index keys, see `pymongo.collection.Collection.create_index`
+    :type keys: str
+    :param description: index description for log messages
+    :type description: str
+    :param kwargs: index options
+    """
+
+    indexed = _indexed_collections.setdefault(app.mongo, set())
+    if collection in indexed:
+        return
+    try:
+        # no-op if index already exists
+        app.mongo.db[collection].create_index(keys, **kwargs)
+    except OperationFailure as e:
+        # TTL was changed in settings, existing index must be modified manually
+        logger.warning(f"Can't create {description} index: {e}")
+    indexed.add(collection)
+
+
+def get_cached_render(key):
+    """
+    Get rendered video from `render_cache` collection, refresh its access time and count a hit or a miss
+    :param key: cache key, see `render_key`
+    :type key: str
+    :return: storage id of rendered video, its metadata and packed keyframe index (timestamps, positions),
+             or None if it is not cached
+    :rtype: tuple
+    """
+
+    doc = app.mongo.db.render_cache.find_one_and_update(
+        {'_id': key},
+        {'$set': {'access_time': datetime.utcnow()}, '$inc': {'hits': 1}}
+    )
+    _count_render_cache(hits=1 if doc else 0, misses=0 if doc else 1)
+    if not doc:
+        return None
+
+    return doc['storage_id'], doc['metadata'], (bytes(doc['timestamps']), bytes(doc['positions']))
+
+
+def drop_cached_render(key):
+    """
+    Drop an entry of `render_cache` collection whose video is missing in a storage, e.g. it was evicted
+    by another worker after `get_cached_render` had found it. The lookup is counted as a miss.
+    :param key: cache key, see `render_key`
+    :type key: str
+    """
+
+    app.mongo.db.render_cache.delete_one({'_id': key})
+    _count_render_cache(hits=-1, misses=1)
+
+
+def cache_render(key, content, extension, metadata, packed_index):
+    """
+    Save rendered video into a storage and `render_cache` collection.
+    Least recently used videos are evicted when total size exceeds `RENDER_CACHE_MAX_SIZE`.
+    :param key: cache key, see `render_key`
+    :type key: str
+    :param content: rendered video
+    :type content: bytes
+    :param extension: video file extension
+    :type extension: str
+    :param metadata: metadata of rendered video
+    :type metadata: dict
+    :param packed_index: packed keyframe index (timestamps, positions) of rendered video
+    :type packed_index: tuple
+    """
+
+    storage_id = f'render_cache/{key}.{extension}'
+    app.fs.replace(content, storage_id)
+    app.mongo.db.render_cache.replace_one(
+        {'_id': key},
+        {
+            'storage_id': storage_id,
+            'size': len(content),
+            'metadata': metadata,
+            'timestamps': bson.Binary(packed_index[0]),
+            'positions': bson.Binary(packed_index[1]),
+            'access_time': datetime.utcnow(),
+            'hits': 0,
+        },
+        upsert=True
+    )
+    _evict_renders(app.config.get('RENDER_CACHE_MAX_SIZE'))
+
+
+def get_render_cache_stats():
+    """
+    Get render cache metrics
+    :return: hits, misses and evictions counters, number of entries and their total size
+    :rtype: dict
+    """
+
+    stats = app.mongo.db.cache_stats.find_one({'_id': 'render'}) or {}
+    usage = _get_render_cache_usage()
+    return {
+        'hits': stats.get('hits', 0),
+        'misses': stats.get('misses', 0),
+        'evictions': stats.get('evictions', 0),
+        'entries': usage['entries'],
+        'size': usage['size'],
+    }
+
+
+def _get_render_cache_usage():
+    usage = list(app.mongo.db.render_cache.aggregate([
+        {'$group': {'_id': None, 'entries': {'$sum': 1}, 'size': {'$sum': '$size'}}}
+    ]))
+    return usage[0] if usage else {'entries': 0, 'size': 0}
+
+
+def _evict_renders(max_size):
+    size = _get_render_cache_usage()['size']
+    evictions = 0
+    for doc in app.mongo.db.render_cache.find({}, {'storage_id': 1, 'size': 1}).sort('access_time', 1):
+        if size <= max_size:
+            break
+        app.fs.delete(doc['storage_id'])
+        app.mongo.db.render_cache.delete_one({'_id': doc['_id']})
+        size -= doc['size']
+        evictions += 1
+
+    if evictions:
+        logger.info(f"Evicted {evictions} rendered videos from render cache, size is {size} bytes.")
+        _count_render_cache(evictions=evictions)
+
+
+def _count_render_cache(**counters):
+    app.mongo.db.cache_stats.update_one({'_id': 'render'}, {'$inc': counters}, upsert=True)
+
+
+def frame_key(project_id, version, position, width, image_format):
+    """
+    Get cache key of a frame
+    :param project_id: project id
+    :type project_id: bson.objectid.ObjectId
+    :param version: video's version
+    :type version: int
+    :param position: quantized position in seconds
+    :type position: float
+    :param width: frame's width
+    :type width: int
+    :param image_format: 'jpeg' or 'webp'
+    :type image_format: str
+    :return: cache key
+    :rtype: str
+    """
+
+    return f'{project_id}_v{version}_{round(position * 1000)}ms_{width}w.{image_format}'
+
+
+def get_cached_frame(key):
+    """
+    Get frame from `frame_cache` collection and refresh its access time
+    :param key: cache key, see `frame_key`
+    :type key: str
+    :return: frame file stream and mimetype, or None if it is not cached
+    :rtype: tuple
+    """
+
+    doc = app.mongo.db.frame_cache.find_one_and_update({'_id': key}, {'$set': {'access_time': datetime.utcnow()}})
+    if not doc:
+        return None
+
+    return bytes(doc['content']), doc['mimetype']
+
+
+def cache_frame(key, project_id, content, mimetype):
+    """
+    Save frame into `frame_cache` collection, frames are small enough to be kept in db.
+    Least recently used frames are evicted when there are more than `FRAME_CACHE_MAX_ENTRIES` of them,
+    it is checked after every `FRAME_CACHE_EVICT_INTERVAL` frames inserted by the process.
+    :param key: cache key, see `frame_key`
+    :type key: str
+    :param project_id: project the frame was captured from
+    :type project_id: bson.objectid.ObjectId
+    :param content: frame file stream
+    :type content: bytes
+    :param mimetype: frame's mimetype
+    :type mimetype: str
+    """
+
+    ensure_index('frame_cache', 'access_time', 'frame cache access time')
+    result = app.mongo.db.frame_cache.replace_one(
+        {'_id': key},
+        {
+            'project_id': bson.ObjectId(project_id),
+            'content': bson.Binary(content),
+            'mimetype': mimetype,
+            'size': len(content),
+            'access_time': datetime.utcnow(),
+        },
+        upsert=True
+    )
+    # replaced frame doesn't grow the cache
+    if result.upserted_id is not None and next(_frame_inserts) % app.config.get('FRAME_CACHE_EVICT_INTERVAL') == 0:
+        _evict_frames(app.config.get('FRAME_CACHE_MAX_ENTRIES'))
+
+
+def delete_cached_frames(project_id):
+    """
+    Delete cached frames of a project from `frame_cache` collection
+    :param project_id: project the frames were captured from
+    :type project_id: bson.objectid.ObjectId
+    """
+
+    app.mongo.db.frame_cache.delete_many({'project_id': bson.ObjectId(project_id)})
+
+
+def _evict_frames(max_entries):
+    excess = app.mongo.db.frame_cache.estimated_document_count() - max_entries
+    if excess <= 0:
+        return
+
+    keys = [doc['_id'] for doc in app.mongo.db.frame_cache.find({}, {'_id': 1}).sort('access_time', 1).limit(excess)]
+    app.mongo.db.frame_cache.delete_many({'_id': {'$in': keys}})
+    logger.info(f"Evicted {len(keys)} frames from frame cache.")
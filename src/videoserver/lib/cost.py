@@ -0,0 +1,158 @@
+import logging
+import math
+import os
+from datetime import datetime
+from fractions import Fraction
+
+from flask import current_app as app
+
+from .cache import ensure_index
+from .video_editor.plan import compile_plan
+
+logger = logging.getLogger(__name__)
+
+#: frame rate used when video's metadata has none
+DEFAULT_FRAME_RATE = 25
+
+
+def edit_features(metadata, changes, threads=None):
+    """
+    Describe an edit for the cost model.
+    Edits of the same `codec`, `tier`, `preset` and `mode` are comparable, their wall time grows with `work`:
+    megapixels of decoded and encoded frames per ffmpeg thread.
+    :param metadata: metadata of source video
+    :type metadata: dict
+    :param changes: changes for `edit_video`
+    :type changes: dict
+    :param threads: ffmpeg threads, `FFMPEG_THREADS` if not set
+    :type threads: int
+    :return: features
+    :rtype: dict
+    """
+
+    codec = metadata.get('codec_name')
+    tier = changes.get('encoding_tier') or app.config.get('DEFAULT_ENCODING_TIER')
+    profile = app.config.get('ENCODING_PROFILES', {}).get(codec, {}).get(tier) or {}
+    preset = profile.get('preset') or ' '.join(profile.get('options', ())) or app.config.get('FFMPEG_PRESET')
+    trim = changes.get('trim')
+    mode = changes.get('trim_mode') if trim and changes.get('trim_mode') in ('copy', 'smart') else 'encode'
+    if threads is None:
+        threads = int(app.config.get('FFMPEG_THREADS') or 0)
+    # 0 means all available CPUs
+    threads = threads or os.cpu_count() or 1
+
+    duration = trim['end'] - trim['start'] if trim else metadata['duration']
+    frames = duration * _get_frame_rate(metadata)
+    steps = [{rule: changes.get(rule) for rule in ('crop', 'scale', 'rotate')}, *changes.get('filters', ())]
+    plan = compile_plan(steps, metadata['width'], metadata['height'])
+    pixels = metadata['width'] * metadata['height'] + plan.width * plan.height
+
+    return {
+        'codec': codec,
+        'tier': tier,
+        'preset': preset,
+        'mode': mode,
+        'work': frames * pixels / threads / 10 ** 6,
+    }
+
+
+def fit_cost_model(samples):
+    """
+    Fit wall time of edits as `overhead + rate * work` by least squares
+    :param samples: work and wall time in seconds of finished edits
+    :type samples: list
+    :return: overhead in seconds, rate in seconds per unit of work, or None if there are no samples
+    :rtype: tuple
+    """
+
+    if not samples:
+        return None
+
+    mean_work = sum(work for work, _ in samples) / len(samples)
+    mean_seconds = sum(seconds for _, seconds in samples) / len(samples)
+    variance = sum((work - mean_work) ** 2 for work, _ in samples)
+    if variance:
+        rate = sum((work - mean_work) * (seconds - mean_seconds) for work, seconds in samples) / variance
+        overhead = mean_seconds - rate * mean_work
+        if rate > 0 and overhead >= 0:
+            return overhead, rate
+
+    # too few distinct or noisy samples to separate overhead, the whole time is proportional to work
+    return 0.0, mean_seconds / mean_work if mean_work else 0.0
+
+
+def shortest_job_priority(seconds, levels):
+    """
+    Get celery task priority of an edit, every doubling of estimated time above 10 seconds lowers it by one
+    :param seconds: estimated wall time
+    :type seconds: float
+    :param levels: number of priority levels
+    :type levels: int
+    :return: priority from 0 (the longest edits) to `levels - 1` (edits up to 10 seconds)
+    :rtype: int
+    """
+
+    rank = math.ceil(math.log2(seconds / 10)) if seconds > 10 else 0
+    return max(levels - 1 - rank, 0)
+
+
+def estimate_edit_time(metadata, changes):
+    """
+    Estimate wall time of an edit. Cost model is fitted to the latest `COST_MODEL_SAMPLES` timings of comparable
+    edits, `COST_MODEL_PRIORS` are used until there are `COST_MODEL_MIN_SAMPLES` of them.
+    :param metadata: metadata of source video
+    :type metadata: dict
+    :param changes: changes for `edit_video`
+    :type changes: dict
+    :return: estimated `seconds` and number of `samples` the model was fitted to
+    :rtype: dict
+    """
+
+    features = edit_features(metadata, changes)
+    work = features.pop('work')
+    samples = [
+        (doc['work'], doc['seconds']) for doc in app.mongo.db.encode_timings.find(
+            features, {'work': 1, 'seconds': 1}
+        ).sort('create_time', -1).limit(app.config.get('COST_MODEL_SAMPLES'))
+    ]
+    if len(samples) < app.config.get('COST_MODEL_MIN_SAMPLES'):
+        samples = []
+        priors = app.config.get('COST_MODEL_PRIORS')
+        overhead, rate = priors.get(features['mode'], priors.get(features['tier'], priors['standard']))
+    else:
+        overhead, rate = fit_cost_model(samples)
+
+    return {'seconds': round(overhead + rate * work, 1), 'samples': len(samples)}
+
+
+def record_edit_timing(metadata, changes, seconds):
+    """
+    Save wall time of a finished edit into `encode_timings` collection to calibrate the cost model.
+    Timings expire after `COST_MODEL_SAMPLE_TTL` seconds.
+    :param metadata: metadata of source video
+    :type metadata: dict
+    :param changes: changes for `edit_video`
+    :type changes: dict
+    :param seconds: wall time of the edit
+    :type seconds: float
+    """
+
+    ensure_index(
+        'encode_timings', 'create_time', 'encode timings TTL',
+        expireAfterSeconds=app.config.get('COST_MODEL_SAMPLE_TTL')
+    )
+    app.mongo.db.encode_timings.insert_one({
+        **edit_features(metadata, changes),
+        'seconds': seconds,
+        'create_time': datetime.utcnow(),
+    })
+
+
+def _get_frame_rate(metadata):
+    try:
+        frame_rate = float(Fraction(metadata.get('r_frame_rate')))
+    except (TypeError, ValueError, ZeroDivisionError):
+        frame_rate = 0
+    if not frame_rate and metadata.get('nb_frames') and metadata.get('duration'):
+        frame_rate = metadata['nb_frames'] / metadata['duration']
+    return frame_rate or DEFAULT_FRAME_RATE
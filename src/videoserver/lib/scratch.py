@@ -0,0 +1,172 @@
+import logging
+import os
+import shutil
+import socket
+import threading
+from contextlib import contextmanager
+from tempfile import gettempdir, mkdtemp
+
+from flask import current_app as app
+
+logger = logging.getLogger(__name__)
+
+#: directory inside scratch roots which holds directories of jobs, named `<hostname>-<pid>-<random>`
+SCRATCH_NAMESPACE = 'videoserver-scratch'
+
+# scratch directories of a job running in the current thread
+_local = threading.local()
+
+
+class ScratchSpaceError(Exception):
+    """
+    There is not enough free space in a scratch directory to start a job
+    """
+
+
+@contextmanager
+def scratch_job():
+    """
+    Scope work files of a job, e.g. a celery task or a request.
+    Directories given by `scratch_dir` during the job are removed when it ends, even if files were leaked by a failure.
+    """
+
+    previous = getattr(_local, 'dirs', None)
+    _local.dirs = {}
+    try:
+        yield
+    finally:
+        dirs, _local.dirs = _local.dirs, previous
+        for path in dirs.values():
+            _remove_dir(path)
+
+
+def scratch_dir(small=False):
+    """
+    Get scratch directory of the current job, it is created on first use.
+    Outside of a job files are put into a directory of the process, users must remove them.
+    :param small: directory for small files like thumbnails, `SCRATCH_SMALL_DIR`, otherwise `SCRATCH_DIR`
+    :type small: bool
+    :return: directory path
+    :rtype: str
+    """
+
+    dirs = getattr(_local, 'dirs', None)
+    key = 'small' if small else 'video'
+    if dirs is None:
+        path = os.path.join(scratch_root(small), f'{_get_owner()}process')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    if key not in dirs:
+        dirs[key] = mkdtemp(prefix=_get_owner(), dir=scratch_root(small))
+    return dirs[key]
+
+
+def scratch_path(path, suffix, small=False):
+    """
+    Get path of a work file named after another work file, e.g. ffmpeg output named after its input
+    :param path: path of a work file
+    :type path: str
+    :param suffix: suffix which replaces extension of `path`
+    :type suffix: str
+    :param small: path for a small file, see `scratch_dir`
+    :type small: bool
+    :return: file path
+    :rtype: str
+    """
+
+    return os.path.join(scratch_dir(small), f"{os.path.basename(path).rsplit('.', 1)[0]}{suffix}")
+
+
+def scratch_root(small=False):
+    """
+    Get directory which holds scratch directories of jobs
+    :param small: root for small files, see `scratch_dir`
+    :type small: bool
+    :return: directory path
+    :rtype: str
+    """
+
+    root = (app.config.get('SCRATCH_SMALL_DIR') if small else None) or app.config.get('SCRATCH_DIR') or gettempdir()
+    path = os.path.join(root, SCRATCH_NAMESPACE)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def admit(size, small=False):
+    """
+    Check there is enough free space in a scratch directory to start a job on a file.
+    The job needs `SCRATCH_SPACE_FACTOR` times the file size, `SCRATCH_MIN_FREE` bytes must stay free.
+    :param size: size of a file the job works on
+    :type size: int
+    :param small: check space for small files, see `scratch_dir`
+    :type small: bool
+    :raise ScratchSpaceError: there is not enough free space
+    """
+
+    root = scratch_root(small)
+    free = shutil.disk_usage(root).free
+    required = size * app.config.get('SCRATCH_SPACE_FACTOR') + app.config.get('SCRATCH_MIN_FREE')
+    if free < required:
+        raise ScratchSpaceError(f'{free} bytes are free in scratch directory {root}, {required} bytes are required.')
+
+
+def sweep_scratch():
+    """
+    Remove scratch directories leaked by killed processes of this host: directories of processes which are not running
+    and partially removed ones. Directories of other hosts sharing the scratch directory are kept,
+    their jobs may still be running.
+    :return: number of removed directories
+    :rtype: int
+    """
+
+    hostname = socket.gethostname()
+    removed = 0
+    for root in {scratch_root(), scratch_root(small=True)}:
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            try:
+                owner_host, pid, _ = name.rsplit('-', 2)
+                pid = int(pid)
+            except ValueError:
+                continue
+            if owner_host != hostname:
+                continue
+            if not name.endswith('.trash') and _is_running(pid):
+                continue
+
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+            removed += 1
+
+    if removed:
+        logger.info(f"Removed {removed} leaked scratch directories.")
+    return removed
+
+
+def _get_owner():
+    return f'{socket.gethostname()}-{os.getpid()}-'
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # process of another user
+        return True
+    return True
+
+
+def _remove_dir(path):
+    # rename is atomic, so the directory is never seen half removed under its name,
+    # the sweeper removes `.trash` directories left by a killed process
+    trash = f'{path}.trash'
+    try:
+        os.rename(path, trash)
+    except FileNotFoundError:
+        return
+    shutil.rmtree(trash, ignore_errors=True)
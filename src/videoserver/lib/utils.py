@@ -10,6 +10,7 @@ from flask import current_app as app
 from flask import url_for
 from werkzeug.exceptions import BadRequest
 
+from .scratch import admit, scratch_dir
 from .validator import Validator
 
 logger = logging.getLogger(__name__)
@@ -69,6 +70,24 @@ def json_response(doc=None, status=200):
     return Response(JSONEncoder().encode(doc), status=status, mimetype='application/json')
 
 
+def media_url(endpoint, **kwargs):
+    """
+    Build url for reading video/picture files, `FILE_STREAM_PROXY_URL` is used if proxy is enabled
+    :param endpoint: endpoint of a view
+    :type endpoint: str
+    :param kwargs: view's arguments
+    :return: url
+    :rtype: str
+    """
+
+    proxy_enabled = app.config.get('FILE_STREAM_PROXY_ENABLED')
+    url = url_for(endpoint, _external=not proxy_enabled, **kwargs)
+    if proxy_enabled:
+        url = app.config.get('FILE_STREAM_PROXY_URL') + url
+
+    return url
+
+
 def add_urls(doc):
     """
     Add urls for project's media
@@ -77,20 +96,8 @@ def add_urls(doc):
     """
 
     def _handle_doc(doc):
-        PROXY_ENABLED = app.config.get('FILE_STREAM_PROXY_ENABLED')
-        PROXY_URL = app.config.get('FILE_STREAM_PROXY_URL')
-
-        def _url_for(*args, **kwargs):
-            kwargs['_external'] = not PROXY_ENABLED
-            url = url_for(*args, **kwargs)
-
-            if PROXY_ENABLED:
-                url = PROXY_URL + url
-
-            return url
-
         if '_id' in doc:
-            url = _url_for(
+            url = media_url(
                 'projects.get_raw_video',
                 project_id=doc['_id']
             )
@@ -98,18 +105,58 @@ def add_urls(doc):
             doc['url'] = url
 
             for index, thumb in enumerate(doc['thumbnails']['timeline']):
-                thumb['url'] = _url_for(
+                thumb['url'] = media_url(
                     'projects.get_raw_timeline_thumbnail',
                     project_id=doc['_id'],
                     index=index
                 )
 
             if doc['thumbnails']['preview'] or doc['processing']['thumbnail_preview']:
-                doc['thumbnails']['preview']['url'] = _url_for(
+                doc['thumbnails']['preview']['url'] = media_url(
                     'projects.get_raw_preview_thumbnail',
                     project_id=doc['_id']
                 )
 
+            for index, candidate in enumerate(doc['thumbnails'].get('candidates', [])):
+                candidate['url'] = media_url(
+                    'projects.get_raw_candidate_thumbnail',
+                    project_id=doc['_id'],
+                    index=index
+                )
+
+            if doc['thumbnails'].get('animated'):
+                doc['thumbnails']['animated']['url'] = media_url(
+                    'projects.get_raw_animated_thumbnail',
+                    project_id=doc['_id']
+                )
+
+            if doc.get('proxy'):
+                doc['proxy']['url'] = media_url(
+                    'projects.get_raw_proxy',
+                    project_id=doc['_id']
+                )
+
+            for rendition in doc.get('renditions') or []:
+                rendition['url'] = media_url(
+                    'projects.get_raw_rendition',
+                    project_id=doc['_id'],
+                    height=rendition['height']
+                )
+
+            if doc.get('waveform'):
+                doc['waveform']['url'] = media_url(
+                    'projects.get_raw_waveform',
+                    project_id=doc['_id']
+                )
+
+            for stream_format, streaming in (doc.get('streaming') or {}).items():
+                streaming['url'] = media_url(
+                    'projects.get_raw_stream',
+                    project_id=doc['_id'],
+                    stream_format=stream_format,
+                    filename=streaming['playlist']
+                )
+
     if type(doc) is dict:
         _handle_doc(doc)
     elif type(doc) is list:
@@ -136,6 +183,150 @@ def save_activity_log(action, project_id, payload=None):
     })
 
 
+def save_keyframe_index(project_id, version, keyframe_index):
+    """
+    Save keyframe index of project's video version into `keyframes` collection,
+    only the index of the latest version is kept
+    :param project_id: project related to keyframe index
+    :type project_id: bson.objectid.ObjectId
+    :param version: project's version
+    :type version: int
+    :param keyframe_index: keyframe index
+    :type keyframe_index: videoserver.lib.video_editor.keyframes.KeyframeIndex
+    """
+
+    timestamps, positions = keyframe_index.pack()
+    app.mongo.db.keyframes.replace_one(
+        {'_id': bson.ObjectId(project_id)},
+        {
+            '_id': bson.ObjectId(project_id),
+            'version': version,
+            'timestamps': bson.Binary(timestamps),
+            'positions': bson.Binary(positions),
+        },
+        upsert=True
+    )
+
+
+def get_keyframe_index(project):
+    """
+    Get keyframe index of project's current video version from `keyframes` collection.
+    Index is built and saved if it is missing, e.g. for projects created before indexes were introduced.
+    :param project: project doc
+    :type project: dict
+    :return: keyframe index
+    :rtype: videoserver.lib.video_editor.keyframes.KeyframeIndex
+    """
+
+    # avoid circular import, video editor uses utils
+    from videoserver.lib.video_editor import get_video_editor
+    from videoserver.lib.video_editor.keyframes import KeyframeIndex
+
+    doc = app.mongo.db.keyframes.find_one({'_id': bson.ObjectId(project['_id']), 'version': project['version']})
+    if doc:
+        return KeyframeIndex.unpack(doc['timestamps'], doc['positions'])
+
+    _, keyframe_index = get_video_editor().get_meta(app.fs.get(project['storage_id']), keyframe_index=True)
+    save_keyframe_index(project['_id'], project['version'], keyframe_index)
+    logger.info(f"Built missing keyframe index for project {project['_id']} version {project['version']}.")
+    return keyframe_index
+
+
+def save_scenes(project_id, version, threshold, scenes):
+    """
+    Save scenes detected in project's video version into `scenes` collection, only the latest version is kept
+    :param project_id: project related to scenes
+    :type project_id: bson.objectid.ObjectId
+    :param version: project's version
+    :type version: int
+    :param threshold: scene detection threshold
+    :type threshold: float
+    :param scenes: scenes timestamps and scores
+    :type scenes: list
+    """
+
+    # avoid circular import, video editor uses utils
+    from videoserver.lib.video_editor.scenes import pack_scenes
+
+    timestamps, scores = pack_scenes(scenes)
+    app.mongo.db.scenes.replace_one(
+        {'_id': bson.ObjectId(project_id)},
+        {
+            '_id': bson.ObjectId(project_id),
+            'version': version,
+            'threshold': threshold,
+            'timestamps': bson.Binary(timestamps),
+            'scores': bson.Binary(scores),
+        },
+        upsert=True
+    )
+
+
+def get_scenes(project, threshold):
+    """
+    Get scenes of project's current video version from `scenes` collection
+    :param project: project doc
+    :type project: dict
+    :param threshold: scene detection threshold
+    :type threshold: float
+    :return: scenes timestamps and scores, None if they were not detected with `threshold`
+    :rtype: list
+    """
+
+    from videoserver.lib.video_editor.scenes import unpack_scenes
+
+    doc = app.mongo.db.scenes.find_one({
+        '_id': bson.ObjectId(project['_id']),
+        'version': project['version'],
+        'threshold': threshold,
+    })
+    if not doc:
+        return None
+    return unpack_scenes(doc['timestamps'], doc['scores'])
+
+
+def get_source_stream(project, height=None):
+    """
+    Get a file stream to capture frames from.
+    Proxy is used if it is up to date and at least `height` pixels high, original video otherwise.
+    :param project: project doc
+    :type project: dict
+    :param height: height of captured frames, None means the full resolution is required
+    :type height: int
+    :return: file stream
+    :rtype: bytes
+    """
+
+    proxy = project.get('proxy')
+    if height and proxy and proxy['version'] == project['version'] and proxy['height'] >= height:
+        return app.fs.get(proxy['storage_id'])
+    return app.fs.get(project['storage_id'])
+
+
+def delete_edit_previews(project_id):
+    """
+    Delete edit previews of a project from `edit_previews` collection and a storage
+    :param project_id: project related to edit previews
+    :type project_id: bson.objectid.ObjectId
+    """
+
+    for preview in app.mongo.db.edit_previews.find({'project_id': bson.ObjectId(project_id)}):
+        app.fs.delete(preview['storage_id'])
+    app.mongo.db.edit_previews.delete_many({'project_id': bson.ObjectId(project_id)})
+
+
+def delete_streaming_files(project_id):
+    """
+    Delete adaptive streaming playlists and segments of a project from `streaming` collection and a storage
+    :param project_id: project related to streaming files
+    :type project_id: bson.objectid.ObjectId
+    """
+
+    for file in app.mongo.db.streaming.find({'project_id': bson.ObjectId(project_id)}, {'storage_id': 1}):
+        app.fs.delete(file['storage_id'])
+    app.mongo.db.streaming.delete_many({'project_id': bson.ObjectId(project_id)})
+
+
 def validate_document(document, schema, **kwargs):
     """
     Validate `document` against provided `schema`
@@ -242,16 +433,18 @@ def get_request_address(request_headers):
 
 def create_temp_file(file_stream, suffix=None):
     """
-    Saves `file_stream` into /tmp directory
+    Saves `file_stream` into scratch directory of the current job, see `videoserver.lib.scratch`
     :param file_stream: file to save
     :type file_stream: bytes
     :param suffix: the file name will end with that suffix, otherwise there will be no suffix.
     :type suffix: str
     :return: file path
     :rtype: str
+    :raise ScratchSpaceError: there is not enough free space to work on the file
     """
 
-    fd, path = mkstemp(suffix=suffix)
+    admit(len(file_stream))
+    fd, path = mkstemp(suffix=suffix, dir=scratch_dir())
 
     with open(fd, "wb") as f:
         f.write(file_stream)
@@ -2,13 +2,16 @@ from flask import current_app as app
 
 from .ffmpeg import FFMPEGVideoEditor
 from .moviepy import MoviePyVideoEditor
+from .pyav import PyAVVideoEditor
 
 
-def get_video_editor(name=None):
+def get_video_editor(name=None, cancel_check=None):
     """
     Instantinates and returns selected video editor
-    :param name: name of video editor. Options: 'ffmpeg'
+    :param name: name of video editor. Options: 'ffmpeg', 'pyav'
     :type name: str
+    :param cancel_check: editing is cancelled if it returns True, see `VideoEditorInterface`
+    :type cancel_check: callable
     :return: instance of video editor
     """
 
@@ -16,8 +19,10 @@ def get_video_editor(name=None):
         name = app.config.get("DEFAULT_MEDIA_TOOL")
 
     if name == 'ffmpeg':
-        return FFMPEGVideoEditor()
+        return FFMPEGVideoEditor(cancel_check=cancel_check)
+    elif name == 'pyav':
+        return PyAVVideoEditor(cancel_check=cancel_check)
     elif name == 'moviepy':
-        return MoviePyVideoEditor()
+        return MoviePyVideoEditor(cancel_check=cancel_check)
 
     raise Exception(f"Video editor backend with '{name}' does not exist.")
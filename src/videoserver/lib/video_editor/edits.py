@@ -0,0 +1,113 @@
+from .plan import scaled_size
+
+#: edit rules applied to video frames, in order they are applied within one edit
+SPATIAL_RULES = ('crop', 'scale', 'rotate')
+
+
+def apply_edit(metadata, edit):
+    """
+    Get metadata of a video as it will be after an edit is rendered.
+    Only `width`, `height` and `duration` are changed, the same way ffmpeg filters change them.
+    :param metadata: video's metadata
+    :type metadata: dict
+    :param edit: edit rules
+    :type edit: dict
+    :return: metadata of edited video
+    :rtype: dict
+    """
+
+    metadata = dict(metadata)
+    if 'trim' in edit:
+        metadata['duration'] = edit['trim']['end'] - edit['trim']['start']
+    if 'crop' in edit:
+        metadata['width'] = edit['crop']['width']
+        metadata['height'] = edit['crop']['height']
+    if 'scale' in edit:
+        # `scale=<width>:-2`, width is even and half of height is rounded once and doubled, see `scaled_size`
+        metadata['width'], metadata['height'] = scaled_size(
+            edit['scale'] - edit['scale'] % 2, metadata['width'], metadata['height']
+        )
+    if edit.get('rotate') and edit['rotate'] % 180:
+        metadata['width'], metadata['height'] = metadata['height'], metadata['width']
+
+    return metadata
+
+
+def compose_edits(edits):
+    """
+    Compose a list of edits into changes for one `edit_video` call, so video is decoded and encoded only once.
+    Trims are composed into one trim of the source video, crop, scale and rotate rules of every edit
+    are kept in order in `filters`.
+    :param edits: edits in order they were made, trim of every edit is relative to the previous edits
+    :type edits: list
+    :return: changes, `trim` and `trim_mode` if video is trimmed, `filters` if frames are changed,
+             `encoding_tier` of the last edit which sets it
+    :rtype: dict
+    """
+
+    start = 0
+    end = None
+    trim_mode = None
+    encoding_tier = None
+    filters = []
+    for edit in edits:
+        encoding_tier = edit.get('encoding_tier', encoding_tier)
+        if 'trim' in edit:
+            offset = start
+            start = offset + edit['trim']['start']
+            end = offset + edit['trim']['end'] if end is None else min(end, offset + edit['trim']['end'])
+            trim_mode = edit.get('trim_mode')
+        rules = {rule: edit[rule] for rule in SPATIAL_RULES if rule in edit}
+        if rules:
+            filters.append(rules)
+
+    changes = {}
+    if end is not None:
+        changes['trim'] = {'start': start, 'end': end}
+        # copy and smart trims can't be combined with filters
+        changes['trim_mode'] = 'accurate' if filters else trim_mode
+    if filters:
+        changes['filters'] = filters
+    if encoding_tier:
+        changes['encoding_tier'] = encoding_tier
+
+    return changes
+
+
+def normalize_changes(changes):
+    """
+    Normalize changes, so edits which produce the same video are equal.
+    Trim is rounded to milliseconds, scale is rounded down to an even width as ffmpeg does,
+    rotations are clockwise in range 90-270, edit rules without effect are dropped.
+    :param changes: changes for `edit_video`
+    :type changes: dict
+    :return: normalized changes
+    :rtype: dict
+    """
+
+    normalized = {}
+    if changes.get('trim'):
+        normalized['trim'] = {
+            'start': round(float(changes['trim']['start']), 3),
+            'end': round(float(changes['trim']['end']), 3),
+        }
+        normalized['trim_mode'] = changes.get('trim_mode') or 'accurate'
+
+    filters = []
+    for rules in ({rule: changes[rule] for rule in SPATIAL_RULES if changes.get(rule)}, *changes.get('filters', [])):
+        rules = {rule: value for rule, value in rules.items() if value}
+        if 'scale' in rules:
+            rules['scale'] -= rules['scale'] % 2
+        if 'rotate' in rules:
+            # -90 and 270 transpose frames the same way
+            rules['rotate'] %= 360
+            if not rules['rotate']:
+                del rules['rotate']
+        if rules:
+            filters.append(rules)
+    if filters:
+        normalized['filters'] = filters
+    if changes.get('encoding_tier'):
+        normalized['encoding_tier'] = changes['encoding_tier']
+
+    return normalized
@@ -1,16 +1,84 @@
+import bisect
 import json
 import logging
 import os
-import shlex
-import subprocess
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import mkdtemp
 
 from flask import current_app as app
 
+from videoserver.lib.cache import cache_metadata, content_key, get_cached_metadata
+from videoserver.lib.scratch import scratch_dir, scratch_path
 from videoserver.lib.utils import create_temp_file
-from .interface import VideoEditorInterface
+from .interface import TIMELINE_THUMBNAIL_HEIGHT, VideoEditorInterface
+from .keyframes import KeyframeIndex, plan_segments
+from .mp4 import is_faststart
+from .plan import compile_plan
+from .scenes import parse_scene_scores, pick_scenes
+from .process import resource, run_process
 
 logger = logging.getLogger(__name__)
 
+#: ffprobe profile names mapped to libx264 profiles
+H264_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+
+#: codecs which can be copied into adaptive streaming formats without encoding
+STREAMING_CODECS = {
+    'hls': {'video': ('h264',), 'audio': ('aac', 'mp3')},
+    'dash': {'video': ('h264', 'vp9', 'av1'), 'audio': ('aac', 'opus')},
+}
+
+#: max `lowres` of decoders which can decode frames at 1/2, 1/4 or 1/8 of their size
+# https://ffmpeg.org/ffmpeg-codecs.html#Codec-Options
+LOWRES_DECODERS = {'mjpeg': 3, 'mpeg1video': 3, 'mpeg2video': 3, 'mpeg4': 3, 'h263': 3}
+
+#: max number of inputs of one ffmpeg run capturing keyframes
+KEYFRAME_CAPTURE_BATCH = 50
+
+#: max difference in seconds between a known scene timestamp and a timestamp of a frame captured for it
+SCENE_TIMESTAMP_TOLERANCE = 0.0005
+
+
+def parse_progress(block):
+    """
+    Parse progress block written by ffmpeg `-progress` option
+    :param block: progress block, key-value pairs
+    :type block: dict
+    :return: progress with `out_time` (seconds of output written), `speed` (relative to realtime),
+             `fps` and `end` flag. `speed` and `fps` are None if ffmpeg didn't report them yet.
+    :rtype: dict
+    """
+
+    def to_float(value):
+        try:
+            return float(value.rstrip('x'))
+        except (AttributeError, ValueError):
+            return None
+
+    out_time = 0.0
+    if to_float(block.get('out_time_us')) is not None:
+        out_time = float(block['out_time_us']) / 1000000
+    elif block.get('out_time', 'N/A') != 'N/A' and not block['out_time'].startswith('-'):
+        hours, minutes, seconds = block['out_time'].split(':')
+        out_time = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    return {
+        'out_time': max(out_time, 0.0),
+        'speed': to_float(block.get('speed')) or None,
+        'fps': to_float(block.get('fps')) or None,
+        'end': block.get('progress') == 'end',
+    }
+
 
 class FFMPEGVideoEditor(VideoEditorInterface):
     """
@@ -28,24 +96,49 @@ class FFMPEGVideoEditor(VideoEditorInterface):
       https://trac.ffmpeg.org/wiki/Scaling
     """
 
-    def get_meta(self, filestream, extension='tmp'):
+    def get_meta(self, filestream, extension='tmp', keyframe_index=False):
         """
         Use ffmpeg tool for getting metadata of file
         :param filestream: file to get meta from
         :type filestream: bytes
-        :return: metadata
+        :param keyframe_index: build keyframe index in the same ffprobe pass
+        :type keyframe_index: bool
+        :return: metadata, or metadata and `KeyframeIndex` if `keyframe_index` is set
         :rtype: dict
         """
 
+        cached = self._get_cached_meta(filestream, keyframe_index)
+        if cached:
+            return cached
+
         file_temp_path = create_temp_file(filestream)
         try:
-            metadata = self._get_meta(file_temp_path)
+            result = self._get_meta(file_temp_path, keyframe_index=keyframe_index)
         finally:
             os.remove(file_temp_path)
 
-        return metadata
+        self._cache_meta(filestream, result, keyframe_index)
+        return result
+
+    def get_keyframes(self, filestream):
+        """
+        Use ffprobe tool for getting keyframes timestamps of file
+        :param filestream: file to get keyframes from
+        :type filestream: bytes
+        :return: sorted keyframes timestamps
+        :rtype: list
+        """
+
+        file_temp_path = create_temp_file(filestream)
+        try:
+            keyframes = self._get_keyframes(file_temp_path)
+        finally:
+            os.remove(file_temp_path)
+
+        return keyframes
 
-    def edit_video(self, stream_file, filename, trim=None, crop=None, rotate=None, scale=None):
+    def edit_video(self, stream_file, filename, trim=None, crop=None, rotate=None, scale=None, trim_mode=None,
+                   progress_callback=None, keyframes=None, keyframe_index=False, filters=None, encoding_tier=None):
         """
         Use ffmpeg tool for edit video
         :param stream_file: file to edit
@@ -60,78 +153,437 @@ class FFMPEGVideoEditor(VideoEditorInterface):
         :type video_rotate: int
         :param scale: width scale to
         :type scale: int
-        :return:
+        :param trim_mode: 'accurate' re-encodes trimmed video, 'copy' cuts it using stream copy,
+                          so `trim` must be aligned to keyframes, 'smart' re-encodes only GOPs at the cut points
+        :type trim_mode: str
+        :param progress_callback: called with parsed ffmpeg progress while video is encoded
+        :type progress_callback: callable
+        :param keyframes: keyframes timestamps of `stream_file` if they are known, file is probed otherwise
+        :type keyframes: list
+        :param keyframe_index: build keyframe index of edited video in the same ffprobe pass as metadata
+        :type keyframe_index: bool
+        :param filters: crop, scale and rotate rules applied one after another after `crop`, `scale` and `rotate`
+        :type filters: list
+        :param encoding_tier: speed tier of `ENCODING_PROFILES` used for re-encoding, `DEFAULT_ENCODING_TIER` if not set
+        :type encoding_tier: str
+        :return: file stream, metadata and `KeyframeIndex` if `keyframe_index` is set
         """
 
+        if trim_mode in ('copy', 'smart') and (crop or rotate or scale or filters):
+            raise ValueError(f"'{trim_mode}' trim can't be combined with crop, rotate or scale")
+
         # file extension is required by ffmpeg
         path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
         path_output = '{}_edit.{}'.format(*path_input.rsplit('.', 1))
-        filter_string = ''
         try:
+            if trim and trim_mode == 'copy':
+                # https://ffmpeg.org/ffmpeg.html#Stream-copy
+                # input seeking lands on a keyframe, no re-encoding needed
+                self._run_ffmpeg(
+                    path_input=path_input,
+                    path_output=path_output,
+                    preoptions=('-ss', str(trim['start'])),
+                    options=(
+                        '-t', str(trim['end'] - trim['start']),
+                        '-c', 'copy',
+                        '-avoid_negative_ts', 'make_zero',
+                    ),
+                    duration=trim['end'] - trim['start'],
+                    progress_callback=progress_callback
+                )
+                trim = None
+            elif trim and trim_mode == 'smart':
+                if self._smart_trim(path_input, path_output, trim['start'], trim['end'], keyframes, encoding_tier):
+                    trim = None
             # get option for trim
             trim_option = (
                 '-ss', str(trim['start']),
                 '-t', str(trim['end'] - trim['start']),
-                '-qscale', '0',
             ) if trim else tuple()
-            # crop
-            # https://ffmpeg.org/ffmpeg-filters.html#crop
-            if crop:
-                filter_string += f'crop={crop["width"]}:{crop["height"]}:{crop["x"]}:{crop["y"]}'
-            # scale
-            # http://ffmpeg.org/ffmpeg-filters.html#scale
-            # https://trac.ffmpeg.org/wiki/Scaling
-            if scale:
-                filter_string += ',' if filter_string != '' else ''
-                # avoid width not divisible by 2
-                if scale % 2 == 1:
-                    scale -= 1
-                filter_string += f"scale={scale}:-2"
-            # rotate
-            # https://ffmpeg.org/ffmpeg-all.html#transpose
-            # 0 = 90CounterCLockwise and Vertical Flip (default)
-            # 1 = 90Clockwise
-            # 2 = 90CounterClockwise
-            # 3 = 90Clockwise and Vertical Flip
-            if rotate:
-                rotate_string = ''
-                if rotate == 90:
-                    rotate_string = 'transpose=1'
-                elif rotate == -90:
-                    rotate_string = 'transpose=2'
-                elif rotate == 180:
-                    rotate_string = 'transpose=1,transpose=1'
-                elif rotate == -180:
-                    rotate_string = 'transpose=2,transpose=2'
-                elif rotate == 270:
-                    rotate_string = 'transpose=1,transpose=1,transpose=1'
-                elif rotate == -270:
-                    rotate_string = 'transpose=2,transpose=2,transpose=2'
-                filter_string += ',' if filter_string != '' else ''
-                filter_string += rotate_string
+            video = self._get_streams(path_input)[0] if trim_option or crop or rotate or scale or filters else None
+            filter_string = self._get_filter_chain(
+                crop=crop, rotate=rotate, scale=scale, filters=filters, size=self._get_frame_size(video)
+            ) if video else ''
             # get option for filter
             filter_option = ('-filter:v', filter_string) if filter_string else tuple()
+            encode_options = (
+                *filter_option,
+                *self._get_encode_options(video['codec_name'], encoding_tier),
+                '-threads', str(app.config.get('FFMPEG_THREADS')),
+            ) if filter_option or trim_option else tuple()
+            duration = trim['end'] - trim['start'] if trim else self._get_stream_duration(video) if video else None
+            split_points = self._plan_local_segments(path_input, duration, keyframes) \
+                if filter_option and not trim_option else []
             # run ffmpeg
-            if filter_option or trim_option:
+            if split_points:
+                # encode long video in parallel segments
+                self._encode_segments(path_input, split_points, encode_options, progress_callback, duration)
+            elif filter_option or trim_option:
                 # combine trim and filter to run one time
                 self._run_ffmpeg(
                     path_input=path_input,
                     path_output=path_output,
                     options=(
                         *trim_option,
-                        *filter_option,
-                        '-threads', str(app.config.get('FFMPEG_THREADS')),
-                        '-preset', app.config.get('FFMPEG_PRESET')
-                    )
+                        *encode_options
+                    ),
+                    progress_callback=progress_callback,
+                    duration=duration
                 )
+            self._faststart(path_input)
             content = open(path_input, 'rb+').read()
-            metadata_edit_file = self._get_meta(path_input)
+            result = self._get_meta(path_input, keyframe_index=keyframe_index)
         finally:
             if path_input:
                 os.remove(path_input)
-        return content, metadata_edit_file
+        self._cache_meta(content, result, keyframe_index)
+        if keyframe_index:
+            return (content, *result)
+        return content, result
+
+    def split_video(self, stream_file, filename, segments_amount, keyframes=None):
+        """
+        Use ffmpeg tool to split video at keyframes into segments of roughly equal duration.
+        Video stream is copied, audio is dropped, use `concat_videos` to put it back.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param segments_amount: desired number of segments
+        :type segments_amount: int
+        :param keyframes: keyframes timestamps of `stream_file` if they are known, file is probed otherwise
+        :type keyframes: list
+        :return: segments file streams
+        :rtype: list
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        path_segments = []
+        try:
+            if keyframes is None:
+                keyframes = self._get_keyframes(path_input)
+            split_points = plan_segments(keyframes, self._get_meta(path_input)['duration'], segments_amount)
+            path_segments = self._split_video(path_input, split_points)
+            segments = []
+            for path_segment in path_segments:
+                with open(path_segment, 'rb') as f:
+                    segments.append(f.read())
+        finally:
+            for path in (path_input, *path_segments):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return segments
+
+    def concat_videos(self, streams, filename, audio_stream, keyframe_index=False):
+        """
+        Use ffmpeg tool to concatenate video segments and mux them with audio of `audio_stream`.
+        :param streams: video segments
+        :type streams: list
+        :param filename: tmp video's file name
+        :type filename: str
+        :param audio_stream: video file to take audio from
+        :type audio_stream: bytes
+        :param keyframe_index: build keyframe index of concatenated video in the same ffprobe pass as metadata
+        :type keyframe_index: bool
+        :return: file stream, metadata and `KeyframeIndex` if `keyframe_index` is set
+        :rtype: bytes, dict
+        """
+
+        suffix = f".{filename.rsplit('.', 1)[-1]}"
+        path_input = create_temp_file(audio_stream, suffix=suffix)
+        path_segments = []
+        try:
+            for stream in streams:
+                path_segments.append(create_temp_file(stream, suffix=suffix))
+            self._concat_videos(path_segments, path_input)
+            self._faststart(path_input)
+            with open(path_input, 'rb') as f:
+                content = f.read()
+            result = self._get_meta(path_input, keyframe_index=keyframe_index)
+        finally:
+            for path in (path_input, *path_segments):
+                os.remove(path)
+        self._cache_meta(content, result, keyframe_index)
+
+        if keyframe_index:
+            return (content, *result)
+        return content, result
+
+    def faststart(self, stream_file, filename):
+        """
+        Use ffmpeg tool to move `moov` box of mp4/mov video to the beginning of a file, streams are copied.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :return: file stream, the same `stream_file` if it is already fast-start or it is not mp4/mov
+        :rtype: bytes
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        try:
+            if not self._faststart(path_input):
+                return stream_file
+            with open(path_input, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(path_input)
+
+    def create_proxy(self, stream_file, filename, height):
+        """
+        Use ffmpeg tool to create a low resolution, fast seeking proxy of a video.
+        Proxy is h264/aac mp4 with a keyframe every `PROXY_KEYFRAME_INTERVAL` seconds.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param height: proxy's height, width keeps aspect ratio
+        :type height: int
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        path_output = f"{path_input.rsplit('.', 1)[0]}_proxy.mp4"
+        try:
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=path_output,
+                options=(
+                    '-map', '0:v:0', '-map', '0:a:0?',
+                    '-filter:v', f'scale=-2:{height}',
+                    '-c:v', 'libx264',
+                    '-pix_fmt', 'yuv420p',
+                    '-crf', str(app.config.get('PROXY_CRF')),
+                    # short GOP, so any frame is decoded quickly after a seek
+                    # https://ffmpeg.org/ffmpeg.html#Advanced-Video-options
+                    '-force_key_frames', f"expr:gte(t,n_forced*{app.config.get('PROXY_KEYFRAME_INTERVAL')})",
+                    '-c:a', 'aac', '-b:a', '64k',
+                    '-movflags', '+faststart',
+                    '-threads', str(app.config.get('FFMPEG_THREADS')),
+                    '-preset', 'veryfast',
+                ),
+                override=False
+            )
+            with open(path_output, 'rb') as f:
+                content = f.read()
+            metadata = self._get_meta(path_output)
+        finally:
+            for path in (path_input, path_output):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return content, metadata
+
+    def create_renditions(self, stream_file, filename, ladder):
+        """
+        Use ffmpeg tool to encode a video into several resolutions in one pass.
+        Video is decoded once, `split` filter feeds decoded frames to a scaler and an encoder of every rendition.
+        Renditions are h264/aac mp4 encoded with the default encoding profile, bitrate is capped,
+        keyframes are aligned across renditions, so a player can switch between them.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param ladder: renditions, `height` and max `bitrate` in bits per second
+        :type ladder: list
+        :return: file stream and metadata of every rendition in order of `ladder`
+        :rtype: list
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        path_outputs = [f"{path_input.rsplit('.', 1)[0]}_{rendition['height']}p.mp4" for rendition in ladder]
+        try:
+            # https://ffmpeg.org/ffmpeg-filters.html#split_002c-asplit
+            graph = ';'.join((
+                f"[0:v:0]split={len(ladder)}{''.join(f'[s{index}]' for index in range(len(ladder)))}",
+                *(f"[s{index}]scale=-2:{rendition['height']}[v{index}]" for index, rendition in enumerate(ladder)),
+            ))
+            options = ['-filter_complex', graph]
+            for index, (rendition, path_output) in enumerate(zip(ladder, path_outputs)):
+                options.extend((
+                    '-map', f'[v{index}]', '-map', '0:a:0?',
+                    *self._get_encode_options('h264'),
+                    # capped crf, https://trac.ffmpeg.org/wiki/Encode/H.264#AdditionalInformationTips
+                    '-maxrate', str(rendition['bitrate']), '-bufsize', str(rendition['bitrate'] * 2),
+                    '-pix_fmt', 'yuv420p',
+                    '-c:a', 'aac', '-b:a', '128k',
+                    '-movflags', '+faststart',
+                    '-threads', str(app.config.get('FFMPEG_THREADS')),
+                ))
+                # the last output path is added by `_run_ffmpeg`
+                if index < len(ladder) - 1:
+                    options.append(path_output)
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=path_outputs[-1],
+                options=options,
+                override=False
+            )
+            renditions = []
+            for path_output in path_outputs:
+                with open(path_output, 'rb') as f:
+                    renditions.append((f.read(), self._get_meta(path_output)))
+        finally:
+            for path in (path_input, *path_outputs):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return renditions
+
+    def package_stream(self, stream_file, filename, stream_format, prefix, segment_duration):
+        """
+        Use ffmpeg tool to package a video for adaptive streaming.
+        Streams are copied if `stream_format` supports their codecs, otherwise they are encoded to h264/aac,
+        copied video is cut into segments at its keyframes.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param stream_format: 'hls' or 'dash'
+        :type stream_format: str
+        :param prefix: prefix of playlist and segments file names
+        :type prefix: str
+        :param segment_duration: target duration of segments in seconds
+        :type segment_duration: float
+        :return: playlist file name, playlist and segments file streams by file names
+        :rtype: str, dict
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        path_dir = mkdtemp(dir=scratch_dir())
+        try:
+            video, audio = self._get_streams(path_input)
+            codecs = STREAMING_CODECS[stream_format]
+            options = ['-map', '0:v:0', '-map', '0:a:0?']
+            if video['codec_name'] in codecs['video']:
+                options.extend(('-c:v', 'copy'))
+            else:
+                options.extend((*self._get_encode_options('h264'), '-pix_fmt', 'yuv420p',
+                                '-threads', str(app.config.get('FFMPEG_THREADS'))))
+            if audio is None or audio['codec_name'] in codecs['audio']:
+                options.extend(('-c:a', 'copy'))
+            else:
+                options.extend(('-c:a', 'aac', '-b:a', '128k'))
+
+            if stream_format == 'hls':
+                # https://ffmpeg.org/ffmpeg-formats.html#hls-2
+                playlist = f'{prefix}.m3u8'
+                options.extend((
+                    '-f', 'hls',
+                    '-hls_time', str(segment_duration),
+                    '-hls_playlist_type', 'vod',
+                    '-hls_segment_filename', os.path.join(path_dir, f'{prefix}_%05d.ts'),
+                ))
+            else:
+                # https://ffmpeg.org/ffmpeg-formats.html#dash-2
+                playlist = f'{prefix}.mpd'
+                options.extend((
+                    '-f', 'dash',
+                    '-seg_duration', str(segment_duration),
+                    '-use_template', '1',
+                    '-use_timeline', '1',
+                    '-init_seg_name', f'{prefix}_init_$RepresentationID$.m4s',
+                    '-media_seg_name', f'{prefix}_$RepresentationID$_$Number%05d$.m4s',
+                ))
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=os.path.join(path_dir, playlist),
+                options=options,
+                override=False,
+                duration=self._get_stream_duration(video)
+            )
+            files = {}
+            for name in sorted(os.listdir(path_dir)):
+                with open(os.path.join(path_dir, name), 'rb') as f:
+                    files[name] = f.read()
+        finally:
+            os.remove(path_input)
+            shutil.rmtree(path_dir, ignore_errors=True)
+
+        return playlist, files
+
+    def preview_edit(self, stream_file, filename, height, duration, trim=None, crop=None, rotate=None, scale=None,
+                     filters=None, position=None):
+        """
+        Use ffmpeg tool to render a low resolution sample of an edited video, or a single frame of it.
+        Filters are the same as `edit_video` applies, sample is encoded with `ultrafast` preset.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param height: preview's height, width keeps aspect ratio
+        :type height: int
+        :param duration: max duration of a sample
+        :type duration: float
+        :param trim: trim editing rules
+        :type trim: dict
+        :param crop: crop editing rules
+        :type crop: dict
+        :param rotate: rotate degree
+        :type rotate: int
+        :param scale: width scale to
+        :type scale: int
+        :param filters: crop, scale and rotate rules applied one after another after `crop`, `scale` and `rotate`
+        :type filters: list
+        :param position: if set, a frame at this position of edited video is rendered instead of a sample
+        :type position: float
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
 
-    def capture_thumbnail(self, stream_file, filename, duration, position, crop=None, rotate=0):
+        start = trim['start'] if trim else 0
+        if trim:
+            duration = min(duration, trim['end'] - trim['start'])
+        filter_string = ','.join(filter(None, (
+            self._get_filter_chain(crop=crop, rotate=rotate, scale=scale, filters=filters),
+            f'scale=-2:{height}'
+        )))
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        if position is None:
+            path_output = f"{path_input.rsplit('.', 1)[0]}_edit_preview.mp4"
+            mimetype = 'video/mp4'
+            options = (
+                '-t', str(duration),
+                '-map', '0:v:0', '-map', '0:a:0?',
+                '-filter:v', filter_string,
+                '-c:v', 'libx264',
+                '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac', '-b:a', '64k',
+                '-movflags', '+faststart',
+                '-threads', str(app.config.get('FFMPEG_THREADS')),
+                '-preset', 'ultrafast',
+            )
+        else:
+            start += position
+            duration = 0
+            path_output = f"{path_input.rsplit('.', 1)[0]}_edit_preview.png"
+            mimetype = 'image/png'
+            options = ('-frames:v', '1', '-filter:v', filter_string)
+        try:
+            # input seeking, only a requested part of the video is decoded
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=path_output,
+                preoptions=('-ss', str(start)),
+                options=options,
+                override=False,
+                duration=duration
+            )
+            with open(path_output, 'rb') as f:
+                content = f.read()
+            metadata = self._get_meta(path_output)
+            metadata['mimetype'] = mimetype
+        finally:
+            for path in (path_input, path_output):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return content, metadata
+
+    def capture_thumbnail(self, stream_file, filename, duration, position, crop=None, rotate=0, fast=False):
         """
         Use ffmpeg tool to capture video frame at a position.
         :param stream_file: video file
@@ -146,6 +598,8 @@ class FFMPEGVideoEditor(VideoEditorInterface):
         :type crop: dict
         :param rotate: rotate degree
         :type rotate: int
+        :param fast: capture the keyframe at or before the position, only this keyframe is decoded
+        :type fast: bool
         :return: file stream, metadata
         :rtype: bytes, dict
         """
@@ -156,28 +610,29 @@ class FFMPEGVideoEditor(VideoEditorInterface):
             if int(duration) <= int(position):
                 position = duration - 0.1
             # create output file path
-            output_file = f"{path_video}_preview_thumbnail.png"
+            output_file = scratch_path(path_video, '_preview_thumbnail.png', small=True)
 
-            vfilter = ''
-            if crop:
-                vfilter = f'-vf crop={crop["width"]}:{crop["height"]}:{crop["x"]}:{crop["y"]}'
-            if rotate:
-                vfilter += ',' if vfilter else '-vf '
-                transpose = 'transpose=1' if rotate > 0 else 'transpose=2'
-                vfilter += ','.join([transpose] * abs(rotate // 90))
+            vfilter = self._get_filter_chain(crop=crop, rotate=rotate)
+            if fast:
+                # https://trac.ffmpeg.org/wiki/Seeking
+                seek_preoptions, seek_options = (*self._get_keyframe_options(), '-ss', str(position)), ()
+            else:
+                seek_preoptions, seek_options = ('-accurate_seek',), ('-ss', str(position))
 
             try:
                 # run ffmpeg command
                 self._run_ffmpeg(
                     path_input=path_video,
                     path_output=output_file,
-                    preoptions=('-y', '-accurate_seek'),
+                    preoptions=('-y', *seek_preoptions),
                     options=(
-                        '-ss', str(position),
+                        *seek_options,
                         '-vframes', '1',
-                        *shlex.split(vfilter),
+                        *(('-filter:v', vfilter) if vfilter else ()),
                     ),
                     override=False,
+                    # single frame is captured
+                    duration=0,
                 )
                 # get metadata
                 thumbnail_metadata = self._get_meta(output_file)
@@ -193,7 +648,117 @@ class FFMPEGVideoEditor(VideoEditorInterface):
         finally:
             os.remove(path_video)
 
-    def capture_timeline_thumbnails(self, stream_file, filename, duration, thumbnails_amount):
+    def capture_thumbnails(self, stream_file, filename, duration, captures):
+        """
+        Use ffmpeg tool to capture video frames at several positions in one run.
+        Every position is a separate input seeked to the nearest keyframe, so only frames between it
+        and the position are decoded, every frame is filtered and written into its own output.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param duration: video's duration
+        :type duration: float
+        :param captures: `position` of every frame with optional `crop` rules and `rotate` degree
+        :type captures: list
+        :return: file stream and metadata of every frame in order of `captures`
+        :rtype: list
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        paths_output = [scratch_path(path_input, f'_capture_{index}.png', small=True) for index in range(len(captures))]
+        # avoid the last frame, it is null
+        positions = [max(min(capture['position'], duration - 0.1), 0) for capture in captures]
+        try:
+            inputs = []
+            outputs = []
+            for index, capture in enumerate(captures):
+                if index:
+                    # https://trac.ffmpeg.org/wiki/Seeking
+                    inputs.extend(('-ss', str(positions[index]), '-i', path_input))
+                vfilter = self._get_filter_chain(crop=capture.get('crop'), rotate=capture.get('rotate'))
+                outputs.extend((
+                    '-map', f'{index}:v:0',
+                    '-frames:v', '1',
+                    *(('-filter:v', vfilter) if vfilter else ()),
+                ))
+                if index < len(captures) - 1:
+                    outputs.append(paths_output[index])
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=paths_output[-1],
+                preoptions=('-y', '-ss', str(positions[0])),
+                options=(*inputs, *outputs),
+                override=False,
+                # single frames are captured
+                duration=0
+            )
+
+            return [self._read_png(path_output) for path_output in paths_output]
+        finally:
+            for path in (path_input, *paths_output):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def capture_frame(self, stream_file, filename, duration, position, width, image_format):
+        """
+        Use ffmpeg tool to capture a scaled video frame at a position.
+        Input is seeked to the keyframe before the position and decoded from there, so only one GOP is decoded.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param duration: video's duration
+        :type duration: float
+        :param position: video position to capture a frame
+        :type position: float
+        :param width: frame's width, height keeps aspect ratio
+        :type width: int
+        :param image_format: 'jpeg' or 'webp'
+        :type image_format: str
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
+
+        codec_options = {
+            'jpeg': ('-c:v', 'mjpeg', '-q:v', str(app.config.get('FRAME_JPEG_QUALITY'))),
+            'webp': ('-c:v', 'libwebp', '-quality', str(app.config.get('FRAME_WEBP_QUALITY'))),
+        }[image_format]
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        path_output = scratch_path(path_input, f'_frame.{image_format}', small=True)
+        try:
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=path_output,
+                # avoid the last frame, it is null
+                # https://trac.ffmpeg.org/wiki/Seeking
+                preoptions=('-ss', str(max(min(position, duration - 0.1), 0))),
+                options=(
+                    '-an',
+                    '-frames:v', '1',
+                    '-filter:v', f'scale={width}:-2',
+                    *codec_options,
+                    '-f', 'image2',
+                ),
+                override=False,
+                # single frame is captured
+                duration=0
+            )
+            with open(path_output, 'rb') as f:
+                content = f.read()
+        finally:
+            for path in (path_input, path_output):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return content, {
+            'codec_name': 'mjpeg' if image_format == 'jpeg' else 'webp',
+            'width': width,
+            'size': len(content),
+            'mimetype': f'image/{image_format}',
+        }
+
+    def capture_timeline_thumbnails(self, stream_file, filename, duration, thumbnails_amount, fast=False):
         """
         Capture thumbnails for timeline.
         :param stream_file: video file
@@ -204,24 +769,36 @@ class FFMPEGVideoEditor(VideoEditorInterface):
         :type duration: int
         :param thumbnails_amount: total number of thumbnails to capture
         :type thumbnails_amount: int
+        :param fast: capture keyframes at or before positions, only these keyframes are decoded,
+                     at reduced resolution if decoder supports it
+        :type fast: bool
         :return: file stream, metadata generator
         :return: bytes, generator
         """
 
+        # time period between two frames
+        if thumbnails_amount == 1:
+            frame_per_second = (duration - 0.05)
+        else:
+            frame_per_second = (duration - 0.05) / (thumbnails_amount - 1)
+
+        if fast:
+            positions = [frame_per_second * i if frame_per_second * i >= 1 else 0 for i in range(thumbnails_amount)]
+            yield from self._capture_keyframes(stream_file, filename, positions, TIMELINE_THUMBNAIL_HEIGHT)
+            return
+
         path_video = create_temp_file(stream_file)
+        # create output file path
+        output_file = scratch_path(path_video, '_', small=True)
         try:
-            # time period between two frames
-            if thumbnails_amount == 1:
-                frame_per_second = (duration - 0.05)
-            else:
-                frame_per_second = (duration - 0.05) / (thumbnails_amount - 1)
-
             # capture list frame via script capture_list_frames.sh
             path_script = os.path.dirname(__file__) + '/script/capture_list_frames.sh'
-            # create output file path
-            output_file = f"{path_video}_"
             # subprocess bash -> ffmpeg in the loop
-            subprocess.run([path_script, path_video, output_file, str(frame_per_second), str(thumbnails_amount)])
+            self._run_process(
+                [path_script, path_video, output_file, str(frame_per_second), str(thumbnails_amount),
+                 str(TIMELINE_THUMBNAIL_HEIGHT)],
+                timeout=self._get_timeout(duration)
+            )
             for i in range(0, thumbnails_amount):
                 thumbnail_path = f'{output_file}{i}.png'
                 try:
@@ -237,8 +814,617 @@ class FFMPEGVideoEditor(VideoEditorInterface):
                     os.remove(thumbnail_path)
         finally:
             os.remove(path_video)
+            # thumbnails left if capture failed or generator was closed before reading all of them
+            for i in range(0, thumbnails_amount):
+                if os.path.exists(f'{output_file}{i}.png'):
+                    os.remove(f'{output_file}{i}.png')
 
-    def _run_ffmpeg(self, path_input, path_output, preoptions=tuple(), options=tuple(), override=True):
+    def capture_scene_thumbnails(self, stream_file, filename, amount, threshold, scenes=None):
+        """
+        Use ffmpeg tool to capture timeline thumbnails at scene changes.
+        Scenes are detected by `select` filter scene score in the same decode pass which captures their first frames,
+        frames of the best scoring scenes are kept. If `scenes` are known, only their frames are captured.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param amount: max number of thumbnails
+        :type amount: int
+        :param threshold: min scene score (0-1) of a frame which starts a new scene
+        :type threshold: float
+        :param scenes: scenes timestamps and scores detected before
+        :type scenes: list
+        :return: scenes timestamps and scores, thumbnails file streams and metadata in chronological order
+        :rtype: list, list
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        path_dir = mkdtemp(dir=scratch_dir(small=True))
+        path_scores = os.path.join(path_dir, 'scenes.txt')
+        try:
+            # https://ffmpeg.org/ffmpeg-filters.html#select_002c-aselect
+            if scenes is None:
+                select = f'eq(n\\,0)+gt(scene\\,{threshold})'
+            else:
+                select = '+'.join(
+                    f'lt(abs(t-{timestamp})\\,{SCENE_TIMESTAMP_TOLERANCE})' for timestamp in pick_scenes(scenes, amount)
+                )
+            # timestamps of selected frames are printed in order they are written,
+            # so every file is matched to its frame even if some positions have no frame
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=os.path.join(path_dir, '%05d.png'),
+                options=(
+                    '-an',
+                    '-filter:v',
+                    f'select={select},metadata=print:file={path_scores},scale=-2:{TIMELINE_THUMBNAIL_HEIGHT}',
+                    '-vsync', 'vfr',
+                ),
+                override=False
+            )
+            printed = []
+            if os.path.exists(path_scores):
+                with open(path_scores) as f:
+                    printed = parse_scene_scores(f.read())
+            if scenes is None:
+                scenes = printed
+
+            thumbnails = []
+            for position in pick_scenes(scenes, amount):
+                indexes = [i for i, (timestamp, _) in enumerate(printed)
+                           if abs(timestamp - position) < SCENE_TIMESTAMP_TOLERANCE]
+                if not indexes:
+                    # frame wasn't found at a position detected in another rendition of the video
+                    continue
+                thumbnail_path = os.path.join(path_dir, f'{indexes[0] + 1:05d}.png')
+                thumbnail_metadata = self._get_meta(thumbnail_path)
+                thumbnail_metadata['mimetype'] = 'image/png'
+                thumbnail_metadata['position'] = position
+                with open(thumbnail_path, 'rb') as f:
+                    thumbnails.append((f.read(), thumbnail_metadata))
+        finally:
+            os.remove(path_input)
+            shutil.rmtree(path_dir, ignore_errors=True)
+
+        return scenes, thumbnails
+
+    def capture_animated_thumbnail(self, stream_file, filename, duration, frames_amount, height, frame_rate):
+        """
+        Use ffmpeg tool to make a looping animated WebP of frames sampled evenly across a video.
+        Video is decoded once, `fps` filter picks the frames.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param duration: video's duration
+        :type duration: float
+        :param frames_amount: number of frames in animation
+        :type frames_amount: int
+        :param height: animation's height, width keeps aspect ratio
+        :type height: int
+        :param frame_rate: playback frames per second
+        :type frame_rate: float
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        path_output = scratch_path(path_input, '_animated.webp', small=True)
+        try:
+            # https://ffmpeg.org/ffmpeg-filters.html#fps-1
+            sample_rate = frames_amount / max(duration, 0.1)
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=path_output,
+                options=(
+                    '-an',
+                    '-filter:v', f'fps={sample_rate:.6f},scale=-2:{height},setpts=N/({frame_rate}*TB)',
+                    '-frames:v', str(frames_amount),
+                    '-c:v', 'libwebp',
+                    '-quality', str(app.config.get('ANIMATED_THUMBNAIL_QUALITY')),
+                    '-loop', '0',
+                ),
+                override=False,
+                duration=duration
+            )
+            with open(path_output, 'rb') as f:
+                content = f.read()
+            if content[12:16] == b'VP8X':
+                # ffprobe can't decode animated webp, canvas size is read from `VP8X` chunk
+                # https://developers.google.com/speed/webp/docs/riff_container#extended_file_format
+                width = int.from_bytes(content[24:27], 'little') + 1
+                height = int.from_bytes(content[27:30], 'little') + 1
+            else:
+                # a single frame is a still image
+                metadata = self._get_meta(path_output)
+                width, height = metadata['width'], metadata['height']
+        finally:
+            for path in (path_input, path_output):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return content, {
+            'codec_name': 'webp',
+            'width': width,
+            'height': height,
+            'size': len(content),
+            'frames': frames_amount,
+            'mimetype': 'image/webp',
+        }
+
+    def decode_audio(self, stream_file, filename, sample_rate):
+        """
+        Use ffmpeg tool to decode the first audio stream of a video into raw mono PCM, video is not decoded.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param sample_rate: output sample rate
+        :type sample_rate: int
+        :return: signed 16-bit little-endian samples, None if video has no audio
+        :rtype: bytes
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        path_output = f"{path_input.rsplit('.', 1)[0]}_audio.pcm"
+        try:
+            audio = self._get_streams(path_input)[1]
+            if not audio:
+                return None
+            # https://trac.ffmpeg.org/wiki/audio%20types
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=path_output,
+                options=(
+                    '-map', '0:a:0',
+                    '-ac', '1',
+                    '-ar', str(sample_rate),
+                    '-f', 's16le',
+                    '-c:a', 'pcm_s16le',
+                ),
+                override=False,
+                duration=self._get_stream_duration(audio)
+            )
+            with open(path_output, 'rb') as f:
+                return f.read()
+        finally:
+            for path in (path_input, path_output):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _smart_trim(self, path_input, path_output, start, end, keyframes=None, encoding_tier=None):
+        """
+        Frame accurate trim which re-encodes only partial GOPs at the cut points.
+        Video between the first keyframe after `start` and the last keyframe before `end` is stream copied,
+        partial GOPs around are re-encoded with the same codec parameters, then all pieces are concatenated.
+        Audio is cheap to encode, so it is re-encoded for the whole trimmed range.
+        :param path_input: input file path, it is replaced with the trimmed video
+        :type path_input: str
+        :param path_output: temp output file path
+        :type path_output: str
+        :param start: trim start
+        :type start: float
+        :param end: trim end
+        :type end: float
+        :param keyframes: keyframes timestamps of input file, file is probed if not set
+        :type keyframes: list
+        :param encoding_tier: speed tier of `ENCODING_PROFILES`, only encoder speed options are used
+        :type encoding_tier: str
+        :return: False if there is no full GOP inside trimmed range and smart render makes no sense,
+                 or if there is no encoder for video's or audio's codec in `CODEC_ENCODER_MAP`
+        :rtype: bool
+        """
+
+        if keyframes is None:
+            keyframes = self._get_keyframes(path_input)
+        index = bisect.bisect_left(keyframes, start)
+        copy_start = keyframes[index] if index < len(keyframes) else end
+        index = bisect.bisect_right(keyframes, end)
+        copy_end = keyframes[index - 1] if index else start
+        if copy_start >= copy_end:
+            return False
+
+        video, audio = self._get_streams(path_input)
+        encoder_map = app.config.get('CODEC_ENCODER_MAP')
+        for stream in (video, audio):
+            if stream and stream['codec_name'] not in encoder_map:
+                logger.info(f"Codec '{stream['codec_name']}' has no encoder in CODEC_ENCODER_MAP, "
+                            f"smart trim is not possible.")
+                return False
+        # intermediate container must keep codec parameters in band to concatenate re-encoded and copied parts
+        ext = 'ts' if video['codec_name'] == 'h264' else 'mkv'
+        encode_options = (
+            '-an',
+            '-c:v', encoder_map[video['codec_name']],
+            '-pix_fmt', video['pix_fmt'],
+            '-r', video['r_frame_rate'],
+            *(('-b:v', video['bit_rate']) if video.get('bit_rate') else tuple()),
+            *(('-profile:v', H264_PROFILES[video.get('profile')])
+              if video['codec_name'] == 'h264' and video.get('profile') in H264_PROFILES else tuple()),
+            '-threads', str(app.config.get('FFMPEG_THREADS')),
+            *self._get_encode_options(video['codec_name'], encoding_tier, speed_only=True),
+        )
+        parts = (
+            # partial GOP before the first keyframe
+            (start, copy_start, encode_options),
+            # full GOPs, no re-encoding needed
+            (copy_start, copy_end, (
+                '-an', '-c:v', 'copy',
+                *(('-bsf:v', 'h264_mp4toannexb') if ext == 'ts' else tuple())
+            )),
+            # partial GOP after the last keyframe
+            (copy_end, end, encode_options),
+        )
+
+        path_parts = []
+        path_list = f'{path_input}_parts.txt'
+        try:
+            for index, (part_start, part_end, options) in enumerate(parts):
+                if part_end - part_start <= 0:
+                    continue
+                path_parts.append(self._run_ffmpeg(
+                    path_input=path_input,
+                    path_output=f'{path_input}_part{index}.{ext}',
+                    preoptions=('-ss', str(part_start)),
+                    options=('-t', str(part_end - part_start), *options),
+                    override=False,
+                    duration=part_end - part_start
+                ))
+            with open(path_list, 'w') as f:
+                f.write(''.join(f"file '{path_part}'\n" for path_part in path_parts))
+            # concat video parts and take audio from the trimmed range of the original file
+            # https://trac.ffmpeg.org/wiki/Concatenate#demuxer
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=path_output,
+                preoptions=(
+                    '-f', 'concat', '-safe', '0', '-i', path_list,
+                    '-ss', str(start), '-t', str(end - start),
+                ),
+                options=(
+                    '-map', '0:v:0', '-map', '1:a:0?',
+                    '-c:v', 'copy',
+                    *(('-c:a', encoder_map[audio['codec_name']]) if audio else tuple()),
+                ),
+                duration=end - start
+            )
+        finally:
+            for path in (*path_parts, path_list):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return True
+
+    def _plan_local_segments(self, path_input, duration=None, keyframes=None):
+        """
+        Plan keyframe split points for encoding a video in parallel segments within this process.
+        :param path_input: input file path
+        :type path_input: str
+        :param duration: video's duration, file is probed only if it is not known
+        :type duration: float
+        :param keyframes: keyframes timestamps of input file, file is probed if not set
+        :type keyframes: list
+        :return: split points, empty if video should be encoded as a whole
+        :rtype: list
+        """
+
+        workers = int(app.config.get('FFMPEG_SEGMENT_WORKERS'))
+        if workers < 2 or app.config.get('FFMPEG_SEGMENT_DISPATCH') != 'local':
+            return []
+
+        if duration is None:
+            duration = self._get_meta(path_input)['duration']
+        if duration < float(app.config.get('FFMPEG_SEGMENT_MIN_DURATION')):
+            return []
+
+        if keyframes is None:
+            keyframes = self._get_keyframes(path_input)
+        return plan_segments(keyframes, duration, workers)
+
+    def _encode_segments(self, path_input, split_points, options, progress_callback=None, duration=None):
+        """
+        Split video at `split_points`, encode segments by parallel ffmpeg processes and concatenate them.
+        :param path_input: input file path, it is replaced with the encoded video
+        :type path_input: str
+        :param split_points: keyframes timestamps to split video at
+        :type split_points: list
+        :param options: encoding options for ffmpeg cmd
+        :type options: tuple
+        :param progress_callback: called with progress summed over all segments
+        :type progress_callback: callable
+        :param duration: video's duration used for timeouts of segments, None if it is unknown
+        :type duration: float
+        """
+
+        ext = path_input.rsplit('.', 1)[-1]
+        bounds = [0, *split_points]
+        durations = [end - start for start, end in zip(bounds, bounds[1:])]
+        durations.append(duration - bounds[-1] if duration else None)
+        path_segments = self._split_video(path_input, split_points)
+        path_encoded = [f'{path_segment}_encoded.{ext}' for path_segment in path_segments]
+        segments_progress = {}
+        # threads have no app context, push it for reading config
+        flask_app = app._get_current_object()
+
+        def encode(index):
+            segment_callback = None
+            if progress_callback:
+                def segment_callback(progress):
+                    segments_progress[index] = progress
+                    progress_callback({
+                        'out_time': sum(p['out_time'] for p in segments_progress.values()),
+                        'speed': sum(p['speed'] or 0 for p in segments_progress.values()) or None,
+                        'fps': sum(p['fps'] or 0 for p in segments_progress.values()) or None,
+                        'end': len(segments_progress) == len(path_segments)
+                        and all(p['end'] for p in segments_progress.values()),
+                    })
+
+            with flask_app.app_context():
+                return self._run_ffmpeg(
+                    path_segments[index], path_encoded[index],
+                    options=options, override=False, progress_callback=segment_callback, duration=durations[index]
+                )
+
+        try:
+            # every thread just waits for its own ffmpeg process
+            with ThreadPoolExecutor(max_workers=int(app.config.get('FFMPEG_SEGMENT_WORKERS'))) as executor:
+                list(executor.map(encode, range(len(path_segments))))
+            self._concat_videos(path_encoded, path_input)
+        finally:
+            for path in (*path_segments, *path_encoded):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _get_encode_options(self, codec_name, encoding_tier=None, speed_only=False):
+        """
+        Get ffmpeg options of an encoding profile
+        :param codec_name: output codec
+        :type codec_name: str
+        :param encoding_tier: speed tier, `DEFAULT_ENCODING_TIER` if not set
+        :type encoding_tier: str
+        :param speed_only: only speed options, so encoder and quality options can be set separately
+        :type speed_only: bool
+        :return: ffmpeg options, `FFMPEG_PRESET` if there is no profile for a codec
+        :rtype: tuple
+        """
+
+        profile = app.config.get('ENCODING_PROFILES', {}).get(codec_name, {}).get(
+            encoding_tier or app.config.get('DEFAULT_ENCODING_TIER')
+        )
+        if not profile:
+            return '-preset', app.config.get('FFMPEG_PRESET')
+
+        options = [
+            *(('-preset', profile['preset']) if profile.get('preset') else tuple()),
+            *profile.get('options', tuple()),
+        ]
+        if speed_only:
+            return tuple(options)
+
+        options[:0] = ('-c:v', profile['encoder'])
+        if profile.get('crf') is not None:
+            options.extend(('-crf', str(profile['crf'])))
+        if profile.get('bitrate') is not None:
+            options.extend(('-b:v', str(profile['bitrate'])))
+        if profile.get('qscale') is not None:
+            options.extend(('-q:v', str(profile['qscale'])))
+        if profile.get('keyframe_interval'):
+            # https://ffmpeg.org/ffmpeg.html#Advanced-Video-options
+            options.extend(('-force_key_frames', f"expr:gte(t,n_forced*{profile['keyframe_interval']})"))
+
+        return tuple(options)
+
+    def _get_filter_chain(self, crop=None, rotate=None, scale=None, filters=None, size=None):
+        """
+        Build a canonical video filter chain for edit rules followed by `filters`, see `compile_plan`
+        :param crop: crop editing rules
+        :type crop: dict
+        :param rotate: rotate degree
+        :type rotate: int
+        :param scale: width scale to
+        :type scale: int
+        :param filters: crop, scale and rotate rules applied one after another
+        :type filters: list
+        :param size: width and height of input frames, if it is known filters are ordered to process fewer pixels
+        :type size: tuple
+        :return: filter chain for `-filter:v` option, empty string if there is nothing to apply
+        :rtype: str
+        """
+
+        steps = [{'crop': crop, 'scale': scale, 'rotate': rotate}, *(filters or ())]
+        return compile_plan(steps, *(size or (None, None))).graph
+
+    def _get_frame_size(self, stream):
+        """
+        Get size of decoded frames of a video stream, ffmpeg rotates frames of videos with rotation metadata
+        :param stream: video stream information from `ffprobe`
+        :type stream: dict
+        :return: width, height
+        :rtype: tuple
+        """
+
+        rotation = stream.get('tags', {}).get('rotate')
+        for side_data in stream.get('side_data_list', ()):
+            rotation = side_data.get('rotation', rotation)
+        if rotation and int(float(rotation)) % 180:
+            return stream['height'], stream['width']
+        return stream['width'], stream['height']
+
+    def _get_keyframe_options(self, stream=None, height=None):
+        """
+        Get input options to decode only keyframes, input seeking outputs the keyframe before a position
+        :param stream: video stream information from `ffprobe`, frames are decoded at reduced resolution if it is set
+        :type stream: dict
+        :param height: min height of reduced resolution frames
+        :type height: int
+        :return: ffmpeg input options
+        :rtype: tuple
+        """
+
+        # https://ffmpeg.org/ffmpeg-codecs.html#Codec-Options
+        options = ['-noaccurate_seek', '-skip_frame', 'nokey']
+        if stream and height:
+            max_lowres = LOWRES_DECODERS.get(stream['codec_name'], 0)
+            lowres = 0
+            while lowres < max_lowres and stream['height'] >> (lowres + 1) >= height:
+                lowres += 1
+            if lowres:
+                options.extend(('-lowres', str(lowres)))
+
+        return tuple(options)
+
+    def _capture_keyframes(self, stream_file, filename, positions, height):
+        """
+        Capture keyframes at or before positions, scaled to a height.
+        Every position is a separate input which decodes only one keyframe, inputs are captured in batches
+        of `KEYFRAME_CAPTURE_BATCH` per ffmpeg run.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param positions: video positions
+        :type positions: list
+        :param height: thumbnails height, width keeps aspect ratio
+        :type height: int
+        :return: file stream, metadata generator
+        :rtype: generator
+        """
+
+        path_input = create_temp_file(stream_file, suffix=f".{filename.rsplit('.', 1)[-1]}")
+        try:
+            options = self._get_keyframe_options(self._get_streams(path_input)[0], height)
+            for start in range(0, len(positions), KEYFRAME_CAPTURE_BATCH):
+                batch = positions[start:start + KEYFRAME_CAPTURE_BATCH]
+                paths_output = [
+                    scratch_path(path_input, f'_keyframe_{start + index}.png', small=True)
+                    for index in range(len(batch))
+                ]
+                inputs = []
+                outputs = []
+                for index, position in enumerate(batch):
+                    if index:
+                        inputs.extend((*options, '-ss', str(position), '-i', path_input))
+                    outputs.extend(('-map', f'{index}:v:0', '-frames:v', '1', '-filter:v', f'scale=-1:{height}'))
+                    if index < len(batch) - 1:
+                        outputs.append(paths_output[index])
+                try:
+                    self._run_ffmpeg(
+                        path_input=path_input,
+                        path_output=paths_output[-1],
+                        preoptions=('-y', *options, '-ss', str(batch[0])),
+                        options=(*inputs, *outputs),
+                        override=False,
+                        # single frames are captured
+                        duration=0
+                    )
+                    results = [self._read_png(path_output) for path_output in paths_output]
+                finally:
+                    for path_output in paths_output:
+                        if os.path.exists(path_output):
+                            os.remove(path_output)
+                yield from results
+        finally:
+            os.remove(path_input)
+
+    def _read_png(self, path):
+        """
+        Read PNG image written by ffmpeg, its size is read from the image header without probing
+        :param path: image path
+        :type path: str
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        # https://www.w3.org/TR/png/#11IHDR
+        width, height = struct.unpack('>II', content[16:24])
+
+        return content, {
+            'codec_name': 'png',
+            'width': width,
+            'height': height,
+            'size': len(content),
+            'mimetype': 'image/png',
+        }
+
+    def _faststart(self, path_input):
+        """
+        Remux mp4/mov video in place with `moov` box at the beginning, unless it is there already.
+        :param path_input: input file path, it is replaced with the remuxed video
+        :type path_input: str
+        :return: True if video was remuxed
+        :rtype: bool
+        """
+
+        with open(path_input, 'rb') as f:
+            if is_faststart(f) is not False:
+                return False
+
+        # https://ffmpeg.org/ffmpeg-formats.html#Options-8
+        path_output = '{}_faststart.{}'.format(*path_input.rsplit('.', 1))
+        self._run_ffmpeg(
+            path_input=path_input,
+            path_output=path_output,
+            options=('-map', '0', '-c', 'copy', '-movflags', '+faststart'),
+        )
+        return True
+
+    def _split_video(self, path_input, split_points):
+        """
+        Split video stream at `split_points` using segment muxer and stream copy.
+        :param path_input: input file path
+        :type path_input: str
+        :param split_points: keyframes timestamps to split video at
+        :type split_points: list
+        :return: segments file paths in order
+        :rtype: list
+        """
+
+        # https://ffmpeg.org/ffmpeg-formats.html#segment
+        path_pattern = '{}_segment%03d.{}'.format(*path_input.rsplit('.', 1))
+        self._run_ffmpeg(
+            path_input=path_input,
+            path_output=path_pattern,
+            options=(
+                '-map', '0:v:0',
+                '-c', 'copy',
+                '-f', 'segment',
+                '-segment_times', ','.join(str(split_point) for split_point in split_points),
+                '-reset_timestamps', '1',
+            ),
+            override=False
+        )
+
+        return [path_pattern % index for index in range(len(split_points) + 1)
+                if os.path.exists(path_pattern % index)]
+
+    def _concat_videos(self, path_segments, path_input):
+        """
+        Concatenate video segments using concat demuxer and mux them with audio of `path_input`.
+        :param path_segments: video segments file paths in order
+        :type path_segments: list
+        :param path_input: file path to take audio from, it is replaced with the concatenated video
+        :type path_input: str
+        """
+
+        path_output = '{}_concat.{}'.format(*path_input.rsplit('.', 1))
+        path_list = f'{path_input}_concat.txt'
+        with open(path_list, 'w') as f:
+            f.write(''.join(f"file '{path_segment}'\n" for path_segment in path_segments))
+        try:
+            # https://trac.ffmpeg.org/wiki/Concatenate#demuxer
+            self._run_ffmpeg(
+                path_input=path_input,
+                path_output=path_output,
+                preoptions=('-f', 'concat', '-safe', '0', '-i', path_list),
+                options=('-map', '0:v:0', '-map', '1:a:0?', '-c', 'copy'),
+            )
+        finally:
+            os.remove(path_list)
+
+    def _run_ffmpeg(self, path_input, path_output, preoptions=tuple(), options=tuple(), override=True,
+                    progress_callback=None, duration=None):
         """
         Subprocess `ffmpeg` command.
         :param path_input: input file path
@@ -251,36 +1437,150 @@ class FFMPEGVideoEditor(VideoEditorInterface):
         :type options: tuple
         :param override: replace input file with output file
         :type override: bool
+        :param progress_callback: if set, ffmpeg writes progress into a pipe and callback is called
+                                  with parsed progress, see `parse_progress`
+        :type progress_callback: callable
+        :param duration: duration of processed video used for timeout, `FFMPEG_TIMEOUT` is used if not set
+        :type duration: float
         :return: file path to edited file
         :rtype: str
         """
+
         try:
             # run ffmpeg with provided options
-            subprocess.run(["ffmpeg", "-loglevel", "error", *preoptions, "-i", path_input, *options, path_output])
+            cmd = ["ffmpeg", "-loglevel", "error", *preoptions, "-i", path_input, *options, path_output]
+            line_callback = None
+            if progress_callback:
+                # https://ffmpeg.org/ffmpeg.html#Advanced-options
+                cmd[1:1] = ['-progress', 'pipe:1', '-nostats']
+                block = {}
+
+                def line_callback(line):
+                    key, _, value = line.strip().partition('=')
+                    block[key] = value
+                    # every progress block ends with `progress` key
+                    if key == 'progress':
+                        progress_callback(parse_progress(block))
+                        block.clear()
+
+            self._run_process(cmd, timeout=self._get_timeout(duration), line_callback=line_callback)
             if not override:
                 return path_output
             # replace tmp origin
-            subprocess.run(["cp", "-r", path_output, path_input])
+            shutil.copyfile(path_output, path_input)
             return path_input
         finally:
-            if override:
+            if override and os.path.exists(path_output):
                 # delete old tmp input file
                 os.remove(path_output)
 
-    def _get_meta(self, file_path):
+    def _run_process(self, cmd, timeout, line_callback=None):
+        """
+        Run subprocess supervised with configured resource limits, it is killed on timeout or cancellation.
+        :param cmd: command to run
+        :type cmd: list
+        :param timeout: wall-clock timeout in seconds
+        :type timeout: float
+        :param line_callback: called with each line of stdout
+        :type line_callback: callable
+        :return: stdout
+        :rtype: bytes
+        """
+
+        limits = {}
+        if resource:
+            limits = {
+                resource.RLIMIT_CPU: app.config.get('FFMPEG_CPU_TIME_LIMIT'),
+                resource.RLIMIT_AS: app.config.get('FFMPEG_MEMORY_LIMIT'),
+                resource.RLIMIT_FSIZE: app.config.get('FFMPEG_FILE_SIZE_LIMIT'),
+            }
+
+        return run_process(
+            cmd, timeout=timeout, limits=limits, cancel_check=self.cancel_check, line_callback=line_callback
+        )
+
+    def _get_timeout(self, duration):
+        """
+        Get ffmpeg wall-clock timeout for processing a video
+        :param duration: video's duration, None if it is unknown
+        :type duration: float
+        :return: timeout in seconds
+        :rtype: float
+        """
+
+        if duration is None:
+            return app.config.get('FFMPEG_TIMEOUT')
+        return app.config.get('FFMPEG_TIMEOUT_BASE') + app.config.get('FFMPEG_TIMEOUT_FACTOR') * duration
+
+    @staticmethod
+    def _get_stream_duration(stream):
+        """
+        Get duration of a stream probed by `_get_streams`
+        :param stream: stream information
+        :type stream: dict
+        :return: duration, None if it is unknown
+        :rtype: float
+        """
+
+        try:
+            return float(stream['duration'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _get_cached_meta(self, content, keyframe_index=False):
+        """
+        Get metadata of a file content from metadata cache
+        :param content: file content
+        :type content: bytes
+        :param keyframe_index: keyframe index is required as well
+        :type keyframe_index: bool
+        :return: the same as `_get_meta` returns, None if cache is disabled or there is no cached metadata
+        """
+
+        if not app.config.get('METADATA_CACHE_ENABLED'):
+            return None
+
+        cached = get_cached_metadata(content_key(content), keyframe_index=keyframe_index)
+        if not cached:
+            return None
+
+        metadata, packed_index = cached
+        if keyframe_index:
+            return metadata, KeyframeIndex.unpack(*packed_index)
+        return metadata
+
+    def _cache_meta(self, content, result, keyframe_index=False):
+        """
+        Save metadata of a file content into metadata cache, so identical content is not probed again
+        :param content: file content
+        :type content: bytes
+        :param result: result of `_get_meta`
+        :param keyframe_index: `result` contains keyframe index
+        :type keyframe_index: bool
+        """
+
+        if not app.config.get('METADATA_CACHE_ENABLED'):
+            return
+
+        metadata, packed_index = (result[0], result[1].pack()) if keyframe_index else (result, None)
+        cache_metadata(content_key(content), metadata, packed_index)
+
+    def _get_meta(self, file_path, keyframe_index=False):
         """
         Get metada using `ffprobe` command
         :param file_path: path to a file to retrieve a metadata
         :type file_path: str
-        :return: metadata
+        :param keyframe_index: also read packets of the first video stream and build keyframe index
+        :type keyframe_index: bool
+        :return: metadata, or metadata and `KeyframeIndex` if `keyframe_index` is set
         :rtype: dict
         """
 
         cmd = ('ffprobe', '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', file_path)
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
-            (output, _) = proc.communicate()
-            if proc.returncode != 0:
-                raise RuntimeError(f"Subprocess with command: '{cmd}' has failed.")
+        if keyframe_index:
+            # only packets are read, frames are not decoded
+            cmd = (*cmd[:-1], '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,pos,flags', file_path)
+        output = self._run_process(cmd, timeout=app.config.get('FFPROBE_TIMEOUT'))
 
         video_data = json.loads(output.decode("utf-8"))
 
@@ -299,6 +1599,8 @@ class FFMPEGVideoEditor(VideoEditorInterface):
         metadata = {key: data.get(key) for key in video_meta_keys}
         metadata['format_name'] = video_data['format']['format_name']
         metadata['size'] = video_data['format']['size']
+        with open(file_path, 'rb') as f:
+            metadata['faststart'] = is_faststart(f)
 
         # some videos don't have duration in video stream
         if not metadata['duration']:
@@ -315,4 +1617,50 @@ class FFMPEGVideoEditor(VideoEditorInterface):
             if metadata.get(value):
                 metadata[value] = format_type[value](metadata[value])
 
+        if keyframe_index:
+            return metadata, KeyframeIndex.from_packets(video_data.get('packets', []))
         return metadata
+
+    def _get_keyframes(self, file_path):
+        """
+        Get keyframes timestamps of the first video stream using `ffprobe` command.
+        Only packets are read, frames are not decoded.
+        :param file_path: path to a file to retrieve keyframes
+        :type file_path: str
+        :return: sorted keyframes timestamps
+        :rtype: list
+        """
+
+        cmd = ('ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+               '-print_format', 'csv=print_section=0', file_path)
+        output = self._run_process(cmd, timeout=app.config.get('FFPROBE_TIMEOUT'))
+
+        keyframes = []
+        for line in output.decode("utf-8").splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                keyframes.append(float(pts_time))
+
+        return sorted(keyframes)
+
+    def _get_streams(self, file_path):
+        """
+        Get first video and audio streams information using `ffprobe` command
+        :param file_path: path to a file to retrieve streams from
+        :type file_path: str
+        :return: video stream, audio stream (None if file has no audio)
+        :rtype: dict, dict
+        """
+
+        cmd = ('ffprobe', '-v', 'error', '-print_format', 'json', '-show_streams', file_path)
+        output = self._run_process(cmd, timeout=app.config.get('FFPROBE_TIMEOUT'))
+
+        streams = json.loads(output.decode("utf-8"))['streams']
+        video = next((stream for stream in streams if stream['codec_type'] == 'video'), None)
+        audio = next((stream for stream in streams if stream['codec_type'] == 'audio'), None)
+        if not video:
+            raise Exception(f'codec_type "video" was not found in streams. '
+                            f'Streams: {streams}. '
+                            f'File: {file_path}')
+
+        return video, audio
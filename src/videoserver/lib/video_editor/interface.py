@@ -1,21 +1,55 @@
 import abc
 
+#: height of timeline thumbnails, width keeps aspect ratio
+TIMELINE_THUMBNAIL_HEIGHT = 50
+
+#: mimetypes of adaptive streaming playlists and segments by file extension
+STREAMING_MIMETYPES = {
+    'm3u8': 'application/vnd.apple.mpegurl',
+    'ts': 'video/mp2t',
+    'mpd': 'application/dash+xml',
+    'm4s': 'video/iso.segment',
+}
+
 
 class VideoEditorInterface(metaclass=abc.ABCMeta):
 
+    def __init__(self, cancel_check=None):
+        """
+        :param cancel_check: called periodically while a long running operation is in progress,
+                             operation is cancelled if it returns True
+        :type cancel_check: callable
+        """
+
+        self.cancel_check = cancel_check
+
     @abc.abstractmethod
-    def get_meta(self, filestream):
+    def get_meta(self, filestream, keyframe_index=False):
         """
         Get metadata of file
         :param filestream: file to get meta from
         :type filestream: bytes
-        :return: metadata
+        :param keyframe_index: build keyframe index along with metadata
+        :type keyframe_index: bool
+        :return: metadata, or metadata and `KeyframeIndex` if `keyframe_index` is set
         :rtype: dict
         """
         pass
 
     @abc.abstractmethod
-    def edit_video(self, stream_file, filename, trim=None, crop=None, rotate=None, scale=None):
+    def get_keyframes(self, filestream):
+        """
+        Get keyframes timestamps of file
+        :param filestream: file to get keyframes from
+        :type filestream: bytes
+        :return: sorted keyframes timestamps
+        :rtype: list
+        """
+        pass
+
+    @abc.abstractmethod
+    def edit_video(self, stream_file, filename, trim=None, crop=None, rotate=None, scale=None, trim_mode=None,
+                   progress_callback=None, keyframes=None, keyframe_index=False, filters=None, encoding_tier=None):
         """
         Edit video.
         :param stream_file: file to edit
@@ -30,12 +64,151 @@ class VideoEditorInterface(metaclass=abc.ABCMeta):
         :type video_rotate: int
         :param scale: width scale to
         :type scale: int
-        :return:
+        :param trim_mode: 'accurate' re-encodes trimmed video, 'copy' cuts it using stream copy,
+                          'smart' re-encodes only GOPs at the cut points
+        :type trim_mode: str
+        :param progress_callback: called with encoding progress
+        :type progress_callback: callable
+        :param keyframes: keyframes timestamps of `stream_file` if they are known
+        :type keyframes: list
+        :param keyframe_index: build keyframe index of edited video along with metadata
+        :type keyframe_index: bool
+        :param filters: crop, scale and rotate rules applied one after another after `crop`, `scale` and `rotate`
+        :type filters: list
+        :param encoding_tier: speed tier of encoding profile used for re-encoding
+        :type encoding_tier: str
+        :return: file stream, metadata and `KeyframeIndex` if `keyframe_index` is set
+        """
+        pass
+
+    @abc.abstractmethod
+    def split_video(self, stream_file, filename, segments_amount, keyframes=None):
+        """
+        Split video at keyframes into segments of roughly equal duration, audio is dropped.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param segments_amount: desired number of segments
+        :type segments_amount: int
+        :param keyframes: keyframes timestamps of `stream_file` if they are known
+        :type keyframes: list
+        :return: segments file streams
+        :rtype: list
+        """
+        pass
+
+    @abc.abstractmethod
+    def concat_videos(self, streams, filename, audio_stream, keyframe_index=False):
+        """
+        Concatenate video segments and mux them with audio of `audio_stream`.
+        :param streams: video segments
+        :type streams: list
+        :param filename: tmp video's file name
+        :type filename: str
+        :param audio_stream: video file to take audio from
+        :type audio_stream: bytes
+        :param keyframe_index: build keyframe index of concatenated video along with metadata
+        :type keyframe_index: bool
+        :return: file stream, metadata and `KeyframeIndex` if `keyframe_index` is set
+        :rtype: bytes, dict
+        """
+        pass
+
+    @abc.abstractmethod
+    def faststart(self, stream_file, filename):
+        """
+        Move `moov` box of mp4/mov video to the beginning of a file without re-encoding.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :return: file stream, the same `stream_file` if it is already fast-start or it is not mp4/mov
+        :rtype: bytes
+        """
+        pass
+
+    @abc.abstractmethod
+    def create_proxy(self, stream_file, filename, height):
+        """
+        Create a low resolution, fast seeking proxy of a video.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param height: proxy's height, width keeps aspect ratio
+        :type height: int
+        :return: file stream, metadata
+        :rtype: bytes, dict
         """
         pass
 
     @abc.abstractmethod
-    def capture_thumbnail(self, stream_file, filename, duration, position, crop, rotate):
+    def create_renditions(self, stream_file, filename, ladder):
+        """
+        Encode a video into several resolutions, decoding it only once.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param ladder: renditions, `height` and max `bitrate` in bits per second
+        :type ladder: list
+        :return: file stream and metadata of every rendition in order of `ladder`
+        :rtype: list
+        """
+        pass
+
+    @abc.abstractmethod
+    def package_stream(self, stream_file, filename, stream_format, prefix, segment_duration):
+        """
+        Package a video for adaptive streaming.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param stream_format: 'hls' or 'dash'
+        :type stream_format: str
+        :param prefix: prefix of playlist and segments file names
+        :type prefix: str
+        :param segment_duration: target duration of segments in seconds
+        :type segment_duration: float
+        :return: playlist file name, playlist and segments file streams by file names
+        :rtype: str, dict
+        """
+        pass
+
+    @abc.abstractmethod
+    def preview_edit(self, stream_file, filename, height, duration, trim=None, crop=None, rotate=None, scale=None,
+                     filters=None, position=None):
+        """
+        Render a low resolution sample of an edited video, or a single frame of it.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param height: preview's height, width keeps aspect ratio
+        :type height: int
+        :param duration: max duration of a sample
+        :type duration: float
+        :param trim: trim editing rules
+        :type trim: dict
+        :param crop: crop editing rules
+        :type crop: dict
+        :param rotate: rotate degree
+        :type rotate: int
+        :param scale: width scale to
+        :type scale: int
+        :param filters: crop, scale and rotate rules applied one after another after `crop`, `scale` and `rotate`
+        :type filters: list
+        :param position: if set, a frame at this position of edited video is rendered instead of a sample
+        :type position: float
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
+        pass
+
+    @abc.abstractmethod
+    def capture_thumbnail(self, stream_file, filename, duration, position, crop, rotate, fast=False):
         """
         Capture video frame at a position.
         :param stream_file: video file
@@ -50,13 +223,53 @@ class VideoEditorInterface(metaclass=abc.ABCMeta):
         :type crop: dict
         :param rotate: rotate degree
         :type rotate: int
+        :param fast: capture the keyframe at or before the position, only this keyframe is decoded
+        :type fast: bool
         :return: file stream, metadata
         :rtype: bytes, dict
         """
         pass
 
     @abc.abstractmethod
-    def capture_timeline_thumbnails(self, stream_file, filename, duration, thumbnails_amount):
+    def capture_thumbnails(self, stream_file, filename, duration, captures):
+        """
+        Capture video frames at several positions at once.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param duration: video's duration
+        :type duration: float
+        :param captures: `position` of every frame with optional `crop` rules and `rotate` degree
+        :type captures: list
+        :return: file stream and metadata of every frame in order of `captures`
+        :rtype: list
+        """
+        pass
+
+    @abc.abstractmethod
+    def capture_frame(self, stream_file, filename, duration, position, width, image_format):
+        """
+        Capture a scaled video frame at a position as fast as possible, for scrubbing.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param duration: video's duration
+        :type duration: float
+        :param position: video position to capture a frame
+        :type position: float
+        :param width: frame's width, height keeps aspect ratio
+        :type width: int
+        :param image_format: 'jpeg' or 'webp'
+        :type image_format: str
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
+        pass
+
+    @abc.abstractmethod
+    def capture_timeline_thumbnails(self, stream_file, filename, duration, thumbnails_amount, fast=False):
         """
         Capture thumbnails for timeline.
         :param stream_file: video file
@@ -67,7 +280,64 @@ class VideoEditorInterface(metaclass=abc.ABCMeta):
         :type duration: int
         :param thumbnails_amount: total number of thumbnails to capture
         :type thumbnails_amount: int
+        :param fast: capture keyframes at or before positions, only these keyframes are decoded
+        :type fast: bool
         :return: file stream, metadata generator
         :return: bytes, generator
         """
         pass
+
+    @abc.abstractmethod
+    def capture_animated_thumbnail(self, stream_file, filename, duration, frames_amount, height, frame_rate):
+        """
+        Make a looping animated image of frames sampled evenly across a video, decoding it only once.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param duration: video's duration
+        :type duration: float
+        :param frames_amount: number of frames in animation
+        :type frames_amount: int
+        :param height: animation's height, width keeps aspect ratio
+        :type height: int
+        :param frame_rate: playback frames per second
+        :type frame_rate: float
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
+        pass
+
+    @abc.abstractmethod
+    def capture_scene_thumbnails(self, stream_file, filename, amount, threshold, scenes=None):
+        """
+        Capture timeline thumbnails at scene changes, scenes are detected in the same decode pass.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param amount: max number of thumbnails
+        :type amount: int
+        :param threshold: min scene score (0-1) of a frame which starts a new scene
+        :type threshold: float
+        :param scenes: scenes timestamps and scores detected before, if set scenes are not detected again
+        :type scenes: list
+        :return: scenes timestamps and scores, thumbnails file streams and metadata in chronological order
+        :rtype: list, list
+        """
+        pass
+
+    @abc.abstractmethod
+    def decode_audio(self, stream_file, filename, sample_rate):
+        """
+        Decode the first audio stream of a video into raw mono PCM.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param sample_rate: output sample rate
+        :type sample_rate: int
+        :return: signed 16-bit little-endian samples, None if video has no audio
+        :rtype: bytes
+        """
+        pass
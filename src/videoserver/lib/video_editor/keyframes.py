@@ -0,0 +1,131 @@
+import bisect
+import sys
+from array import array
+
+
+def snap_to_keyframes(keyframes, start, end, duration):
+    """
+    Snap trim range outwards to the closest keyframes, so it can be cut using stream copy.
+    Start is moved back to the keyframe at or before `start`, end is moved forward to the keyframe
+    at or after `end` (or to the end of the video), so snapped range always covers a requested one.
+    :param keyframes: sorted keyframes timestamps
+    :type keyframes: list
+    :param start: trim start
+    :type start: float
+    :param end: trim end
+    :type end: float
+    :param duration: video's duration
+    :type duration: float
+    :return: snapped start, snapped end
+    :rtype: tuple
+    """
+
+    index = bisect.bisect_right(keyframes, start)
+    snapped_start = keyframes[index - 1] if index else 0.0
+
+    index = bisect.bisect_left(keyframes, end)
+    snapped_end = keyframes[index] if index < len(keyframes) else duration
+
+    return snapped_start, min(snapped_end, duration)
+
+
+def plan_segments(keyframes, duration, segments_amount):
+    """
+    Pick keyframes which split a video into `segments_amount` segments of roughly equal duration.
+    :param keyframes: sorted keyframes timestamps
+    :type keyframes: list
+    :param duration: video's duration
+    :type duration: float
+    :param segments_amount: desired number of segments
+    :type segments_amount: int
+    :return: split points, there may be less segments than desired if video has not enough keyframes
+    :rtype: list
+    """
+
+    split_points = []
+    for number in range(1, segments_amount):
+        target = duration * number / segments_amount
+        index = bisect.bisect_left(keyframes, target)
+        candidates = keyframes[max(index - 1, 0):index + 1]
+        if not candidates:
+            break
+        # closest keyframe to the target
+        split_point = min(candidates, key=lambda keyframe: abs(keyframe - target))
+        if (split_points[-1] if split_points else 0) < split_point < duration:
+            split_points.append(split_point)
+
+    return split_points
+
+
+class KeyframeIndex:
+    """
+    Compact index of video keyframes: presentation timestamps and byte offsets in a file.
+    It is stored as packed arrays of little-endian doubles (timestamps) and 64-bit integers (offsets).
+    """
+
+    def __init__(self, timestamps=(), positions=()):
+        """
+        :param timestamps: sorted keyframes timestamps
+        :type timestamps: iterable
+        :param positions: keyframes byte offsets, -1 if unknown
+        :type positions: iterable
+        """
+
+        self.timestamps = array('d', timestamps)
+        self.positions = array('q', positions)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_packets(cls, packets):
+        """
+        Build index from packets printed by ffprobe `-show_entries packet=pts_time,pos,flags`
+        :param packets: packets of a video stream
+        :type packets: list
+        :return: keyframe index
+        :rtype: KeyframeIndex
+        """
+
+        keyframes = sorted(
+            (float(packet['pts_time']), int(packet['pos']) if packet.get('pos', 'N/A') != 'N/A' else -1)
+            for packet in packets
+            if 'K' in packet.get('flags', '') and packet.get('pts_time', 'N/A') != 'N/A'
+        )
+        return cls(
+            (timestamp for timestamp, _ in keyframes),
+            (position for _, position in keyframes)
+        )
+
+    @classmethod
+    def unpack(cls, timestamps, positions):
+        """
+        Load index from packed arrays
+        :param timestamps: packed timestamps
+        :type timestamps: bytes
+        :param positions: packed byte offsets
+        :type positions: bytes
+        :return: keyframe index
+        :rtype: KeyframeIndex
+        """
+
+        index = cls()
+        index.timestamps.frombytes(timestamps)
+        index.positions.frombytes(positions)
+        if sys.byteorder == 'big':
+            index.timestamps.byteswap()
+            index.positions.byteswap()
+        return index
+
+    def pack(self):
+        """
+        Pack index into arrays of bytes
+        :return: packed timestamps, packed byte offsets
+        :rtype: bytes, bytes
+        """
+
+        timestamps, positions = array('d', self.timestamps), array('q', self.positions)
+        if sys.byteorder == 'big':
+            timestamps.byteswap()
+            positions.byteswap()
+        return timestamps.tobytes(), positions.tobytes()
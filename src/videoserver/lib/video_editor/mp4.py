@@ -0,0 +1,39 @@
+import struct
+
+#: boxes an ISO base media file (mp4, mov) can start with
+# https://developer.apple.com/documentation/quicktime-file-format
+FILE_START_BOXES = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pdin', b'uuid')
+
+
+def is_faststart(f):
+    """
+    Check if `moov` box of an ISO base media file is before `mdat` box, so playback starts without reading
+    the end of a file. Only headers of top-level boxes are read.
+    :param f: binary file object
+    :type f: io.BufferedIOBase
+    :return: True if `moov` box is before `mdat` box, False if it is after, None if it is not an ISO base media file
+    :rtype: bool
+    """
+
+    size = f.seek(0, 2)
+    offset = 0
+    while offset + 8 <= size:
+        f.seek(offset)
+        box_size, box_type = struct.unpack('>I4s', f.read(8))
+        if offset == 0 and box_type not in FILE_START_BOXES:
+            return None
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if box_size == 1:
+            # 64-bit size follows box type
+            box_size = struct.unpack('>Q', f.read(8))[0]
+        elif box_size == 0:
+            # box extends to the end of a file
+            return None
+        if box_size < 8:
+            return None
+        offset += box_size
+
+    return None
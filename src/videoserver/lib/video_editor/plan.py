@@ -0,0 +1,230 @@
+#: rough cost of filters per input pixel, crop only moves data pointers,
+# transpose is slower than flips because it reads frames across rows
+FILTER_COSTS = {'crop': 0, 'scale': 4, 'transpose': 2, 'hflip': 1, 'vflip': 1}
+
+#: filters rotating a frame clockwise by a number of degrees
+# https://ffmpeg.org/ffmpeg-filters.html#transpose-1
+ROTATE_FILTERS = {
+    90: (('transpose', '1'),),
+    180: (('hflip', None), ('vflip', None)),
+    270: (('transpose', '2'),),
+}
+
+
+class EditPlan:
+    """
+    Canonical filter graph of crop, scale and rotate rules.
+    Rotations are merged into one, crops and downscales are moved before it so fewer pixels are rotated,
+    adjacent crops and scales with the same result are merged. Output frame is the same as if every rule
+    was applied one by one, except that a frame scaled several times is resampled only once.
+    """
+
+    def __init__(self, filters, width=None, height=None, cost=None):
+        """
+        :param filters: filter names and arguments in order they are applied, see `FILTER_COSTS`
+        :type filters: list
+        :param width: output width, None if input size is unknown
+        :type width: int
+        :param height: output height, None if input size is unknown
+        :type height: int
+        :param cost: estimated cost of filtering one frame, see `FILTER_COSTS`, None if input size is unknown
+        :type cost: int
+        """
+
+        self.filters = filters
+        self.width = width
+        self.height = height
+        self.cost = cost
+
+    def __bool__(self):
+        return bool(self.filters)
+
+    def __repr__(self):
+        return f'<EditPlan {self.graph!r} {self.width}x{self.height} cost={self.cost}>'
+
+    @property
+    def graph(self):
+        """
+        Filter graph for ffmpeg `-filter:v` option
+        :return: comma separated filters, empty string if there is nothing to apply
+        :rtype: str
+        """
+
+        return ','.join(f'{name}={args}' if args else name for name, args in self.filters)
+
+
+def compile_plan(steps, width=None, height=None):
+    """
+    Compile edit rules into a canonical filter graph.
+    :param steps: crop, scale and rotate rules applied one after another,
+                  within one step rules are applied in order crop, scale, rotate
+    :type steps: list
+    :param width: input width, crops and scales are not moved before rotations if size is unknown
+    :type width: int
+    :param height: input height
+    :type height: int
+    :return: edit plan
+    :rtype: EditPlan
+    """
+
+    compiler = _PlanCompiler(width, height)
+    for rules in steps:
+        if rules.get('crop'):
+            compiler.crop(rules['crop'])
+        if rules.get('scale'):
+            compiler.scale(rules['scale'])
+        if rules.get('rotate'):
+            compiler.rotate(rules['rotate'])
+    compiler.flush_rotation()
+
+    return EditPlan(
+        filters=[(item['name'], item['args']) for item in compiler.filters],
+        width=compiler.width,
+        height=compiler.height,
+        cost=sum(
+            FILTER_COSTS[item['name']] * item['input'][0] * item['input'][1] for item in compiler.filters
+        ) if compiler.width is not None else None
+    )
+
+
+def scaled_size(width, input_width, input_height):
+    """
+    Get frame size after `scale=<width>:-2`, rounded the same way ffmpeg does
+    :param width: scale width
+    :type width: int
+    :param input_width: input width
+    :type input_width: int
+    :param input_height: input height
+    :type input_height: int
+    :return: width, height
+    :rtype: tuple
+    """
+
+    # https://github.com/FFmpeg/FFmpeg/blob/master/libavfilter/scale_eval.c
+    # -2 is rounded once to a half of height and doubled
+    return width, _rescale(width, input_height, input_width * 2) * 2
+
+
+def _rescale(a, b, c):
+    # `av_rescale` of non-negative numbers, rounded to the nearest integer, halves away from zero
+    return (a * b + c // 2) // c
+
+
+class _PlanCompiler:
+    """
+    Emits filters for rules one by one. A clockwise rotation is kept pending until a rule can't be moved
+    before it, so consecutive rotations are merged. Frame size is tracked as it is before the pending rotation.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.rotation = 0
+        # filter `name`, `args`, `input` size
+        self.filters = []
+
+    def rotate(self, degrees):
+        self.rotation = (self.rotation + degrees) % 360
+
+    def flush_rotation(self):
+        for name, args in ROTATE_FILTERS.get(self.rotation, ()):
+            self._emit(name, args, self._size)
+        if self.rotation % 180 and self.width is not None:
+            self.width, self.height = self.height, self.width
+        self.rotation = 0
+
+    def crop(self, crop):
+        crop = dict(crop)
+        if self.rotation:
+            unrotated = self._unrotate_crop(crop)
+            # crop offsets of subsampled pixel formats are rounded down to even numbers,
+            # so a crop is moved only if rounding has no effect before and after the move
+            if unrotated and _is_even(crop) and _is_even(unrotated):
+                crop = unrotated
+            else:
+                self.flush_rotation()
+
+        previous = self.filters[-1] if self.filters else None
+        if previous and previous['name'] == 'crop' and _is_even(previous['crop']) and _is_even(crop):
+            # crop of a crop is one crop with summed offsets
+            self.filters.pop()
+            crop['x'] += previous['crop']['x']
+            crop['y'] += previous['crop']['y']
+            self._emit('crop', _crop_args(crop), previous['input'], crop=crop)
+        else:
+            self._emit('crop', _crop_args(crop), self._size, crop=crop)
+        if self.width is not None:
+            self.width, self.height = crop['width'], crop['height']
+
+    def scale(self, width):
+        # avoid width not divisible by 2
+        width -= width % 2
+        if self.width is None:
+            self.flush_rotation()
+            self._emit('scale', f'{width}:-2', None)
+            return
+
+        if self.rotation % 180:
+            # the same size before rotation, `scale_eval` rounds width and height symmetrically
+            height, scaled_width = scaled_size(width, self.height, self.width)
+            size, args = (scaled_width, height), f'-2:{width}'
+        else:
+            size, args = scaled_size(width, self.width, self.height), f'{width}:-2'
+        if self.rotation and size[0] * size[1] > self.width * self.height:
+            # upscale after rotation, so fewer pixels are rotated
+            self.flush_rotation()
+            size, args = scaled_size(width, self.width, self.height), f'{width}:-2'
+
+        previous = self.filters[-1] if self.filters else None
+        if previous and previous['name'] == 'scale' and self._scale_args(previous['input'], size):
+            # scale of a scale is one scale if it has the same result
+            self.filters.pop()
+            self._emit('scale', self._scale_args(previous['input'], size), previous['input'])
+        else:
+            self._emit('scale', args, self._size)
+        self.width, self.height = size
+
+    @property
+    def _size(self):
+        return (self.width, self.height) if self.width is not None else None
+
+    def _emit(self, name, args, input_size, **extra):
+        self.filters.append({'name': name, 'args': args, 'input': input_size, **extra})
+
+    def _scale_args(self, input_size, size):
+        """
+        Get arguments of a single scale from `input_size` to `size`, None if rounding makes it different
+        """
+
+        if scaled_size(size[0], *input_size) == size:
+            return f'{size[0]}:-2'
+        if scaled_size(size[1], input_size[1], input_size[0]) == (size[1], size[0]):
+            return f'-2:{size[1]}'
+        return None
+
+    def _unrotate_crop(self, crop):
+        """
+        Map crop of a frame rotated by pending rotation to a crop of the frame before rotation
+        """
+
+        if self.width is None:
+            return None
+        width, height = self.width, self.height
+        if self.rotation == 90:
+            # clockwise, the left column of rotated frame is the bottom row
+            return {'x': crop['y'], 'y': height - crop['x'] - crop['width'],
+                    'width': crop['height'], 'height': crop['width']}
+        if self.rotation == 180:
+            return {'x': width - crop['x'] - crop['width'], 'y': height - crop['y'] - crop['height'],
+                    'width': crop['width'], 'height': crop['height']}
+        # counterclockwise, the top row of rotated frame is the right column
+        return {'x': width - crop['y'] - crop['height'], 'y': crop['x'],
+                'width': crop['height'], 'height': crop['width']}
+
+
+def _crop_args(crop):
+    return f'{crop["width"]}:{crop["height"]}:{crop["x"]}:{crop["y"]}'
+
+
+def _is_even(crop):
+    return crop['x'] % 2 == 0 and crop['y'] % 2 == 0
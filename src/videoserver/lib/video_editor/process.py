@@ -0,0 +1,164 @@
+import logging
+import os
+import signal
+import subprocess
+import threading
+from time import monotonic
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, resource limits are not applied
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+#: max length of captured stderr kept in exception message
+STDERR_TAIL_LENGTH = 2000
+
+
+class ProcessError(RuntimeError):
+    """
+    Subprocess exited with non-zero status
+    """
+
+    def __init__(self, cmd, returncode, stderr, message=None):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+        if not message:
+            message = f"Subprocess with command: '{cmd}' has failed with exit status {returncode}."
+        if stderr:
+            message += f" stderr: {stderr[-STDERR_TAIL_LENGTH:]}"
+        super().__init__(message)
+
+
+class ProcessTimeoutError(ProcessError):
+    """
+    Subprocess was killed because it exceeded its wall-clock timeout
+    """
+
+
+class ProcessCancelledError(ProcessError):
+    """
+    Subprocess was killed because its job was cancelled
+    """
+
+
+def run_process(cmd, timeout=None, limits=None, cancel_check=None, line_callback=None, poll_interval=1):
+    """
+    Run subprocess under supervision.
+    Subprocess is started in a new process group with resource limits applied, so it can be killed
+    along with all its children if it exceeds `timeout` or if `cancel_check` returns True.
+    :param cmd: command to run
+    :type cmd: list
+    :param timeout: wall-clock timeout in seconds, None means no timeout
+    :type timeout: float
+    :param limits: resource limits, `resource.RLIMIT_*` constant mapped to a limit, 0 means unlimited
+    :type limits: dict
+    :param cancel_check: called every `poll_interval` seconds, subprocess is killed if it returns True
+    :type cancel_check: callable
+    :param line_callback: if set, called with each line of stdout as soon as it is written,
+                          its exceptions are logged and don't stop the subprocess
+    :type line_callback: callable
+    :param poll_interval: seconds between timeout and cancellation checks
+    :type poll_interval: float
+    :return: stdout, empty if `line_callback` is set
+    :rtype: bytes
+    :raise: `ProcessError` if subprocess exits with non-zero status,
+            `ProcessTimeoutError` if subprocess exceeds `timeout`,
+            `ProcessCancelledError` if `cancel_check` returns True
+    """
+
+    stdout = []
+    stderr = []
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+
+    def read_stdout():
+        if line_callback:
+            for line in proc.stdout:
+                try:
+                    line_callback(line.decode('utf-8', 'replace'))
+                except Exception as e:
+                    # keep draining, otherwise subprocess blocks on a full pipe until it is timed out
+                    logger.exception(f"Subprocess line callback has failed: {e}")
+        else:
+            stdout.append(proc.stdout.read())
+
+    # drain pipes in threads, so subprocess never blocks on a full pipe while it is polled
+    readers = [
+        threading.Thread(target=read_stdout, daemon=True),
+        threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True),
+    ]
+    try:
+        _set_limits(proc.pid, limits)
+        for reader in readers:
+            reader.start()
+
+        deadline = monotonic() + timeout if timeout else None
+        while True:
+            try:
+                proc.wait(timeout=poll_interval)
+                break
+            except subprocess.TimeoutExpired:
+                if deadline and monotonic() > deadline:
+                    _kill(proc)
+                    readers[1].join(poll_interval)
+                    raise ProcessTimeoutError(
+                        cmd, proc.returncode, _decode(stderr),
+                        f"Subprocess with command: '{cmd}' was killed after {timeout} seconds timeout."
+                    )
+                if cancel_check and cancel_check():
+                    _kill(proc)
+                    readers[1].join(poll_interval)
+                    raise ProcessCancelledError(
+                        cmd, proc.returncode, _decode(stderr),
+                        f"Subprocess with command: '{cmd}' was cancelled."
+                    )
+
+        for reader in readers:
+            reader.join()
+    finally:
+        # also covers exceptions raised by `cancel_check` and task termination
+        if proc.poll() is None:
+            _kill(proc)
+        for reader in readers:
+            if reader.is_alive():
+                # pipes are closed soon after the whole process group is killed
+                reader.join(poll_interval)
+        proc.stdout.close()
+        proc.stderr.close()
+
+    if proc.returncode != 0:
+        raise ProcessError(cmd, proc.returncode, _decode(stderr))
+
+    return b''.join(stdout)
+
+
+def _set_limits(pid, limits):
+    if not limits:
+        return
+    if resource is None or not hasattr(resource, 'prlimit'):
+        logger.warning('Resource limits are not supported on this platform.')
+        return
+
+    # `prlimit` is used instead of `preexec_fn`, which is not safe when subprocesses are started from threads
+    for rlimit, value in limits.items():
+        if value:
+            try:
+                resource.prlimit(pid, rlimit, (value, value))
+            except ProcessLookupError:
+                # process has already finished
+                return
+
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def _decode(chunks):
+    return b''.join(chunks).decode('utf-8', 'replace').strip()
@@ -0,0 +1,323 @@
+import bisect
+import io
+import logging
+
+from .ffmpeg import FFMPEGVideoEditor
+from .interface import TIMELINE_THUMBNAIL_HEIGHT
+from .keyframes import KeyframeIndex
+from .mp4 import is_faststart
+from .plan import compile_plan
+from .process import ProcessCancelledError
+
+try:
+    import av
+except ImportError:
+    av = None
+
+logger = logging.getLogger(__name__)
+
+
+class PyAVVideoEditor(FFMPEGVideoEditor):
+    """
+    PyAV based video editor.
+    Metadata and thumbnails are decoded and encoded in-process by libav bindings from an in-memory file,
+    without spawning ffmpeg/ffprobe and writing temp files. Editing is left to `FFMPEGVideoEditor`.
+
+    Links:
+      https://pyav.org/docs/stable/
+      https://pyav.org/docs/stable/api/filter.html
+    """
+
+    def __init__(self, cancel_check=None):
+        if av is None:
+            raise RuntimeError("PyAV is not installed, install it with `pip install videoserver[pyav]`.")
+        super().__init__(cancel_check=cancel_check)
+
+    def get_meta(self, filestream, extension='tmp', keyframe_index=False):
+        """
+        Use PyAV for getting metadata of file
+        :param filestream: file to get meta from
+        :type filestream: bytes
+        :param keyframe_index: build keyframe index by demuxing packets of the first video stream
+        :type keyframe_index: bool
+        :return: metadata, or metadata and `KeyframeIndex` if `keyframe_index` is set
+        :rtype: dict
+        """
+
+        cached = self._get_cached_meta(filestream, keyframe_index)
+        if cached:
+            return cached
+
+        with av.open(io.BytesIO(filestream)) as container:
+            stream = self._get_video_stream(container)
+            metadata = self._get_stream_meta(container, stream, len(filestream))
+            metadata['faststart'] = is_faststart(io.BytesIO(filestream))
+            if keyframe_index:
+                keyframes = self._demux_keyframes(container, stream)
+                result = metadata, KeyframeIndex(
+                    (timestamp for timestamp, _ in keyframes),
+                    (position for _, position in keyframes)
+                )
+            else:
+                result = metadata
+
+        self._cache_meta(filestream, result, keyframe_index)
+        return result
+
+    def capture_thumbnail(self, stream_file, filename, duration, position, crop=None, rotate=0, fast=False):
+        """
+        Use PyAV to capture video frame at a position.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param duration: video's duration
+        :type duration: int
+        :param position: video position to capture a frame
+        :type position: int
+        :param crop: crop editing rules
+        :type crop: dict
+        :param rotate: rotate degree
+        :type rotate: int
+        :param fast: capture the keyframe at or before the position, only this keyframe is decoded
+        :type fast: bool
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
+
+        # avoid the last frame, it is null
+        if int(duration) <= int(position):
+            position = duration - 0.1
+
+        # the same filters as ffmpeg editor applies
+        filters = compile_plan([{'crop': crop, 'rotate': rotate}]).filters
+
+        with av.open(io.BytesIO(stream_file)) as container:
+            stream = self._get_video_stream(container)
+            if fast:
+                frame = next(self._decode_keyframes(container, stream, [position]))
+            else:
+                frame = next(self._decode_frames(container, stream, [position]))
+            if filters:
+                frame = self._filter_frame(stream, frame, filters)
+            return self._encode_png(frame)
+
+    def capture_timeline_thumbnails(self, stream_file, filename, duration, thumbnails_amount, fast=False):
+        """
+        Capture thumbnails for timeline using PyAV.
+        :param stream_file: video file
+        :type stream_file: bytes
+        :param filename: tmp video's file name
+        :type filename: str
+        :param duration: video's duration
+        :type duration: int
+        :param thumbnails_amount: total number of thumbnails to capture
+        :type thumbnails_amount: int
+        :param fast: capture keyframes at or before positions, only these keyframes are decoded
+        :type fast: bool
+        :return: file stream, metadata generator
+        :return: bytes, generator
+        """
+
+        # time period between two frames
+        if thumbnails_amount == 1:
+            frame_per_second = (duration - 0.05)
+        else:
+            frame_per_second = (duration - 0.05) / (thumbnails_amount - 1)
+
+        positions = [frame_per_second * i if frame_per_second * i >= 1 else 0 for i in range(0, thumbnails_amount)]
+        with av.open(io.BytesIO(stream_file)) as container:
+            stream = self._get_video_stream(container)
+            if fast:
+                frames = self._decode_keyframes(container, stream, positions)
+            else:
+                keyframes = [timestamp for timestamp, _ in self._demux_keyframes(container, stream)]
+                frames = self._decode_frames(container, stream, positions, keyframes)
+            for frame in frames:
+                if self.cancel_check and self.cancel_check():
+                    raise ProcessCancelledError(
+                        None, None, None, 'Timeline thumbnails capturing was cancelled.'
+                    )
+                # keep aspect ratio, the same as ffmpeg `scale=-1:50`
+                width = round(frame.width * TIMELINE_THUMBNAIL_HEIGHT / frame.height)
+                yield self._encode_png(frame.reformat(width=width, height=TIMELINE_THUMBNAIL_HEIGHT))
+
+    def _get_video_stream(self, container):
+        """
+        Get the first video stream of container
+        :param container: input container
+        :type container: av.container.InputContainer
+        :return: video stream
+        :rtype: av.video.stream.VideoStream
+        """
+
+        if not container.streams.video:
+            raise Exception(f'codec_type "video" was not found in streams. '
+                            f'Streams: {container.streams}.')
+        return container.streams.video[0]
+
+    def _get_stream_meta(self, container, stream, size):
+        """
+        Get metadata of a video stream, keys and types are the same as `FFMPEGVideoEditor._get_meta` returns
+        :param container: input container
+        :type container: av.container.InputContainer
+        :param stream: video stream
+        :type stream: av.video.stream.VideoStream
+        :param size: file size
+        :type size: int
+        :return: metadata
+        :rtype: dict
+        """
+
+        codec_context = stream.codec_context
+        # `base_rate` is the same as ffprobe `r_frame_rate`
+        rate = getattr(stream, 'base_rate', None) or stream.average_rate
+        duration = None
+        if stream.duration is not None:
+            duration = float(stream.duration * stream.time_base)
+        elif container.duration is not None:
+            # some videos don't have duration in video stream
+            duration = container.duration / av.time_base
+
+        return {
+            'codec_name': codec_context.name,
+            'codec_long_name': codec_context.codec.long_name,
+            'width': codec_context.width,
+            'height': codec_context.height,
+            'r_frame_rate': f'{rate.numerator}/{rate.denominator}' if rate else '0/0',
+            'bit_rate': codec_context.bit_rate or None,
+            'nb_frames': stream.frames or None,
+            'duration': duration,
+            'format_name': container.format.name,
+            'size': size,
+        }
+
+    def _demux_keyframes(self, container, stream):
+        """
+        Read packets of a video stream and collect keyframes, frames are not decoded
+        :param container: input container
+        :type container: av.container.InputContainer
+        :param stream: video stream
+        :type stream: av.video.stream.VideoStream
+        :return: sorted keyframes timestamps and byte offsets (-1 if unknown)
+        :rtype: list
+        """
+
+        return sorted(
+            (float(packet.pts * stream.time_base), packet.pos if packet.pos is not None else -1)
+            for packet in container.demux(stream)
+            if packet.is_keyframe and packet.pts is not None
+        )
+
+    def _decode_frames(self, container, stream, positions, keyframes=None):
+        """
+        Decode frames at sorted positions.
+        Decoder seeks to the keyframe before a position only if that keyframe is after the last decoded frame,
+        otherwise it keeps decoding forward, so frames of the same GOP are never decoded twice.
+        :param container: input container
+        :type container: av.container.InputContainer
+        :param stream: video stream
+        :type stream: av.video.stream.VideoStream
+        :param positions: sorted video positions in seconds
+        :type positions: list
+        :param keyframes: sorted keyframes timestamps, if not set decoder seeks only to the first position
+        :type keyframes: list
+        :return: the first frame at or after each position, the last frame if position is beyond the end
+        :rtype: generator
+        """
+
+        # frame and slice threading, the same as ffmpeg does by default
+        stream.thread_type = 'AUTO'
+        frames = None
+        frame = None
+        for position in positions:
+            index = bisect.bisect_right(keyframes, position) if keyframes else 0
+            keyframe = keyframes[index - 1] if index else 0.0
+            if frames is None or (frame is not None and frame.time is not None and frame.time < keyframe):
+                container.seek(int(position / stream.time_base), stream=stream, backward=True, any_frame=False)
+                frames = container.decode(stream)
+                frame = None
+            if frame is None or frame.time is None or frame.time < position:
+                for frame in frames:
+                    if frame.time is not None and frame.time >= position:
+                        break
+            if frame is None:
+                raise Exception(f'No frame was decoded at position {position}.')
+            yield frame
+
+    def _decode_keyframes(self, container, stream, positions):
+        """
+        Decode keyframes at or before positions, decoder seeks to every position and skips non-key frames,
+        so only one frame is decoded per position.
+        :param container: input container
+        :type container: av.container.InputContainer
+        :param stream: video stream
+        :type stream: av.video.stream.VideoStream
+        :param positions: video positions in seconds
+        :type positions: list
+        :return: keyframe at or before each position
+        :rtype: generator
+        """
+
+        stream.codec_context.skip_frame = 'NONKEY'
+        for position in positions:
+            container.seek(int(position / stream.time_base), stream=stream, backward=True, any_frame=False)
+            frame = next(container.decode(stream), None)
+            if frame is None:
+                raise Exception(f'No keyframe was decoded at position {position}.')
+            yield frame
+
+    def _filter_frame(self, stream, frame, filters):
+        """
+        Apply libavfilter filters to a frame
+        :param stream: video stream frame was decoded from
+        :type stream: av.video.stream.VideoStream
+        :param frame: decoded frame
+        :type frame: av.VideoFrame
+        :param filters: filter names and arguments
+        :type filters: list
+        :return: filtered frame
+        :rtype: av.VideoFrame
+        """
+
+        # https://ffmpeg.org/ffmpeg-filters.html
+        graph = av.filter.Graph()
+        nodes = [graph.add_buffer(template=stream)]
+        for name, args in filters:
+            nodes.append(graph.add(name, args))
+        nodes.append(graph.add('buffersink'))
+        graph.link_nodes(*nodes).configure()
+        graph.push(frame)
+        return graph.pull()
+
+    def _encode_png(self, frame):
+        """
+        Encode a frame into png image
+        :param frame: video frame
+        :type frame: av.VideoFrame
+        :return: file stream, metadata
+        :rtype: bytes, dict
+        """
+
+        codec_context = av.CodecContext.create('png', 'w')
+        codec_context.width = frame.width
+        codec_context.height = frame.height
+        codec_context.pix_fmt = 'rgb24'
+        packets = [*codec_context.encode(frame.reformat(format='rgb24')), *codec_context.encode(None)]
+        content = b''.join(bytes(packet) for packet in packets)
+
+        return content, {
+            'codec_name': 'png',
+            'codec_long_name': codec_context.codec.long_name,
+            'width': frame.width,
+            'height': frame.height,
+            # ffprobe reports default rate of image demuxers
+            'r_frame_rate': '25/1',
+            'bit_rate': None,
+            'nb_frames': None,
+            'duration': None,
+            'format_name': 'png_pipe',
+            'size': len(content),
+            'faststart': None,
+            'mimetype': 'image/png',
+        }
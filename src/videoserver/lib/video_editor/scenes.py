@@ -0,0 +1,74 @@
+import sys
+from array import array
+
+
+def parse_scene_scores(output):
+    """
+    Parse output of ffmpeg `metadata=print` filter placed after scene detecting `select` filter
+    :param output: filter output, `frame:<n> pts:<pts> pts_time:<seconds>` line and metadata lines of every frame
+    :type output: str
+    :return: scenes timestamps and scores in order of frames, the first frame always starts a scene
+    :rtype: list
+    """
+
+    scenes = []
+    for line in output.splitlines():
+        if line.startswith('frame:'):
+            pts_time = line.rsplit('pts_time:', 1)[-1].strip()
+            scenes.append([float(pts_time), 0.0])
+        elif line.startswith('lavfi.scene_score=') and scenes:
+            scenes[-1][1] = float(line.split('=', 1)[1])
+    if scenes:
+        scenes[0][1] = 1.0
+
+    return [tuple(scene) for scene in scenes]
+
+
+def pick_scenes(scenes, amount):
+    """
+    Pick timestamps of the most distinct scenes
+    :param scenes: scenes timestamps and scores
+    :type scenes: list
+    :param amount: max number of scenes
+    :type amount: int
+    :return: timestamps of up to `amount` scenes with the highest scores in chronological order
+    :rtype: list
+    """
+
+    best = sorted(scenes, key=lambda scene: scene[1], reverse=True)[:amount]
+    return sorted(timestamp for timestamp, _ in best)
+
+
+def pack_scenes(scenes):
+    """
+    Pack scenes into arrays of bytes, timestamps are float64 and scores are float32 little-endian
+    :param scenes: scenes timestamps and scores
+    :type scenes: list
+    :return: packed timestamps, packed scores
+    :rtype: bytes, bytes
+    """
+
+    timestamps = array('d', (timestamp for timestamp, _ in scenes))
+    scores = array('f', (score for _, score in scenes))
+    if sys.byteorder == 'big':
+        timestamps.byteswap()
+        scores.byteswap()
+    return timestamps.tobytes(), scores.tobytes()
+
+
+def unpack_scenes(timestamps, scores):
+    """
+    Load scenes from packed arrays
+    :param timestamps: packed timestamps
+    :type timestamps: bytes
+    :param scores: packed scores
+    :type scores: bytes
+    :return: scenes timestamps and scores
+    :rtype: list
+    """
+
+    timestamps, scores = array('d', timestamps), array('f', scores)
+    if sys.byteorder == 'big':
+        timestamps.byteswap()
+        scores.byteswap()
+    return list(zip(timestamps, scores))
@@ -5,9 +5,11 @@ $1: input file
 $2: output file
 $3: time delta between frames
 $4: total frames
+$5: frame height
 ########
 '
-for i in `seq 0 $4`
+set -e
+for i in `seq 0 $(($4 - 1))`
 do
         if [ 1 -eq "$(echo "${i}*${3} < 1" | bc)" ]
         then
@@ -15,5 +17,5 @@ do
         else
                 position=$(echo "$3*$i" | bc)
         fi
-        ffmpeg -v error -y -accurate_seek -ss $position -i $1 -filter:v scale="-1:50" -frames:v 1 $2$i.png
+        ffmpeg -v error -y -accurate_seek -ss $position -i $1 -filter:v scale="-1:$5" -frames:v 1 $2$i.png
 done
\ No newline at end of file
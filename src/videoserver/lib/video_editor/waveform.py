@@ -0,0 +1,74 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#: dtype of peak values by bits per value, little-endian
+PEAK_DTYPES = {8: 'i1', 16: '<i2'}
+
+
+def compute_peaks(pcm, samples_per_peak, levels, bits=8):
+    """
+    Reduce mono signed 16-bit little-endian PCM into min/max peaks of several zoom levels.
+    Samples are reduced block by block with vectorized numpy operations, every next level
+    merges pairs of peaks of the previous one, so audio is read only once.
+    :param pcm: raw PCM audio
+    :type pcm: bytes
+    :param samples_per_peak: number of samples reduced into one min/max pair of the most detailed level
+    :type samples_per_peak: int
+    :param levels: number of zoom levels, every next level has half the resolution of the previous one
+    :type levels: int
+    :param bits: bits per peak value, 8 or 16
+    :type bits: int
+    :return: interleaved min/max pairs of every level, from the most detailed one
+    :rtype: list
+    """
+
+    if np is None:
+        raise RuntimeError("NumPy is not installed, install it with `pip install videoserver[waveform]`.")
+
+    samples = np.frombuffer(pcm, dtype='<i2', count=len(pcm) // 2)
+    if not samples.size:
+        return [np.empty((0, 2), dtype=PEAK_DTYPES[bits]) for _ in range(levels)]
+
+    # the last block is padded with its last sample, which doesn't change its min and max
+    samples = np.pad(samples, (0, -samples.size % samples_per_peak), mode='edge')
+    blocks = samples.reshape(-1, samples_per_peak)
+    peaks = [np.stack((blocks.min(axis=1), blocks.max(axis=1)), axis=1)]
+    for _ in range(levels - 1):
+        previous = peaks[-1]
+        previous = np.pad(previous, ((0, previous.shape[0] % 2), (0, 0)), mode='edge').reshape(-1, 2, 2)
+        peaks.append(np.stack((previous[:, :, 0].min(axis=1), previous[:, :, 1].max(axis=1)), axis=1))
+
+    if bits == 8:
+        # keep the high byte, arithmetic shift rounds towards negative infinity for both min and max
+        peaks = [level >> 8 for level in peaks]
+    return [level.astype(PEAK_DTYPES[bits]) for level in peaks]
+
+
+def pack_peaks(peaks, samples_per_peak, bits=8):
+    """
+    Pack peaks of all zoom levels into one binary blob, levels follow each other without headers,
+    so a single level can be fetched with a range request.
+    :param peaks: interleaved min/max pairs of every level, see `compute_peaks`
+    :type peaks: list
+    :param samples_per_peak: number of samples in a peak of the most detailed level
+    :type samples_per_peak: int
+    :param bits: bits per peak value, 8 or 16
+    :type bits: int
+    :return: blob, levels description: `samples_per_peak`, byte `offset` and `length` in min/max pairs
+    :rtype: bytes, list
+    """
+
+    blob = b''.join(level.astype(PEAK_DTYPES[bits]).tobytes() for level in peaks)
+    levels = []
+    offset = 0
+    for index, level in enumerate(peaks):
+        levels.append({
+            'samples_per_peak': samples_per_peak * 2 ** index,
+            'offset': offset,
+            'length': len(level),
+        })
+        offset += len(level) * 2 * bits // 8
+
+    return blob, levels
@@ -1,7 +1,9 @@
 import bson
 from flask import current_app as app
 from flask.views import MethodView as FlaskMethodView
-from werkzeug.exceptions import NotFound
+from werkzeug.exceptions import NotFound, ServiceUnavailable
+
+from .scratch import ScratchSpaceError, scratch_job
 
 
 class MethodView(FlaskMethodView):
@@ -17,11 +19,16 @@ class MethodView(FlaskMethodView):
     def dispatch_request(self, *args, **kwargs):
         """
         Automatically preload project from db if `project_id` is in request.
+        Work files of the request are removed when it ends, see `scratch_job`.
         """
         if 'project_id' in kwargs:
             self._project_id = kwargs['project_id']
 
-        return super().dispatch_request(*args, **kwargs)
+        try:
+            with scratch_job():
+                return super().dispatch_request(*args, **kwargs)
+        except ScratchSpaceError as e:
+            raise ServiceUnavailable(str(e))
 
     @staticmethod
     def _get_project_or_404(project_id):
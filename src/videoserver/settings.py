@@ -63,6 +63,10 @@ BROKER_URL = env('CELERY_BROKER_URL', RABBIT_MQ_URL)
 CELERY_BROKER_URL = BROKER_URL
 CELERY_TASK_ALWAYS_EAGER = strtobool(env('CELERY_TASK_ALWAYS_EAGER', 'False'))
 CELERY_TASK_SERIALIZER = 'bson'
+#: result backend is required for dispatching segment encodes as celery subtasks
+CELERY_RESULT_BACKEND = env('CELERY_RESULT_BACKEND')
+#: minimal interval in seconds between saving editing progress into a project
+PROGRESS_UPDATE_INTERVAL = float(env('PROGRESS_UPDATE_INTERVAL', 2))
 #: number retry when task fail
 MAX_RETRIES = int(env('MAX_RETRIES', 3))
 BROKER_CONNECTION_MAX_RETRIES = MAX_RETRIES
@@ -75,6 +79,18 @@ CODEC_EXTENSION_MAP = {
     'png': 'png',
     'mjpeg': 'jpeg'
 }
+#: encoders used when a stream must be re-encoded with the same codec
+CODEC_ENCODER_MAP = {
+    'h264': 'libx264',
+    'vp8': 'libvpx',
+    'vp9': 'libvpx-vp9',
+    'theora': 'libtheora',
+    'av1': 'libaom-av1',
+    'aac': 'aac',
+    'mp3': 'libmp3lame',
+    'opus': 'libopus',
+    'vorbis': 'libvorbis',
+}
 CODEC_MIMETYPE_MAP = {
     'bmp': 'image/bmp',
     'png': 'image/png',
@@ -87,11 +103,46 @@ DEFAULT_PATH = os.path.join(BASE_PATH, 'media', 'projects')
 FS_MEDIA_STORAGE_PATH = env('FS_MEDIA_STORAGE_PATH', DEFAULT_PATH)
 
 #: media tool
+# 'ffmpeg' - ffmpeg/ffprobe subprocesses,
+# 'pyav' - metadata and thumbnails are decoded in-process by PyAV (`pip install videoserver[pyav]`),
+# editing is done by ffmpeg.
 DEFAULT_MEDIA_TOOL = env('DEFAULT_MEDIA_TOOL', 'ffmpeg')
 
 #: pagination, items per page
 ITEMS_PER_PAGE = int(env('ITEMS_PER_PAGE', 25))
 DEFAULT_TOTAL_TIMELINE_THUMBNAILS = int(env('DEFAULT_TOTAL_TIMELINE_THUMBNAILS', 40))
+#: min ffmpeg scene score (0-1) of a frame which starts a new scene, used by `scenes` timeline thumbnails mode
+SCENE_CHANGE_THRESHOLD = float(env('SCENE_CHANGE_THRESHOLD', 0.3))
+#: capture mode of interval timeline thumbnails and preview thumbnails, may be changed per request.
+# 'accurate' captures frames exactly at positions, 'fast' captures keyframes at or before positions,
+# only these keyframes are decoded (at reduced resolution for timeline if decoder supports `lowres`).
+CAPTURE_MODES = ('accurate', 'fast')
+DEFAULT_CAPTURE_MODE = env('DEFAULT_CAPTURE_MODE', 'accurate')
+
+#: animated thumbnail, a looping WebP of frames sampled evenly across the video, e.g. for hover previews
+ANIMATED_THUMBNAIL_FRAMES = int(env('ANIMATED_THUMBNAIL_FRAMES', 10))
+ANIMATED_THUMBNAIL_HEIGHT = int(env('ANIMATED_THUMBNAIL_HEIGHT', 144))
+# playback frames per second
+ANIMATED_THUMBNAIL_FRAME_RATE = float(env('ANIMATED_THUMBNAIL_FRAME_RATE', 2))
+# libwebp quality 0-100
+ANIMATED_THUMBNAIL_QUALITY = int(env('ANIMATED_THUMBNAIL_QUALITY', 60))
+
+#: max number of preview thumbnail candidates captured in one request
+MAX_PREVIEW_CANDIDATES = int(env('MAX_PREVIEW_CANDIDATES', 20))
+
+#: on-demand frames for scrubbing, captured synchronously from the proxy if it is large enough
+FRAME_MAX_WIDTH = int(env('FRAME_MAX_WIDTH', 1280))
+# mjpeg qscale 2-31, lower is better
+FRAME_JPEG_QUALITY = int(env('FRAME_JPEG_QUALITY', 4))
+# libwebp quality 0-100
+FRAME_WEBP_QUALITY = int(env('FRAME_WEBP_QUALITY', 75))
+# requested positions are rounded to this step in seconds, so nearby requests share cached frames
+FRAME_POSITION_STEP = float(env('FRAME_POSITION_STEP', 0.1))
+# least recently used frames are evicted above FRAME_CACHE_MAX_ENTRIES, it is checked every
+# FRAME_CACHE_EVICT_INTERVAL inserted frames, so the cache may exceed it by that many frames per process
+FRAME_CACHE_ENABLED = strtobool(env('FRAME_CACHE_ENABLED', 'True'))
+FRAME_CACHE_MAX_ENTRIES = int(env('FRAME_CACHE_MAX_ENTRIES', 10000))
+FRAME_CACHE_EVICT_INTERVAL = int(env('FRAME_CACHE_EVICT_INTERVAL', 100))
 
 #: set PORT for video server
 VIDEO_SERVER_PORT = env('VIDEO_SERVER_PORT', 5050)
@@ -111,6 +162,11 @@ MIN_VIDEO_WIDTH = env('MIN_VIDEO_WIDTH', 320)
 MAX_VIDEO_WIDTH = env('MAX_VIDEO_WIDTH', 3840)
 MIN_VIDEO_HEIGHT = env('MIN_VIDEO_HEIGHT', 180)
 MAX_VIDEO_HEIGHT = env('MAX_VIDEO_HEIGHT', 2160)
+#: trim mode used for trim-only edits if `trim_mode` is not set in the request.
+# 'accurate' re-encodes an entire trimmed video,
+# 'copy' uses stream copy (no re-encoding), but cut points are snapped to the closest keyframes,
+# 'smart' re-encodes only partial GOPs at the cut points and stream copies the rest.
+DEFAULT_TRIM_MODE = env('DEFAULT_TRIM_MODE', 'accurate')
 
 #: ffmpeg command line defaults
 # the default is the number of available CPUs (0)
@@ -121,3 +177,159 @@ FFMPEG_THREADS = env('FFMPEG_THREADS', '0')
 # but the file size will be larger when compared to medium. The visual quality will be the same.
 # Valid presets are ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow and placebo.
 FFMPEG_PRESET = env('FFMPEG_PRESET', 'medium')
+
+#: encoding profiles of edited video, per output codec (codec of the source video) and speed tier.
+# Every edit may pick a tier, `draft` trades file size for a several times faster encoding.
+# encoder - ffmpeg encoder
+# crf/bitrate/qscale - quality, constant rate factor, target bitrate or quantizer scale
+# preset - x264 speed preset
+# options - other encoder options, e.g. speed of libvpx and libaom
+# keyframe_interval - max seconds between keyframes
+ENCODING_TIERS = ('draft', 'standard', 'archive')
+DEFAULT_ENCODING_TIER = env('DEFAULT_ENCODING_TIER', 'standard')
+ENCODING_PROFILES = {
+    'h264': {
+        'draft': {'encoder': 'libx264', 'crf': 28, 'preset': 'ultrafast', 'keyframe_interval': 2},
+        'standard': {'encoder': 'libx264', 'crf': 23, 'preset': FFMPEG_PRESET, 'keyframe_interval': 2},
+        'archive': {'encoder': 'libx264', 'crf': 18, 'preset': 'slow', 'keyframe_interval': 2},
+    },
+    'vp8': {
+        'draft': {'encoder': 'libvpx', 'crf': 20, 'bitrate': '2M', 'keyframe_interval': 2,
+                  'options': ('-deadline', 'realtime', '-cpu-used', '8')},
+        'standard': {'encoder': 'libvpx', 'crf': 10, 'bitrate': '2M', 'keyframe_interval': 2,
+                     'options': ('-deadline', 'good', '-cpu-used', '4')},
+        'archive': {'encoder': 'libvpx', 'crf': 6, 'bitrate': '4M', 'keyframe_interval': 2,
+                    'options': ('-deadline', 'good', '-cpu-used', '1')},
+    },
+    'vp9': {
+        'draft': {'encoder': 'libvpx-vp9', 'crf': 40, 'bitrate': '0', 'keyframe_interval': 2,
+                  'options': ('-deadline', 'realtime', '-cpu-used', '8', '-row-mt', '1')},
+        'standard': {'encoder': 'libvpx-vp9', 'crf': 33, 'bitrate': '0', 'keyframe_interval': 2,
+                     'options': ('-deadline', 'good', '-cpu-used', '4', '-row-mt', '1')},
+        'archive': {'encoder': 'libvpx-vp9', 'crf': 31, 'bitrate': '0', 'keyframe_interval': 2,
+                    'options': ('-deadline', 'good', '-cpu-used', '1', '-row-mt', '1')},
+    },
+    'theora': {
+        'draft': {'encoder': 'libtheora', 'qscale': 5, 'keyframe_interval': 2},
+        'standard': {'encoder': 'libtheora', 'qscale': 7, 'keyframe_interval': 2},
+        'archive': {'encoder': 'libtheora', 'qscale': 9, 'keyframe_interval': 2},
+    },
+    'av1': {
+        'draft': {'encoder': 'libaom-av1', 'crf': 40, 'bitrate': '0', 'keyframe_interval': 2,
+                  'options': ('-cpu-used', '8', '-row-mt', '1', '-usage', 'realtime')},
+        'standard': {'encoder': 'libaom-av1', 'crf': 32, 'bitrate': '0', 'keyframe_interval': 2,
+                     'options': ('-cpu-used', '6', '-row-mt', '1')},
+        'archive': {'encoder': 'libaom-av1', 'crf': 28, 'bitrate': '0', 'keyframe_interval': 2,
+                    'options': ('-cpu-used', '4', '-row-mt', '1')},
+    },
+}
+
+#: segment-parallel encoding of crop/rotate/scale edits.
+# Video at least FFMPEG_SEGMENT_MIN_DURATION seconds long is split at keyframes into FFMPEG_SEGMENT_WORKERS
+# segments which are encoded in parallel and concatenated back. 1 disables segment-parallel encoding.
+FFMPEG_SEGMENT_WORKERS = int(env('FFMPEG_SEGMENT_WORKERS', 1))
+FFMPEG_SEGMENT_MIN_DURATION = float(env('FFMPEG_SEGMENT_MIN_DURATION', 120))
+# 'local' - segments are encoded by a pool of ffmpeg processes inside the edit task,
+# 'celery' - segments are encoded by celery subtasks, so they can be spread across workers.
+FFMPEG_SEGMENT_DISPATCH = env('FFMPEG_SEGMENT_DISPATCH', 'local')
+
+#: supervision of ffmpeg/ffprobe subprocesses.
+# ffmpeg is killed after FFMPEG_TIMEOUT_BASE + FFMPEG_TIMEOUT_FACTOR * <video duration> seconds,
+# or after FFMPEG_TIMEOUT seconds if duration is not known, ffprobe is killed after FFPROBE_TIMEOUT seconds.
+FFMPEG_TIMEOUT_BASE = float(env('FFMPEG_TIMEOUT_BASE', 60))
+FFMPEG_TIMEOUT_FACTOR = float(env('FFMPEG_TIMEOUT_FACTOR', 10))
+FFMPEG_TIMEOUT = float(env('FFMPEG_TIMEOUT', 2 * 60 * 60))
+FFPROBE_TIMEOUT = float(env('FFPROBE_TIMEOUT', 60))
+# resource limits of every subprocess (including its children), 0 means unlimited.
+# CPU time in seconds, address space (virtual memory) in bytes, size of a written file in bytes.
+FFMPEG_CPU_TIME_LIMIT = int(env('FFMPEG_CPU_TIME_LIMIT', 0))
+FFMPEG_MEMORY_LIMIT = int(env('FFMPEG_MEMORY_LIMIT', 0))
+FFMPEG_FILE_SIZE_LIMIT = int(env('FFMPEG_FILE_SIZE_LIMIT', 0))
+
+#: scratch space for ffmpeg work files, every task and request gets own directories removed when it ends.
+# SCRATCH_DIR holds videos, system temp directory if empty. SCRATCH_SMALL_DIR holds thumbnails and frames
+# and may be a tmpfs, SCRATCH_DIR if empty.
+SCRATCH_DIR = env('SCRATCH_DIR', '')
+SCRATCH_SMALL_DIR = env('SCRATCH_SMALL_DIR', '')
+# a job on a file is started only if SCRATCH_SPACE_FACTOR times its size plus SCRATCH_MIN_FREE bytes are free,
+# otherwise a task is retried later and a request fails with 503
+SCRATCH_SPACE_FACTOR = float(env('SCRATCH_SPACE_FACTOR', 3))
+SCRATCH_MIN_FREE = int(env('SCRATCH_MIN_FREE', 512 * 1024 ** 2))
+# directories of processes of this host which are not running are removed on startup
+SCRATCH_SWEEP_ON_STARTUP = strtobool(env('SCRATCH_SWEEP_ON_STARTUP', 'True'))
+
+#: ffprobe metadata cache keyed by a content hash, stored in `metadata_cache` mongo collection.
+# Entries not accessed for METADATA_CACHE_TTL seconds are evicted.
+METADATA_CACHE_ENABLED = strtobool(env('METADATA_CACHE_ENABLED', 'True'))
+METADATA_CACHE_TTL = int(env('METADATA_CACHE_TTL', 7 * 24 * 60 * 60))
+
+#: rendered videos cache keyed by a source content hash and normalized edit rules, identical edits of
+# the same source are copied instead of rendered. Least recently used videos are evicted above RENDER_CACHE_MAX_SIZE.
+RENDER_CACHE_ENABLED = strtobool(env('RENDER_CACHE_ENABLED', 'True'))
+# bytes
+RENDER_CACHE_MAX_SIZE = int(env('RENDER_CACHE_MAX_SIZE', 10 * 1024 ** 3))
+
+#: cost model predicting wall time of edits from source metadata, output frame size and encoding profile.
+# It is calibrated by timings of finished edits stored in `encode_timings` mongo collection, the latest
+# COST_MODEL_SAMPLES timings of the same codec, tier and trim mode are fitted once there are COST_MODEL_MIN_SAMPLES.
+# Timings expire after COST_MODEL_SAMPLE_TTL seconds.
+COST_MODEL_SAMPLES = int(env('COST_MODEL_SAMPLES', 50))
+COST_MODEL_MIN_SAMPLES = int(env('COST_MODEL_MIN_SAMPLES', 3))
+COST_MODEL_SAMPLE_TTL = int(env('COST_MODEL_SAMPLE_TTL', 30 * 24 * 60 * 60))
+# overhead seconds and seconds per megapixel of decoded and encoded frames per thread, by trim mode or encoding tier
+COST_MODEL_PRIORS = {
+    'copy': (1.0, 0.0002),
+    'smart': (2.0, 0.001),
+    'draft': (2.0, 0.005),
+    'standard': (2.0, 0.02),
+    'archive': (2.0, 0.05),
+}
+# celery priority levels of edit tasks, shortest estimated edits first, 0 disables priorities.
+# Priorities need RabbitMQ queues declared with `x-max-priority`, existing queues must be recreated.
+EDIT_PRIORITY_LEVELS = int(env('EDIT_PRIORITY_LEVELS', 0))
+CELERY_TASK_QUEUE_MAX_PRIORITY = EDIT_PRIORITY_LEVELS - 1 if EDIT_PRIORITY_LEVELS else None
+
+#: low resolution proxy rendition, generated at ingest and after each edit for videos higher than PROXY_HEIGHT.
+# Timeline thumbnails are captured from a proxy, it can be used for scrubbing via `/projects/<id>/raw/proxy`.
+PROXY_ENABLED = strtobool(env('PROXY_ENABLED', 'True'))
+PROXY_HEIGHT = int(env('PROXY_HEIGHT', 480))
+# seconds between keyframes
+PROXY_KEYFRAME_INTERVAL = float(env('PROXY_KEYFRAME_INTERVAL', 1))
+# x264 constant rate factor, higher is smaller and lower quality
+PROXY_CRF = int(env('PROXY_CRF', 28))
+
+#: edit preview, a short low resolution sample or a single frame rendered with edit rules without committing them
+EDIT_PREVIEW_HEIGHT = int(env('EDIT_PREVIEW_HEIGHT', 240))
+# max duration of a preview sample in seconds
+EDIT_PREVIEW_DURATION = float(env('EDIT_PREVIEW_DURATION', 3))
+
+#: adaptive streaming packaging, generated at ingest and after each edit if STREAMING_FORMATS is not empty.
+# 'hls' - HLS playlist with MPEG-TS segments, 'dash' - DASH manifest with fragmented mp4 segments.
+# Streams are copied if the format supports their codecs, otherwise they are encoded to h264/aac.
+STREAMING_FORMATS = tuple(f for f in env('STREAMING_FORMATS', '').split(',') if f)
+# seconds, segments are cut at keyframes so copied streams have segments of roughly this duration
+STREAMING_SEGMENT_DURATION = float(env('STREAMING_SEGMENT_DURATION', 6))
+# playlists and segments names are unique per video version, so they can be cached by clients and CDN forever
+STREAMING_CACHE_MAX_AGE = int(env('STREAMING_CACHE_MAX_AGE', 365 * 24 * 60 * 60))
+
+#: adaptive bitrate ladder, renditions of the video encoded in one ffmpeg pass at ingest and after each edit.
+# Renditions higher than the video are skipped. bitrate - max video bitrate in bits per second.
+RENDITIONS_ENABLED = strtobool(env('RENDITIONS_ENABLED', 'False'))
+RENDITION_LADDER = (
+    {'height': 1080, 'bitrate': 5000000},
+    {'height': 720, 'bitrate': 2800000},
+    {'height': 480, 'bitrate': 1400000},
+    {'height': 360, 'bitrate': 800000},
+)
+
+#: audio waveform for the editor timeline, min/max peaks generated at ingest and after each edit.
+# Requires numpy, install it with `pip install videoserver[waveform]`.
+WAVEFORM_ENABLED = strtobool(env('WAVEFORM_ENABLED', 'False'))
+# audio is decoded to mono PCM with this sample rate before it's reduced to peaks
+WAVEFORM_SAMPLE_RATE = int(env('WAVEFORM_SAMPLE_RATE', 8000))
+# samples per min/max pair of the most detailed zoom level
+WAVEFORM_SAMPLES_PER_PEAK = int(env('WAVEFORM_SAMPLES_PER_PEAK', 64))
+# number of zoom levels, every next level has half the resolution of the previous one
+WAVEFORM_LEVELS = int(env('WAVEFORM_LEVELS', 6))
+# bits per peak value, 8 or 16
+WAVEFORM_BITS = int(env('WAVEFORM_BITS', 8))
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+from flask import url_for
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_preview_sample(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.preview_edit_project', project_id=project['_id'])
+        resp = client.post(
+            url,
+            data=json.dumps({
+                "trim": "2,10",
+                "crop": "0,0,640,480"
+            }),
+            content_type='application/json'
+        )
+        assert resp.status == '200 OK'
+        preview = json.loads(resp.data)
+        assert preview['mimetype'] == 'video/mp4'
+        assert preview['width'] == 320
+        assert preview['height'] == 240
+        assert preview['duration'] == pytest.approx(test_app.config['EDIT_PREVIEW_DURATION'], abs=0.1)
+
+        resp = client.get(preview['url'])
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'video/mp4'
+        assert resp.content_length == preview['size']
+
+        # preview is cached by edit rules
+        resp = client.post(
+            url,
+            data=json.dumps({
+                "crop": "0,0,640,480",
+                "trim": "2,10"
+            }),
+            content_type='application/json'
+        )
+        assert json.loads(resp.data)['_id'] == preview['_id']
+        assert test_app.mongo.db.edit_previews.count_documents({}) == 1
+
+        # video is not changed
+        resp = client.get(url_for('projects.retrieve_edit_destroy_project', project_id=project['_id']))
+        assert json.loads(resp.data)['version'] == project['version']
+
+        # previews are removed after video is edited
+        resp = client.put(
+            url_for('projects.retrieve_edit_destroy_project', project_id=project['_id']),
+            data=json.dumps({"trim": "2,10"}),
+            content_type='application/json'
+        )
+        assert resp.status == '202 ACCEPTED'
+        assert test_app.mongo.db.edit_previews.count_documents({}) == 0
+        resp = client.get(preview['url'])
+        assert resp.status == '404 NOT FOUND'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_preview_frame(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.preview_edit_project', project_id=project['_id'])
+        resp = client.post(
+            url,
+            data=json.dumps({
+                "trim": "2,10",
+                "rotate": 90,
+                "position": 1.5
+            }),
+            content_type='application/json'
+        )
+        assert resp.status == '200 OK'
+        preview = json.loads(resp.data)
+        assert preview['mimetype'] == 'image/png'
+        assert preview['height'] == 240
+
+        resp = client.get(preview['url'])
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'image/png'
+
+        # position is outside of trimmed video
+        resp = client.post(
+            url,
+            data=json.dumps({
+                "trim": "2,10",
+                "position": 8
+            }),
+            content_type='application/json'
+        )
+        assert resp.status == '400 BAD REQUEST'
+        assert json.loads(resp.data) == {'position': ['position is outside of edited video']}
+
+        # at least one edit rule is required
+        resp = client.post(
+            url,
+            data=json.dumps({"position": 1}),
+            content_type='application/json'
+        )
+        assert resp.status == '400 BAD REQUEST'
@@ -0,0 +1,105 @@
+import json
+from unittest import mock
+
+import pytest
+from flask import url_for
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edits_render(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.create_destroy_edits', project_id=project['_id'])
+        resp = client.post(url, data=json.dumps({"trim": "2,12"}), content_type='application/json')
+        assert resp.status == '201 CREATED'
+        resp = client.post(url, data=json.dumps({"crop": "0,0,640,480"}), content_type='application/json')
+        assert resp.status == '201 CREATED'
+        resp_data = json.loads(resp.data)
+        assert len(resp_data['edits']) == 2
+        assert resp_data['metadata']['width'] == 640
+        assert resp_data['metadata']['height'] == 480
+        assert resp_data['metadata']['duration'] == 10
+
+        # edits are validated against video with pending edits applied
+        resp = client.post(url, data=json.dumps({"crop": "0,0,700,480"}), content_type='application/json')
+        assert resp.status == '400 BAD REQUEST'
+        assert json.loads(resp.data) == {"crop": ["width of crop's frame is outside a video's frame"]}
+
+        # video is not rendered yet
+        project_url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp_data = json.loads(client.get(project_url).data)
+        assert resp_data['version'] == project['version']
+        assert resp_data['metadata']['width'] == 1280
+
+        resp = client.post(url_for('projects.render_project', project_id=project['_id']))
+        assert resp.status == '202 ACCEPTED'
+        assert json.loads(resp.data) == {'processing': True, 'estimate': mock.ANY}
+
+        # edits are rendered in one pass
+        resp_data = json.loads(client.get(project_url).data)
+        assert resp_data['version'] == project['version'] + 1
+        assert resp_data['edits'] == []
+        assert resp_data['metadata']['width'] == 640
+        assert resp_data['metadata']['height'] == 480
+        assert resp_data['metadata']['duration'] == pytest.approx(10, abs=0.1)
+
+        resp = client.post(url_for('projects.render_project', project_id=project['_id']))
+        assert resp.status == '400 BAD REQUEST'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edits_lazy_render(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.create_destroy_edits', project_id=project['_id'])
+        resp = client.post(url, data=json.dumps({"trim": "2,12"}), content_type='application/json')
+        assert resp.status == '201 CREATED'
+
+        # pending edits are rendered on the first access to video
+        resp = client.get(url_for('projects.get_raw_video', project_id=project['_id']))
+        assert resp.status == '200 OK'
+        project_url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp_data = json.loads(client.get(project_url).data)
+        assert resp_data['version'] == project['version'] + 1
+        assert resp_data['edits'] == []
+        assert resp.content_length == resp_data['metadata']['size']
+
+        # edit is rendered along with pending edits
+        resp = client.post(url, data=json.dumps({"rotate": 90}), content_type='application/json')
+        assert resp.status == '201 CREATED'
+        resp = client.put(project_url, data=json.dumps({"trim": "1,5"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp_data = json.loads(client.get(project_url).data)
+        assert resp_data['version'] == project['version'] + 2
+        assert resp_data['edits'] == []
+        assert resp_data['metadata']['width'] == 720
+        assert resp_data['metadata']['duration'] == pytest.approx(4, abs=0.1)
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edits_discard(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.create_destroy_edits', project_id=project['_id'])
+        resp = client.post(url, data=json.dumps({"rotate": 90}), content_type='application/json')
+        assert resp.status == '201 CREATED'
+
+        resp = client.delete(url)
+        assert resp.status == '204 NO CONTENT'
+        project_url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp_data = json.loads(client.get(project_url).data)
+        assert resp_data['edits'] == []
+        assert resp_data['version'] == project['version']
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_edits_version_1(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.create_destroy_edits', project_id=project['_id'])
+        resp = client.post(url, data=json.dumps({"rotate": 90}), content_type='application/json')
+        assert resp.status == '400 BAD REQUEST'
@@ -0,0 +1,80 @@
+import json
+import struct
+from unittest import mock
+
+import pytest
+from flask import url_for
+
+from videoserver.lib.video_editor.ffmpeg import FFMPEGVideoEditor
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_frame(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_frame', project_id=project['_id'])
+        resp = client.get(url + '?t=5.02&w=321')
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'image/jpeg'
+        assert resp.headers['X-Frame-Cache'] == 'miss'
+        content = resp.get_data()
+        assert content.startswith(b'\xff\xd8')
+
+        # positions are rounded, so nearby requests share cached frames
+        with mock.patch.object(FFMPEGVideoEditor, 'capture_frame') as capture_frame:
+            resp = client.get(url + '?t=4.98&w=320')
+            assert not capture_frame.called
+        assert resp.status == '200 OK'
+        assert resp.headers['X-Frame-Cache'] == 'hit'
+        assert resp.get_data() == content
+
+        resp = client.get(url + '?t=5&w=320&format=webp')
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'image/webp'
+        assert resp.headers['X-Frame-Cache'] == 'miss'
+        content = resp.get_data()
+        assert content[:4] == b'RIFF' and content[8:12] == b'WEBP'
+
+        # frame is not upscaled, position beyond the end is the last frame
+        resp = client.get(url + '?t=100&format=webp&w=1280')
+        assert resp.status == '200 OK'
+        content = resp.get_data()
+        # https://developers.google.com/speed/webp/docs/riff_container#simple_file_format_lossy
+        assert content[12:16] == b'VP8 '
+        width, height = struct.unpack('<HH', content[26:30])
+        assert (width & 0x3fff, height & 0x3fff) == (1280, 720)
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_frame_fail(test_app, client, projects):
+    project = projects[0]
+    test_app.config['FRAME_MAX_WIDTH'] = 640
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_frame', project_id=project['_id'])
+        for query in ('', '?t=-1', '?t=abc', '?t=1&w=1280', '?t=1&w=0', '?t=1&format=png'):
+            resp = client.get(url + query)
+            assert resp.status == '400 BAD REQUEST'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_frame_cache_eviction(test_app, client, projects):
+    project = projects[0]
+    test_app.config['FRAME_CACHE_MAX_ENTRIES'] = 2
+    test_app.config['FRAME_CACHE_EVICT_INTERVAL'] = 1
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_frame', project_id=project['_id'])
+        for position in (1, 2, 1, 3):
+            resp = client.get(url + f'?t={position}&w=160')
+            assert resp.status == '200 OK'
+        # frame at 2 s is the least recently used
+        assert resp.headers['X-Frame-Cache'] == 'miss'
+        assert sorted(doc['_id'].split('_')[2] for doc in test_app.mongo.db.frame_cache.find()) == ['1000ms', '3000ms']
+
+        # frames of the previous version are removed after an edit
+        project_url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(project_url, data=json.dumps({"trim": "2,10"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        assert test_app.mongo.db.frame_cache.count_documents({}) == 0
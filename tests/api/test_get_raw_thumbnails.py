@@ -66,3 +66,20 @@ def test_get_raw_preview_thumbnail_404(test_app, client, projects):
         resp = client.get(url)
 
         assert resp.status == '404 NOT FOUND'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_animated_thumbnail(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.get_raw_animated_thumbnail', project_id=project['_id'])
+        resp = client.get(url)
+        assert resp.status == '404 NOT FOUND'
+
+        # capture animated thumbnail
+        client.get(url_for('projects.retrieve_or_create_thumbnails', project_id=project['_id']) + '?type=animated')
+        resp = client.get(url)
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'image/webp'
+        assert resp.data[:4] == b'RIFF'
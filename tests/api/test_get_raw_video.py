@@ -1,3 +1,6 @@
+import json
+from array import array
+
 from bson import ObjectId
 
 import pytest
@@ -52,3 +55,158 @@ def test_get_raw_video_409_resp(test_app, client, projects):
         resp = client.get(url)
 
         assert resp.status == '409 CONFLICT'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_proxy(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        # proxy is created by a task after upload
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.get(url)
+        proxy = json.loads(resp.data)['proxy']
+        assert proxy['height'] == 480
+        assert proxy['version'] == 1
+        assert proxy['url'] == url_for('projects.get_raw_proxy', project_id=project['_id'], _external=True)
+
+        resp = client.get(proxy['url'])
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'video/mp4'
+        assert resp.content_length == proxy['size']
+
+        resp = client.get(proxy['url'], headers={"Range": "bytes=200-"})
+        assert resp.status == '206 PARTIAL CONTENT'
+
+        # proxy is recreated for an edited video
+        resp = client.put(url, data=json.dumps({"trim": "2,10"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp = client.get(url)
+        assert json.loads(resp.data)['proxy']['version'] == 2
+
+        # proxy is not created for a video which is not higher than `PROXY_HEIGHT`
+        test_app.config['PROXY_HEIGHT'] = 720
+        resp = client.put(url, data=json.dumps({"trim": "2,6"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp = client.get(url)
+        assert json.loads(resp.data)['proxy'] is None
+        resp = client.get(url_for('projects.get_raw_proxy', project_id=project['_id']))
+        assert resp.status == '404 NOT FOUND'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_stream(test_app, client, projects):
+    project = projects[0]
+    test_app.config['STREAMING_FORMATS'] = ('hls', 'dash')
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.get(url)
+        assert json.loads(resp.data)['streaming'] == {}
+
+        # streaming files are packaged by a task after each edit
+        resp = client.put(url, data=json.dumps({"trim": "2,10"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp = client.get(url)
+        streaming = json.loads(resp.data)['streaming']
+        assert streaming['hls']['playlist'] == 'v2.m3u8'
+        assert streaming['hls']['version'] == 2
+        assert streaming['dash']['playlist'] == 'v2.mpd'
+        assert streaming['hls']['url'] == url_for(
+            'projects.get_raw_stream', project_id=project['_id'], stream_format='hls', filename='v2.m3u8',
+            _external=True
+        )
+
+        resp = client.get(streaming['hls']['url'])
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'application/vnd.apple.mpegurl'
+        assert 'max-age=' in resp.headers['Cache-Control']
+        segment = next(line for line in resp.data.decode().splitlines() if line.endswith('.ts'))
+        resp = client.get(url_for('projects.get_raw_stream', project_id=project['_id'], stream_format='hls',
+                                  filename=segment))
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'video/mp2t'
+
+        resp = client.get(streaming['dash']['url'])
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'application/dash+xml'
+
+        # files of the previous version are removed after an edit
+        resp = client.put(url, data=json.dumps({"trim": "2,6"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp = client.get(streaming['hls']['url'])
+        assert resp.status == '404 NOT FOUND'
+        resp = client.get(url)
+        assert json.loads(resp.data)['streaming']['hls']['playlist'] == 'v3.m3u8'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_rendition(test_app, client, projects):
+    project = projects[0]
+    test_app.config['RENDITIONS_ENABLED'] = True
+    test_app.config['RENDITION_LADDER'] = (
+        {'height': 1080, 'bitrate': 5000000},
+        {'height': 480, 'bitrate': 1400000},
+        {'height': 360, 'bitrate': 800000},
+    )
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(url, data=json.dumps({"trim": "2,10"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp = client.get(url)
+        renditions = json.loads(resp.data)['renditions']
+        # video is not upscaled
+        assert [rendition['height'] for rendition in renditions] == [480, 360]
+        assert renditions[0]['metadata']['height'] == 480
+        assert renditions[0]['metadata']['duration'] == pytest.approx(8, abs=0.1)
+        assert renditions[0]['version'] == 2
+        assert renditions[0]['url'] == url_for('projects.get_raw_rendition', project_id=project['_id'], height=480,
+                                               _external=True)
+
+        resp = client.get(renditions[0]['url'])
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'video/mp4'
+        assert resp.content_length == renditions[0]['metadata']['size']
+
+        resp = client.get(url_for('projects.get_raw_rendition', project_id=project['_id'], height=1080))
+        assert resp.status == '404 NOT FOUND'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_get_raw_waveform(test_app, client, projects):
+    pytest.importorskip('numpy')
+    project = projects[0]
+    test_app.config['WAVEFORM_ENABLED'] = True
+    test_app.config['WAVEFORM_SAMPLE_RATE'] = 8000
+    test_app.config['WAVEFORM_SAMPLES_PER_PEAK'] = 64
+    test_app.config['WAVEFORM_LEVELS'] = 3
+    test_app.config['WAVEFORM_BITS'] = 8
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(url, data=json.dumps({"trim": "2,10"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp = client.get(url)
+        waveform = json.loads(resp.data)['waveform']
+        assert waveform['version'] == 2
+        assert waveform['url'] == url_for('projects.get_raw_waveform', project_id=project['_id'], _external=True)
+        assert [level['samples_per_peak'] for level in waveform['levels']] == [64, 128, 256]
+        # 8 seconds of 8000 Hz audio
+        assert waveform['levels'][0]['length'] == pytest.approx(1000, abs=20)
+        assert waveform['levels'][1]['offset'] == waveform['levels'][0]['length'] * 2
+        assert waveform['size'] == sum(level['length'] * 2 for level in waveform['levels'])
+
+        resp = client.get(waveform['url'])
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'application/octet-stream'
+        assert resp.content_length == waveform['size']
+
+        level = waveform['levels'][1]
+        end = level['offset'] + level['length'] * 2 - 1
+        resp = client.get(waveform['url'], headers={'Range': f"bytes={level['offset']}-{end}"})
+        assert resp.status == '206 PARTIAL CONTENT'
+        assert len(resp.get_data()) == level['length'] * 2
+        # interleaved signed min/max pairs
+        peaks = array('b', resp.get_data())
+        assert all(low <= high for low, high in zip(peaks[::2], peaks[1::2]))
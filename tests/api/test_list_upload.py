@@ -36,6 +36,8 @@ def test_upload_project_success(test_app, client, filestreams):
         assert resp_data['processing'] == {'video': False, 'thumbnail_preview': False, 'thumbnails_timeline': False}
         assert resp_data['thumbnails'] == {'timeline': [], 'preview': {}}
         assert resp_data['url'] == url_for('projects.get_raw_video', project_id=resp_data["_id"], _external=True)
+        # `moov` of uploaded video is moved to the beginning of the file
+        assert resp_data['metadata']['faststart'] is True
 
 
 @pytest.mark.parametrize('filestreams', [('sample_0.jpg',)], indirect=True)
@@ -1,5 +1,6 @@
 import json
 from io import BytesIO
+from unittest import mock
 from bson import ObjectId
 
 import pytest
@@ -57,6 +58,74 @@ def test_capture_timeline_thumbnails_remove_old(test_app, client, projects):
             assert test_app.fs.get(thumbnail_data['storage_id']).__class__ is bytes
 
 
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_capture_timeline_thumbnails_scenes(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_or_create_thumbnails', project_id=project['_id'])
+        resp = client.get(url + '?type=timeline&amount=5&mode=scenes')
+        assert resp.status == '202 ACCEPTED'
+
+        resp = client.get(url + '?type=timeline&amount=5&mode=scenes')
+        resp_data = json.loads(resp.data)
+        assert resp.status == '200 OK'
+        thumbnails = resp_data['thumbnails']
+        assert 1 <= len(thumbnails) <= 5
+        positions = [thumbnail['position'] for thumbnail in thumbnails]
+        # the first frame starts the first scene
+        assert positions[0] == 0
+        assert positions == sorted(positions)
+
+        # scenes are detected once per video version
+        scenes = test_app.mongo.db.scenes.find_one({'_id': ObjectId(project['_id'])})
+        assert scenes['version'] == 1
+        with mock.patch('videoserver.apps.projects.tasks.save_scenes') as save_scenes:
+            resp = client.get(url + '?type=timeline&amount=2&mode=scenes')
+            assert resp.status == '202 ACCEPTED'
+            save_scenes.assert_not_called()
+        resp = client.get(url + '?type=timeline&amount=2&mode=scenes')
+        best_positions = [thumbnail['position'] for thumbnail in json.loads(resp.data)['thumbnails']]
+        assert 1 <= len(best_positions) <= 2
+        assert set(best_positions) <= set(positions)
+
+        # interval thumbnails are captured again even if amount is the same
+        resp = client.get(url + '?type=timeline&amount=2')
+        assert resp.status == '202 ACCEPTED'
+
+        resp = client.get(url + '?type=timeline&mode=frames')
+        assert resp.status == '400 BAD REQUEST'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_capture_timeline_thumbnails_fast(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_or_create_thumbnails', project_id=project['_id'])
+        resp = client.get(url + '?type=timeline&amount=3')
+        assert resp.status == '202 ACCEPTED'
+
+        # thumbnails are captured again in another capture mode
+        resp = client.get(url + '?type=timeline&amount=3&capture_mode=fast')
+        assert resp.status == '202 ACCEPTED'
+        resp = client.get(url + '?type=timeline&amount=3&capture_mode=fast')
+        assert resp.status == '200 OK'
+        thumbnails = json.loads(resp.data)['thumbnails']
+        assert [(thumbnail['width'], thumbnail['height']) for thumbnail in thumbnails] == [(89, 50)] * 3
+
+        # default capture mode is set in settings
+        test_app.config['DEFAULT_CAPTURE_MODE'] = 'fast'
+        resp = client.get(url + '?type=timeline&amount=3')
+        assert resp.status == '200 OK'
+
+        # scenes are detected in every frame
+        resp = client.get(url + '?type=timeline&amount=3&mode=scenes&capture_mode=fast')
+        assert resp.status == '400 BAD REQUEST'
+        resp = client.get(url + '?type=timeline&amount=3&capture_mode=slow')
+        assert resp.status == '400 BAD REQUEST'
+
+
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
 def test_capture_timeline_thumbnails_409_resp(test_app, client, projects):
     project = projects[0]
@@ -228,6 +297,135 @@ def test_capture_preview_thumbnail_409_resp(test_app, client, projects):
         assert resp.status == '409 CONFLICT'
 
 
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_capture_animated_thumbnail_success(test_app, client, projects):
+    project = projects[0]
+    test_app.config['ANIMATED_THUMBNAIL_FRAMES'] = 6
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_or_create_thumbnails', project_id=project['_id']) + '?type=animated'
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert resp.status == '202 ACCEPTED'
+        assert resp_data == {'processing': True}
+
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert resp.status == '200 OK'
+        assert resp_data['mimetype'] == 'image/webp'
+        assert resp_data['height'] == test_app.config['ANIMATED_THUMBNAIL_HEIGHT']
+        assert resp_data['width'] == 256
+        assert resp_data['frames'] == 6
+        assert resp_data['url'] == url_for('projects.get_raw_animated_thumbnail', project_id=project['_id'],
+                                           _external=True)
+        assert test_app.fs.get(resp_data['storage_id']).__class__ is bytes
+
+        # animated thumbnail is removed after an edit
+        project_url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(project_url, data=json.dumps({"trim": "2,10"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp = client.get(project_url)
+        assert 'animated' not in json.loads(resp.data)['thumbnails']
+        with pytest.raises(FileNotFoundError):
+            test_app.fs.get(resp_data['storage_id'])
+
+        resp = client.get(url + '&amount=3')
+        assert resp.status == '400 BAD REQUEST'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_capture_animated_thumbnail_409_resp(test_app, client, projects):
+    project = projects[0]
+
+    test_app.mongo.db.projects.find_one_and_update(
+        {'_id': ObjectId(project['_id'])},
+        {'$set': {'processing.video': True}}
+    )
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_or_create_thumbnails', project_id=project['_id']) + '?type=animated'
+        resp = client.get(url)
+        assert resp.status == '409 CONFLICT'
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_capture_preview_candidates_success(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_create_select_preview_candidates', project_id=project['_id'])
+        resp = client.post(url, data=json.dumps({'candidates': [
+            {'position': 1},
+            {'position': 4.5, 'crop': '0,0,640,480'},
+            {'position': 8, 'rotate': 90},
+            # position greater than duration
+            {'position': 20},
+        ]}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        assert json.loads(resp.data) == {'processing': True}
+
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert resp.status == '200 OK'
+        assert resp_data['processing'] is False
+        candidates = resp_data['candidates']
+        assert [candidate['position'] for candidate in candidates] == [1, 4.5, 8, 15]
+        assert [(candidate['width'], candidate['height']) for candidate in candidates] == [
+            (1280, 720), (640, 480), (720, 1280), (1280, 720)
+        ]
+        assert candidates[1]['crop'] == {'x': 0, 'y': 0, 'width': 640, 'height': 480}
+        assert candidates[2]['rotate'] == 90
+        assert candidates[0]['url'] == url_for('projects.get_raw_candidate_thumbnail', project_id=project['_id'],
+                                               index=0, _external=True)
+        resp = client.get(candidates[1]['url'])
+        assert resp.status == '200 OK'
+        assert resp.mimetype == 'image/png'
+
+        # pick a candidate as a preview thumbnail
+        resp = client.put(url, data=json.dumps({'index': 1}), content_type='application/json')
+        resp_data = json.loads(resp.data)
+        assert resp.status == '200 OK'
+        assert resp_data['position'] == 4.5
+        assert (resp_data['width'], resp_data['height']) == (640, 480)
+        assert resp_data['storage_id'] != candidates[1]['storage_id']
+        assert test_app.fs.get(resp_data['storage_id']) == test_app.fs.get(candidates[1]['storage_id'])
+
+        resp = client.put(url, data=json.dumps({'index': 4}), content_type='application/json')
+        assert resp.status == '404 NOT FOUND'
+
+        # new candidates replace old ones
+        resp = client.post(url, data=json.dumps({'candidates': [{'position': 2}]}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp = client.get(url)
+        assert [candidate['position'] for candidate in json.loads(resp.data)['candidates']] == [2]
+        with pytest.raises(FileNotFoundError):
+            test_app.fs.get(candidates[0]['storage_id'])
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
+def test_capture_preview_candidates_fail(test_app, client, projects):
+    project = projects[0]
+    test_app.config['MAX_PREVIEW_CANDIDATES'] = 2
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_create_select_preview_candidates', project_id=project['_id'])
+        for candidates in ([], [{'position': 1}] * 3, [{'crop': '0,0,640,480'}], [{'position': 1, 'rotate': 45}]):
+            resp = client.post(url, data=json.dumps({'candidates': candidates}), content_type='application/json')
+            assert resp.status == '400 BAD REQUEST'
+
+        resp = client.post(url, data=json.dumps({'candidates': [{'position': 1, 'crop': '0,0,1640,480'}]}),
+                           content_type='application/json')
+        assert resp.status == '400 BAD REQUEST'
+        assert json.loads(resp.data) == {'crop': ["width of crop's frame is outside a video's frame"]}
+
+        test_app.mongo.db.projects.find_one_and_update(
+            {'_id': ObjectId(project['_id'])},
+            {'$set': {'processing.thumbnail_candidates': True}}
+        )
+        resp = client.post(url, data=json.dumps({'candidates': [{'position': 1}]}), content_type='application/json')
+        assert resp.status == '409 CONFLICT'
+
+
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
 @pytest.mark.parametrize('filestreams', [('sample_0.jpg',)], indirect=True)
 def test_upload_custom_preview_thumbnail_success(test_app, client, projects, filestreams):
@@ -1,9 +1,16 @@
 import json
+from datetime import datetime
+from unittest import mock
+
 from bson import ObjectId
 
 import pytest
 from flask import url_for
 
+from videoserver.lib.cache import get_render_cache_stats
+from videoserver.lib.cost import edit_features, fit_cost_model, shortest_job_priority
+from videoserver.lib.video_editor.ffmpeg import FFMPEGVideoEditor
+
 
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
 def test_retrieve_project_success(test_app, client, projects):
@@ -154,7 +161,7 @@ def test_edit_project_trim_success(test_app, client, projects):
         )
         resp_data = json.loads(resp.data)
         assert resp.status == '202 ACCEPTED'
-        assert resp_data == {'processing': True}
+        assert resp_data == {'processing': True, 'estimate': mock.ANY}
         # get details
         resp = client.get(url)
         resp_data = json.loads(resp.data)
@@ -174,7 +181,7 @@ def test_edit_project_trim_success(test_app, client, projects):
         )
         resp_data = json.loads(resp.data)
         assert resp.status == '202 ACCEPTED'
-        assert resp_data == {'processing': True}
+        assert resp_data == {'processing': True, 'estimate': mock.ANY}
         # get details
         resp = client.get(url)
         resp_data = json.loads(resp.data)
@@ -182,6 +189,95 @@ def test_edit_project_trim_success(test_app, client, projects):
         assert resp_data['metadata']['duration'] == old_duration - start
 
 
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_trim_stream_copy_success(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        # edit request
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(
+            url,
+            data=json.dumps({
+                "trim": "2.0,10.0",
+                "trim_mode": "copy"
+            }),
+            content_type='application/json'
+        )
+        resp_data = json.loads(resp.data)
+        assert resp.status == '202 ACCEPTED'
+        assert resp_data['processing'] is True
+        start, end = resp_data['trim']['start'], resp_data['trim']['end']
+        assert start <= 2.0
+        assert end >= 10.0
+        # get details
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert abs(resp_data['metadata']['duration'] - (end - start)) < 0.1
+        assert resp_data['metadata']['width'] == 1280
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_trim_smart_success(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        # edit request
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(
+            url,
+            data=json.dumps({
+                "trim": "2.5,11.5",
+                "trim_mode": "smart"
+            }),
+            content_type='application/json'
+        )
+        resp_data = json.loads(resp.data)
+        assert resp.status == '202 ACCEPTED'
+        assert resp_data == {'processing': True, 'estimate': mock.ANY}
+        # get details
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert abs(resp_data['metadata']['duration'] - 9.0) < 0.05
+        assert resp_data['metadata']['nb_frames'] == 225
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_trim_stream_copy_fail(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+
+        # trim mode without trim
+        resp = client.put(
+            url,
+            data=json.dumps({
+                "trim_mode": "copy"
+            }),
+            content_type='application/json'
+        )
+        resp_data = json.loads(resp.data)
+        assert resp.status == '400 BAD REQUEST'
+        assert resp_data == {'trim_mode': ["field 'trim' is required"]}
+
+        # stream copy with filters
+        resp = client.put(
+            url,
+            data=json.dumps({
+                "trim": "2.0,10.0",
+                "trim_mode": "copy",
+                "rotate": 90
+            }),
+            content_type='application/json'
+        )
+        resp_data = json.loads(resp.data)
+        assert resp.status == '400 BAD REQUEST'
+        assert resp_data == {'trim_mode': ["'copy' trim mode can't be combined with crop, rotate or scale"]}
+
+
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
 def test_edit_project_trim_fail(test_app, client, projects):
     project = projects[0]
@@ -290,12 +386,82 @@ def test_edit_project_rotate_success(test_app, client, projects):
         )
         resp_data = json.loads(resp.data)
         assert resp.status == '202 ACCEPTED'
-        assert resp_data == {'processing': True}
+        assert resp_data == {'processing': True, 'estimate': mock.ANY}
         # get details
         resp = client.get(url)
         resp_data = json.loads(resp.data)
         assert resp_data['metadata']['width'] == 720
         assert resp_data['metadata']['height'] == 1280
+        # progress is removed once editing is finished
+        assert resp_data['processing'] == {'video': False, 'thumbnail_preview': False, 'thumbnails_timeline': False}
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_progress(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        test_app.mongo.db.projects.find_one_and_update(
+            {'_id': ObjectId(project['_id'])},
+            {'$set': {
+                'processing.video': True,
+                'processing.video_progress': {'percent': 42.5, 'eta': 12.3, 'speed': 2.1, 'fps': 52.4}
+            }}
+        )
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert resp_data['processing']['video'] is True
+        assert resp_data['processing']['video_progress'] == {'percent': 42.5, 'eta': 12.3, 'speed': 2.1, 'fps': 52.4}
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_estimate(test_app, client, projects):
+    project = projects[0]
+    test_app.config['RENDER_CACHE_ENABLED'] = False
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(url, data=json.dumps({"crop": "0,0,640,480"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        # not calibrated yet
+        estimate = json.loads(resp.data)['estimate']
+        assert estimate['samples'] == 0
+        assert estimate['seconds'] > 0
+        # timing of finished edit is saved, estimate is removed
+        timing = test_app.mongo.db.encode_timings.find_one()
+        assert timing['mode'] == 'encode'
+        assert timing['tier'] == test_app.config['DEFAULT_ENCODING_TIER']
+        assert timing['seconds'] > 0
+        resp_data = json.loads(client.get(url).data)
+        assert 'video_estimate' not in resp_data['processing']
+
+        # estimate is fitted to timings of comparable edits
+        changes = {'filters': [{'crop': {'x': 0, 'y': 0, 'width': 320, 'height': 240}}]}
+        features = edit_features(resp_data['metadata'], changes)
+        test_app.mongo.db.encode_timings.delete_many({})
+        test_app.mongo.db.encode_timings.insert_many([
+            {**features, 'work': work, 'seconds': 1 + 2 * work, 'create_time': datetime.utcnow()}
+            for work in (1, 2, 3)
+        ])
+        with mock.patch('videoserver.apps.projects.routes.edit_video'):
+            resp = client.put(url, data=json.dumps({"crop": "0,0,320,240"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        estimate = json.loads(resp.data)['estimate']
+        assert estimate['samples'] == 3
+        assert estimate['seconds'] == pytest.approx(1 + 2 * features['work'], abs=0.1)
+        resp_data = json.loads(client.get(url).data)
+        assert resp_data['processing']['video_estimate']['seconds'] == estimate['seconds']
+
+
+def test_cost_model():
+    assert fit_cost_model([]) is None
+    assert fit_cost_model([(1, 3), (2, 5), (3, 7)]) == pytest.approx((1, 2))
+    # overhead can't be negative
+    assert fit_cost_model([(1, 1), (3, 5)]) == pytest.approx((0, 1.5))
+    assert fit_cost_model([(2, 4), (2, 6)]) == pytest.approx((0, 2.5))
+
+    assert [shortest_job_priority(seconds, 4) for seconds in (1, 10, 11, 20, 40, 1000)] == [3, 3, 2, 2, 1, 0]
 
 
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': False},)], indirect=True)
@@ -331,7 +497,7 @@ def test_edit_project_crop_success(test_app, client, projects):
         )
         resp_data = json.loads(resp.data)
         assert resp.status == '202 ACCEPTED'
-        assert resp_data == {'processing': True}
+        assert resp_data == {'processing': True, 'estimate': mock.ANY}
         # get details
         resp = client.get(url)
         resp_data = json.loads(resp.data)
@@ -339,6 +505,36 @@ def test_edit_project_crop_success(test_app, client, projects):
         assert resp_data['metadata']['height'] == 480
 
 
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_segments_subtasks_success(test_app, client, projects):
+    project = projects[0]
+    test_app.config['FFMPEG_SEGMENT_WORKERS'] = 3
+    test_app.config['FFMPEG_SEGMENT_MIN_DURATION'] = 1
+    test_app.config['FFMPEG_SEGMENT_DISPATCH'] = 'celery'
+
+    with test_app.test_request_context():
+        # edit request
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(
+            url,
+            data=json.dumps({
+                "crop": "0,0,640,480"
+            }),
+            content_type='application/json'
+        )
+        assert resp.status == '202 ACCEPTED'
+        # get details
+        resp = client.get(url)
+        resp_data = json.loads(resp.data)
+        assert not resp_data['processing']['video']
+        assert resp_data['version'] == project['version'] + 1
+        assert resp_data['metadata']['width'] == 640
+        assert resp_data['metadata']['height'] == 480
+        assert resp_data['metadata']['nb_frames'] == 375
+        # timing of the whole segmented edit calibrates cost model
+        assert test_app.mongo.db.encode_timings.count_documents({'mode': 'encode'}) == 1
+
+
 @pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
 def test_edit_project_crop_fail(test_app, client, projects):
     project = projects[0]
@@ -471,7 +667,7 @@ def test_edit_project_scale_success(test_app, client, projects):
         )
         resp_data = json.loads(resp.data)
         assert resp.status == '202 ACCEPTED'
-        assert resp_data == {'processing': True}
+        assert resp_data == {'processing': True, 'estimate': mock.ANY}
         # get details
         resp = client.get(url)
         resp_data = json.loads(resp.data)
@@ -569,7 +765,7 @@ def test_edit_project_scale_and_crop_success(test_app, client, projects):
         )
         resp_data = json.loads(resp.data)
         assert resp.status == '202 ACCEPTED'
-        assert resp_data == {'processing': True}
+        assert resp_data == {'processing': True, 'estimate': mock.ANY}
         # get details
         resp = client.get(url)
         resp_data = json.loads(resp.data)
@@ -603,7 +799,7 @@ def test_edit_project_remove_thumbnails(test_app, client, projects):
         )
         resp_data = json.loads(resp.data)
         assert resp.status == '202 ACCEPTED'
-        assert resp_data == {'processing': True}
+        assert resp_data == {'processing': True, 'estimate': mock.ANY}
         # get details
         resp = client.get(url)
         resp_data = json.loads(resp.data)
@@ -611,3 +807,116 @@ def test_edit_project_remove_thumbnails(test_app, client, projects):
         assert resp_data['thumbnails']['timeline'] == []
         # we keep preview thumbnail
         assert resp_data['thumbnails']['preview'] is not None
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_keyframe_index(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        # index is copied along with a duplicated video
+        keyframe_index = test_app.mongo.db.keyframes.find_one({'_id': ObjectId(project['_id'])})
+        assert keyframe_index['version'] == project['version']
+        # packed doubles and 64-bit integers
+        assert len(keyframe_index['timestamps']) % 8 == 0
+        assert len(keyframe_index['timestamps']) == len(keyframe_index['positions'])
+
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(
+            url,
+            data=json.dumps({
+                "trim": "2,10"
+            }),
+            content_type='application/json'
+        )
+        assert resp.status == '202 ACCEPTED'
+        # index is rebuilt for the edited version
+        keyframe_index = test_app.mongo.db.keyframes.find_one({'_id': ObjectId(project['_id'])})
+        assert keyframe_index['version'] == project['version'] + 1
+
+        resp = client.delete(url)
+        assert resp.status == '204 NO CONTENT'
+        assert test_app.mongo.db.keyframes.find_one({'_id': ObjectId(project['_id'])}) is None
+
+
+@pytest.mark.parametrize('projects', [(
+    {'file': 'sample_0.mp4', 'duplicate': True},
+    {'file': 'sample_0.mp4', 'duplicate': True},
+)], indirect=True)
+def test_edit_project_render_cache(test_app, client, projects):
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=projects[0]['_id'])
+        resp = client.put(url, data=json.dumps({"trim": "2,10", "rotate": -90}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        assert get_render_cache_stats() == {'hits': 0, 'misses': 1, 'evictions': 0, 'entries': 1, 'size': mock.ANY}
+        edited_project = json.loads(client.get(url).data)
+
+        # the same edit of the same source video is copied
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=projects[1]['_id'])
+        with mock.patch.object(FFMPEGVideoEditor, 'edit_video') as edit_video:
+            resp = client.put(
+                url, data=json.dumps({"rotate": 270, "trim": "2.0,10.0"}), content_type='application/json'
+            )
+            assert resp.status == '202 ACCEPTED'
+            edit_video.assert_not_called()
+        assert get_render_cache_stats()['hits'] == 1
+        resp_data = json.loads(client.get(url).data)
+        assert resp_data['version'] == projects[1]['version'] + 1
+        assert resp_data['metadata'] == edited_project['metadata']
+        keyframe_index = test_app.mongo.db.keyframes.find_one({'_id': ObjectId(projects[1]['_id'])})
+        assert keyframe_index['version'] == resp_data['version']
+
+        # least recently used renders are evicted
+        test_app.config['RENDER_CACHE_MAX_SIZE'] = 0
+        resp = client.put(url, data=json.dumps({"trim": "1,5"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        stats = get_render_cache_stats()
+        assert stats['evictions'] == 2
+        assert stats['entries'] == 0
+        assert stats['size'] == 0
+
+
+@pytest.mark.parametrize('projects', [(
+    {'file': 'sample_0.mp4', 'duplicate': True},
+    {'file': 'sample_0.mp4', 'duplicate': True},
+)], indirect=True)
+def test_edit_project_render_cache_missing(test_app, client, projects):
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=projects[0]['_id'])
+        resp = client.put(url, data=json.dumps({"trim": "2,10"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        # cached video is evicted by another worker after it was found
+        test_app.fs.delete(test_app.mongo.db.render_cache.find_one()['storage_id'])
+
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=projects[1]['_id'])
+        resp = client.put(url, data=json.dumps({"trim": "2,10"}), content_type='application/json')
+        assert resp.status == '202 ACCEPTED'
+        resp_data = json.loads(client.get(url).data)
+        assert resp_data['version'] == projects[1]['version'] + 1
+        assert resp_data['metadata']['duration'] == 8.0
+        # video is rendered and cached again
+        assert get_render_cache_stats() == {'hits': 0, 'misses': 2, 'evictions': 0, 'entries': 1, 'size': mock.ANY}
+
+
+@pytest.mark.parametrize('projects', [({'file': 'sample_0.mp4', 'duplicate': True},)], indirect=True)
+def test_edit_project_encoding_tier(test_app, client, projects):
+    project = projects[0]
+
+    with test_app.test_request_context():
+        url = url_for('projects.retrieve_edit_destroy_project', project_id=project['_id'])
+        resp = client.put(url, data=json.dumps({"encoding_tier": "fastest"}), content_type='application/json')
+        assert resp.status == '400 BAD REQUEST'
+        # encoding tier is not an edit by itself
+        resp = client.put(url, data=json.dumps({"encoding_tier": "draft"}), content_type='application/json')
+        assert resp.status == '400 BAD REQUEST'
+        assert 'edit' in json.loads(resp.data)
+
+        with mock.patch.object(FFMPEGVideoEditor, 'edit_video', wraps=FFMPEGVideoEditor().edit_video) as edit_video:
+            resp = client.put(
+                url, data=json.dumps({"crop": "0,0,640,480", "encoding_tier": "draft"}), content_type='application/json'
+            )
+            assert resp.status == '202 ACCEPTED'
+            assert edit_video.call_args[1]['encoding_tier'] == 'draft'
+        resp_data = json.loads(client.get(url).data)
+        assert resp_data['version'] == project['version'] + 1
+        assert resp_data['metadata']['width'] == 640
@@ -36,6 +36,15 @@ def test_app(request):
         """
         # drop test db
         test_app.mongo.db.projects.drop()
+        test_app.mongo.db.keyframes.drop()
+        test_app.mongo.db.metadata_cache.drop()
+        test_app.mongo.db.edit_previews.drop()
+        test_app.mongo.db.render_cache.drop()
+        test_app.mongo.db.cache_stats.drop()
+        test_app.mongo.db.streaming.drop()
+        test_app.mongo.db.scenes.drop()
+        test_app.mongo.db.frame_cache.drop()
+        test_app.mongo.db.encode_timings.drop()
         # drop test media folder
         if os.path.exists(test_app.config['FS_MEDIA_STORAGE_PATH']):
             shutil.rmtree(os.path.dirname(test_app.config.get('FS_MEDIA_STORAGE_PATH')))
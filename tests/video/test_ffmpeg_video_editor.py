@@ -1,6 +1,24 @@
+import io
+import os
+import resource
+import shutil
+import socket
+import struct
+from functools import reduce
+from unittest import mock
+
 import pytest
 
-from videoserver.lib.video_editor.ffmpeg import FFMPEGVideoEditor
+from videoserver.lib.scratch import ScratchSpaceError, scratch_dir, scratch_job, scratch_root, sweep_scratch
+from videoserver.lib.utils import create_temp_file
+from videoserver.lib.video_editor.edits import apply_edit, compose_edits, normalize_changes
+from videoserver.lib.video_editor.ffmpeg import FFMPEGVideoEditor, parse_progress
+from videoserver.lib.video_editor.keyframes import KeyframeIndex, snap_to_keyframes
+from videoserver.lib.video_editor.mp4 import is_faststart
+from videoserver.lib.video_editor.plan import compile_plan, scaled_size
+from videoserver.lib.video_editor.scenes import pack_scenes, parse_scene_scores, pick_scenes, unpack_scenes
+from videoserver.lib.video_editor.process import (ProcessCancelledError, ProcessError, ProcessTimeoutError,
+                                                  run_process)
 
 
 @pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
@@ -99,6 +117,84 @@ def test_ffmpeg_video_editor_all_methods(test_app, filestreams):
         assert metadata['height'] == 320
 
 
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_edit_plan(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    crop = {'width': 720, 'height': 360, 'x': 0, 'y': 0}
+
+    def get_graph(run_process):
+        cmd = run_process.call_args_list[-1][0][0]
+        return cmd[cmd.index('-filter:v') + 1]
+
+    with test_app.app_context():
+        # edited video and thumbnail share the same filter graph
+        with mock.patch.object(editor, '_run_process', wraps=editor._run_process) as run_process:
+            content, metadata = editor.edit_video(
+                stream_file=filestreams[0],
+                filename='test_ffmpeg_video_editor_sample.mp4',
+                crop=crop,
+                rotate=-270
+            )
+            edit_graph = get_graph(run_process)
+        with mock.patch.object(editor, '_run_process', wraps=editor._run_process) as run_process:
+            thumbnail, meta = editor.capture_thumbnail(
+                stream_file=filestreams[0],
+                filename='test_ffmpeg_video_editor_sample.mp4',
+                duration=15,
+                position=5,
+                crop=crop,
+                rotate=-270
+            )
+            thumbnail_graph = get_graph(run_process)
+
+        assert edit_graph == thumbnail_graph == 'crop=720:360:0:0,transpose=1'
+        assert (metadata['width'], metadata['height']) == (meta['width'], meta['height']) == (360, 720)
+
+
+def test_edit_plan():
+    # rotations are merged
+    assert compile_plan([{'rotate': -270}], 1280, 720).graph == 'transpose=1'
+    assert compile_plan([{'rotate': 180}], 1280, 720).graph == 'hflip,vflip'
+    plan = compile_plan([{'rotate': 90}, {'rotate': -90}], 1280, 720)
+    assert not plan
+    assert (plan.width, plan.height, plan.cost) == (1280, 720, 0)
+
+    # crops and downscales are moved before rotation
+    plan = compile_plan([{'rotate': 90}, {'crop': {'x': 0, 'y': 0, 'width': 360, 'height': 640}}], 1280, 720)
+    assert plan.graph == 'crop=640:360:0:360,transpose=1'
+    assert (plan.width, plan.height) == (360, 640)
+    plan = compile_plan([{'rotate': 90, 'scale': 360}], 1280, 720)
+    assert plan.graph == 'scale=360:-2,transpose=1'
+    plan = compile_plan([{'rotate': 90}, {'scale': 360}], 1280, 720)
+    assert plan.graph == 'scale=-2:360,transpose=1'
+    assert (plan.width, plan.height) == (360, 640)
+    # transpose of the full frame and scale of the rotated one
+    assert plan.cost < 1280 * 720 * (2 + 4)
+    # but not upscales, crops with odd offsets or if frame size is unknown
+    assert compile_plan([{'rotate': 90}, {'scale': 1000}], 1280, 720).graph == 'transpose=1,scale=1000:-2'
+    crop = {'x': 1, 'y': 0, 'width': 360, 'height': 640}
+    assert compile_plan([{'rotate': 90}, {'crop': crop}], 1280, 720).graph == 'transpose=1,crop=360:640:1:0'
+    assert compile_plan([{'rotate': 90}, {'scale': 360}]).graph == 'transpose=1,scale=360:-2'
+
+    # scales with the same result are merged
+    plan = compile_plan([{'scale': 640}, {'scale': 320}], 1280, 720)
+    assert plan.graph == 'scale=320:-2'
+    assert (plan.width, plan.height) == (320, 180)
+    # as well as crops
+    steps = [
+        {'crop': {'x': 100, 'y': 50, 'width': 640, 'height': 480}},
+        {'crop': {'x': 2, 'y': 4, 'width': 320, 'height': 240}},
+    ]
+    assert compile_plan(steps, 1280, 720).graph == 'crop=320:240:102:54'
+
+    # height of `scale=104:-2` is 58.5 rounded once as a half, 29.25 to 29, as ffmpeg does
+    assert scaled_size(104, 1280, 720) == (104, 58)
+    steps = [{'scale': 104}, {'rotate': 90}, {'crop': {'x': 0, 'y': 0, 'width': 58, 'height': 104}}]
+    plan = compile_plan(steps, 1280, 720)
+    assert plan.graph == 'scale=104:-2,crop=104:58:0:0,transpose=1'
+    assert (plan.width, plan.height) == (58, 104)
+
+
 @pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
 def test_ffmpeg_video_editor_capture_timeline_thumbnails(test_app, filestreams):
     editor = FFMPEGVideoEditor()
@@ -137,3 +233,720 @@ def test_ffmpeg_video_editor_capture_thumbnail(test_app, filestreams):
         assert meta['mimetype'] == 'image/png'
         assert meta['width'] == 360
         assert meta['height'] == 720
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_capture_fast(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        with mock.patch.object(editor, '_run_process', wraps=editor._run_process) as run_process:
+            thumbnails = list(editor.capture_timeline_thumbnails(
+                filestreams[0], 'test_ffmpeg_video_editor_sample.mp4', 15, 10, fast=True
+            ))
+            # all keyframes are captured in one ffmpeg run, non-key frames are not decoded
+            commands = [call[0][0] for call in run_process.call_args_list if call[0][0][0] == 'ffmpeg']
+            assert len(commands) == 1
+            assert commands[0].count('nokey') == 10
+        assert len(thumbnails) == 10
+        for content, meta in thumbnails:
+            assert content.startswith(b'\x89PNG')
+            assert (meta['width'], meta['height']) == (89, 50)
+
+        thumbnail, meta = editor.capture_thumbnail(
+            stream_file=filestreams[0],
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            duration=15,
+            position=5,
+            crop={'width': 720, 'height': 360, 'x': 0, 'y': 0},
+            rotate=90,
+            fast=True
+        )
+        assert (meta['width'], meta['height']) == (360, 720)
+
+    # frames are decoded at reduced resolution by decoders which support it
+    assert editor._get_keyframe_options({'codec_name': 'mjpeg', 'height': 720}, 50)[-2:] == ('-lowres', '3')
+    assert editor._get_keyframe_options({'codec_name': 'mpeg4', 'height': 480}, 200)[-2:] == ('-lowres', '1')
+    assert '-lowres' not in editor._get_keyframe_options({'codec_name': 'h264', 'height': 720}, 50)
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_capture_thumbnails(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        with mock.patch.object(editor, '_run_process', wraps=editor._run_process) as run_process:
+            results = editor.capture_thumbnails(
+                stream_file=filestreams[0],
+                filename='test_ffmpeg_video_editor_sample.mp4',
+                duration=15,
+                captures=[
+                    {'position': 5, 'crop': {'width': 720, 'height': 360, 'x': 0, 'y': 0}, 'rotate': 90},
+                    {'position': 1},
+                    {'position': 15, 'rotate': -180},
+                ]
+            )
+            # all frames are captured in one ffmpeg run
+            assert run_process.call_count == 1
+
+        assert [(meta['width'], meta['height']) for _, meta in results] == [(360, 720), (1280, 720), (1280, 720)]
+        for content, meta in results:
+            assert content.startswith(b'\x89PNG')
+            assert meta['codec_name'] == 'png'
+            assert meta['mimetype'] == 'image/png'
+            assert meta['size'] == len(content)
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_capture_scene_thumbnails(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        with mock.patch.object(editor, '_run_process', wraps=editor._run_process) as run_process:
+            scenes, thumbnails = editor.capture_scene_thumbnails(
+                stream_file=filestreams[0],
+                filename='test_ffmpeg_video_editor_sample.mp4',
+                amount=3,
+                threshold=0.3
+            )
+            # scenes are detected and captured in one ffmpeg run
+            assert [call[0][0][0] for call in run_process.call_args_list].count('ffmpeg') == 1
+        assert scenes[0] == (0.0, 1.0)
+        assert 1 <= len(thumbnails) <= 3
+        positions = [meta['position'] for _, meta in thumbnails]
+        assert positions == pick_scenes(scenes, 3)
+        for _, meta in thumbnails:
+            assert meta['height'] == 50
+            assert meta['mimetype'] == 'image/png'
+
+        # known scenes are not detected again
+        reused_scenes, reused_thumbnails = editor.capture_scene_thumbnails(
+            filestreams[0], 'test_ffmpeg_video_editor_sample.mp4', 3, 0.3, scenes=scenes
+        )
+        assert reused_scenes == scenes
+        assert [meta['position'] for _, meta in reused_thumbnails] == positions
+
+        # scene of another rendition has no frame, thumbnails of later scenes are still matched to their positions
+        _, shifted_thumbnails = editor.capture_scene_thumbnails(
+            filestreams[0], 'test_ffmpeg_video_editor_sample.mp4', len(positions) + 1, 0.3,
+            scenes=[*scenes, (positions[0] + 0.002, 2.0)]
+        )
+        assert [meta['position'] for _, meta in shifted_thumbnails] == positions
+        assert [content for content, _ in shifted_thumbnails] == [content for content, _ in thumbnails]
+
+
+def test_scenes():
+    output = (
+        'frame:0    pts:0       pts_time:0\n'
+        'lavfi.scene_score=0.000000\n'
+        'frame:1    pts:62976   pts_time:4.92\n'
+        'lavfi.scene_score=0.500000\n'
+        'frame:2    pts:98000   pts_time:7.65625\n'
+        'lavfi.scene_score=0.750000\n'
+    )
+    scenes = parse_scene_scores(output)
+    assert scenes == [(0.0, 1.0), (4.92, 0.5), (7.65625, 0.75)]
+    assert pick_scenes(scenes, 2) == [0.0, 7.65625]
+    assert pick_scenes(scenes, 10) == [0.0, 4.92, 7.65625]
+    assert unpack_scenes(*pack_scenes(scenes)) == scenes
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_capture_animated_thumbnail(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        with mock.patch.object(editor, '_run_process', wraps=editor._run_process) as run_process:
+            content, meta = editor.capture_animated_thumbnail(
+                stream_file=filestreams[0],
+                filename='test_ffmpeg_video_editor_sample.mp4',
+                duration=15,
+                frames_amount=8,
+                height=144,
+                frame_rate=2
+            )
+            # frames are sampled in one ffmpeg run
+            assert [call[0][0][0] for call in run_process.call_args_list] == ['ffmpeg']
+        assert content[:4] == b'RIFF' and content[8:12] == b'WEBP'
+        # animation frames
+        assert 1 < content.count(b'ANMF') <= 8
+        assert (meta['width'], meta['height']) == (256, 144)
+        assert meta['size'] == len(content)
+        assert meta['mimetype'] == 'image/webp'
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_trim_stream_copy(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        keyframes = editor.get_keyframes(mp4_stream)
+        assert keyframes[0] == 0.0
+        assert keyframes == sorted(keyframes)
+
+        start, end = snap_to_keyframes(keyframes, 2, 10, 15.0)
+        assert start <= 2
+        assert end >= 10
+        assert start in keyframes
+        assert end in keyframes or end == 15.0
+
+        content, metadata = editor.edit_video(
+            stream_file=mp4_stream,
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            trim={'start': start, 'end': end},
+            trim_mode='copy'
+        )
+        assert abs(metadata['duration'] - (end - start)) < 0.1
+        # stream copy keeps original codec and frame size
+        assert metadata['codec_name'] == 'h264'
+        assert metadata['width'] == 1280
+        assert metadata['height'] == 720
+
+        with pytest.raises(ValueError):
+            editor.edit_video(
+                stream_file=mp4_stream,
+                filename='test_ffmpeg_video_editor_sample.mp4',
+                trim={'start': start, 'end': end},
+                rotate=90,
+                trim_mode='copy'
+            )
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_trim_smart(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        keyframes = editor.get_keyframes(mp4_stream)
+        # cut points between keyframes, partial GOPs are re-encoded
+        for start, end in ((2.5, 11.5), (keyframes[0], 10.5), (0.52, 3.0)):
+            content, metadata = editor.edit_video(
+                stream_file=mp4_stream,
+                filename='test_ffmpeg_video_editor_sample.mp4',
+                trim={'start': start, 'end': end},
+                trim_mode='smart'
+            )
+            # frame accurate, sample_0.mp4 is 25 fps
+            assert abs(metadata['duration'] - (end - start)) < 0.05
+            assert metadata['nb_frames'] == round((end - start) * 25)
+            assert metadata['codec_name'] == 'h264'
+            assert metadata['width'] == 1280
+            assert metadata['height'] == 720
+
+        # codecs without an encoder, e.g. hevc or pcm, fall back to accurate trim
+        encoder_map = dict(test_app.config['CODEC_ENCODER_MAP'])
+        smart_trim = editor._smart_trim
+        results = []
+
+        def record_smart_trim(*args, **kwargs):
+            results.append(smart_trim(*args, **kwargs))
+            return results[-1]
+
+        for codec in ('h264', 'aac'):
+            test_app.config['CODEC_ENCODER_MAP'] = {name: encoder for name, encoder in encoder_map.items()
+                                                    if name != codec}
+            results.clear()
+            with mock.patch.object(editor, '_smart_trim', side_effect=record_smart_trim):
+                content, metadata = editor.edit_video(
+                    stream_file=mp4_stream,
+                    filename='test_ffmpeg_video_editor_sample.mp4',
+                    trim={'start': 2.5, 'end': 11.5},
+                    trim_mode='smart'
+                )
+            assert results == [False]
+            assert metadata['nb_frames'] == 225
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_segments(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+    test_app.config['FFMPEG_SEGMENT_WORKERS'] = 3
+    test_app.config['FFMPEG_SEGMENT_MIN_DURATION'] = 1
+
+    with test_app.app_context():
+        filename = 'test_ffmpeg_video_editor_sample.mp4'
+        segments = editor.split_video(mp4_stream, filename, 3)
+        assert 1 < len(segments) <= 3
+        content, metadata = editor.concat_videos(segments, filename, mp4_stream)
+        assert abs(metadata['duration'] - 15.0) < 0.1
+        assert metadata['nb_frames'] == 375
+
+        # encode segments in parallel
+        content, metadata = editor.edit_video(
+            stream_file=mp4_stream,
+            filename=filename,
+            rotate=90
+        )
+        assert abs(metadata['duration'] - 15.0) < 0.1
+        assert metadata['nb_frames'] == 375
+        assert metadata['width'] == 720
+        assert metadata['height'] == 1280
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_progress(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+    progress = []
+
+    with test_app.app_context():
+        editor.edit_video(
+            stream_file=mp4_stream,
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            trim={'start': 2, 'end': 10},
+            progress_callback=progress.append
+        )
+        assert progress
+        assert progress[-1]['end'] is True
+        assert abs(progress[-1]['out_time'] - 8.0) < 0.1
+        assert all(not p['end'] for p in progress[:-1])
+        out_times = [p['out_time'] for p in progress]
+        assert out_times == sorted(out_times)
+
+
+def test_ffmpeg_parse_progress():
+    assert parse_progress({
+        'fps': '51.20', 'out_time_us': '5120000', 'out_time': '00:00:05.120000', 'speed': '2.5x',
+        'progress': 'continue'
+    }) == {'out_time': 5.12, 'speed': 2.5, 'fps': 51.2, 'end': False}
+    assert parse_progress({
+        'fps': '0.00', 'out_time': '00:01:05.500000', 'speed': 'N/A', 'progress': 'end'
+    }) == {'out_time': 65.5, 'speed': None, 'fps': None, 'end': True}
+    assert parse_progress({
+        'out_time_us': 'N/A', 'out_time': '-00:00:00.040000', 'progress': 'continue'
+    })['out_time'] == 0.0
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_keyframe_index(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        metadata, keyframe_index = editor.get_meta(mp4_stream, keyframe_index=True)
+        # metadata is the same as without index
+        assert metadata == editor.get_meta(mp4_stream)
+        assert list(keyframe_index.timestamps) == editor.get_keyframes(mp4_stream)
+        assert all(position >= 0 for position in keyframe_index.positions)
+        assert list(keyframe_index.positions) == sorted(keyframe_index.positions)
+
+        unpacked = KeyframeIndex.unpack(*keyframe_index.pack())
+        assert unpacked.timestamps == keyframe_index.timestamps
+        assert unpacked.positions == keyframe_index.positions
+
+        content, metadata, keyframe_index = editor.edit_video(
+            stream_file=mp4_stream,
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            trim={'start': 2, 'end': 10},
+            keyframes=unpacked.timestamps,
+            keyframe_index=True
+        )
+        assert metadata['duration'] == 8.0
+        assert keyframe_index.timestamps[0] == 0.0
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_metadata_cache(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        metadata = editor.get_meta(mp4_stream)
+        with mock.patch.object(editor, '_get_meta') as mock_get_meta:
+            assert editor.get_meta(mp4_stream) == metadata
+            assert not mock_get_meta.called
+        assert test_app.mongo.db.metadata_cache.count_documents({}) == 1
+
+        # cached metadata has no keyframe index yet
+        metadata, keyframe_index = editor.get_meta(mp4_stream, keyframe_index=True)
+        with mock.patch.object(editor, '_get_meta') as mock_get_meta:
+            cached_metadata, cached_keyframe_index = editor.get_meta(mp4_stream, keyframe_index=True)
+            assert not mock_get_meta.called
+        assert cached_metadata == metadata
+        assert cached_keyframe_index.timestamps == keyframe_index.timestamps
+
+        # edited video is cached as well
+        content, metadata = editor.edit_video(
+            stream_file=mp4_stream,
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            trim={'start': 2, 'end': 10}
+        )
+        with mock.patch.object(editor, '_get_meta') as mock_get_meta:
+            assert editor.get_meta(content) == metadata
+            assert not mock_get_meta.called
+
+        test_app.config['METADATA_CACHE_ENABLED'] = False
+        with mock.patch.object(editor, '_get_meta', return_value=metadata) as mock_get_meta:
+            editor.get_meta(mp4_stream)
+            assert mock_get_meta.called
+
+
+def test_run_process(tmp_path):
+    assert run_process(['echo', 'output']) == b'output\n'
+
+    lines = []
+    run_process(['printf', 'first\nsecond\n'], line_callback=lines.append)
+    assert lines == ['first\n', 'second\n']
+
+    # output larger than a pipe buffer is drained after callback has failed
+    callback = mock.Mock(side_effect=RuntimeError('failure'))
+    run_process(['sh', '-c', 'seq 100000'], timeout=10, line_callback=callback, poll_interval=0.1)
+    assert callback.call_count == 100000
+
+    with pytest.raises(ProcessError) as excinfo:
+        run_process(['sh', '-c', 'echo failure >&2; exit 3'])
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.stderr == 'failure'
+
+    # file size limit is exceeded
+    with pytest.raises(ProcessError):
+        run_process(
+            ['sh', '-c', f'head -c 2000000 /dev/zero > {tmp_path / "big.bin"}'],
+            limits={resource.RLIMIT_FSIZE: 1000000}
+        )
+
+
+def test_run_process_kill_process_group(tmp_path):
+    pid_file = tmp_path / 'child.pid'
+
+    with pytest.raises(ProcessTimeoutError):
+        run_process(['sh', '-c', f'sleep 30 & echo $! > {pid_file}; wait'], timeout=1, poll_interval=0.1)
+
+    # background child was killed along with its parent, it is gone or a zombie waiting to be reaped
+    stat_path = f'/proc/{int(pid_file.read_text())}/stat'
+    if os.path.exists(stat_path):
+        with open(stat_path) as f:
+            assert f.read().rsplit(')', 1)[1].split()[0] == 'Z'
+
+
+def test_ffmpeg_video_editor_cancel(test_app):
+    editor = FFMPEGVideoEditor(cancel_check=lambda: True)
+
+    with test_app.app_context():
+        with pytest.raises(ProcessCancelledError):
+            editor._run_process(['sleep', '30'], timeout=None)
+
+
+def test_ffmpeg_video_editor_timeout(test_app):
+    editor = FFMPEGVideoEditor()
+    test_app.config.update({'FFMPEG_TIMEOUT_BASE': 60, 'FFMPEG_TIMEOUT_FACTOR': 10, 'FFMPEG_TIMEOUT': 7200})
+
+    with test_app.app_context():
+        assert editor._get_timeout(0) == 60
+        assert editor._get_timeout(15) == 210
+        # input is not probed for duration
+        assert editor._get_timeout(None) == 7200
+        with mock.patch.object(editor, '_run_process') as run:
+            editor._run_ffmpeg('input.mp4', 'output.mp4', override=False)
+        assert run.call_count == 1
+        assert run.call_args[1]['timeout'] == 7200
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_create_proxy(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        content, metadata = editor.create_proxy(
+            stream_file=filestreams[0],
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            height=480
+        )
+        assert metadata['width'] == 854
+        assert metadata['height'] == 480
+        assert metadata['codec_name'] == 'h264'
+        assert metadata['size'] < len(filestreams[0])
+        # proxy is seekable at every second
+        _, keyframe_index = editor.get_meta(content, keyframe_index=True)
+        timestamps = keyframe_index.timestamps
+        assert max(b - a for a, b in zip(timestamps, timestamps[1:])) <= 1.05
+
+
+def test_is_faststart():
+    def box(box_type, payload=b''):
+        return struct.pack('>I', 8 + len(payload)) + box_type + payload
+
+    assert is_faststart(io.BytesIO(box(b'ftyp', b'isom') + box(b'moov') + box(b'mdat', b'0' * 16))) is True
+    assert is_faststart(io.BytesIO(box(b'ftyp', b'isom') + box(b'mdat', b'0' * 16) + box(b'moov'))) is False
+    # 64-bit box size
+    large_mdat = struct.pack('>I4sQ', 1, b'mdat', 32) + b'0' * 16
+    assert is_faststart(io.BytesIO(box(b'ftyp') + large_mdat + box(b'moov'))) is False
+    # webm
+    assert is_faststart(io.BytesIO(b'\x1a\x45\xdf\xa3' + b'0' * 32)) is None
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_faststart(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        assert editor.get_meta(filestreams[0])['faststart'] is False
+        content = editor.faststart(filestreams[0], 'test_ffmpeg_video_editor_sample.mp4')
+        metadata = editor.get_meta(content)
+        assert metadata['faststart'] is True
+        assert metadata['duration'] == editor.get_meta(filestreams[0])['duration']
+        # fast-start video is not remuxed
+        assert editor.faststart(content, 'test_ffmpeg_video_editor_sample.mp4') is content
+        # edited video is fast-start
+        _, metadata = editor.edit_video(filestreams[0], 'test_ffmpeg_video_editor_sample.mp4',
+                                        trim={'start': 2, 'end': 6})
+        assert metadata['faststart'] is True
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_create_renditions(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        with mock.patch.object(editor, '_run_process', wraps=editor._run_process) as run_process:
+            renditions = editor.create_renditions(
+                stream_file=filestreams[0],
+                filename='test_ffmpeg_video_editor_sample.mp4',
+                ladder=[{'height': 480, 'bitrate': 1400000}, {'height': 360, 'bitrate': 800000}]
+            )
+            # all renditions are encoded by one ffmpeg
+            assert [call[0][0][0] for call in run_process.call_args_list].count('ffmpeg') == 1
+        assert [(meta['width'], meta['height']) for _, meta in renditions] == [(854, 480), (640, 360)]
+        for content, meta in renditions:
+            assert meta['codec_name'] == 'h264'
+            assert meta['size'] == len(content)
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_package_stream(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        playlist, files = editor.package_stream(
+            stream_file=filestreams[0],
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            stream_format='hls',
+            prefix='v1',
+            segment_duration=6
+        )
+        assert playlist == 'v1.m3u8'
+        segments = [name for name in files if name != playlist]
+        assert segments and all(name.startswith('v1_') and name.endswith('.ts') for name in segments)
+        manifest = files[playlist].decode()
+        assert '#EXT-X-PLAYLIST-TYPE:VOD' in manifest
+        assert all(name in manifest for name in segments)
+
+        playlist, files = editor.package_stream(
+            stream_file=filestreams[0],
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            stream_format='dash',
+            prefix='v2',
+            segment_duration=6
+        )
+        assert playlist == 'v2.mpd'
+        assert all(name.startswith('v2') for name in files)
+        assert any(name.startswith('v2_init_') for name in files)
+        # h264 is copied, not encoded
+        with mock.patch.object(editor, '_get_encode_options') as get_encode_options:
+            editor.package_stream(filestreams[0], 'test_ffmpeg_video_editor_sample.mp4', 'hls', 'v3', 6)
+            get_encode_options.assert_not_called()
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_preview_edit(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        content, metadata = editor.preview_edit(
+            stream_file=filestreams[0],
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            height=240,
+            duration=3,
+            trim={'start': 2, 'end': 4},
+            crop={'width': 640, 'height': 480, 'x': 0, 'y': 0}
+        )
+        assert metadata['mimetype'] == 'video/mp4'
+        assert metadata['width'] == 320
+        assert metadata['height'] == 240
+        # sample is not longer than trimmed video
+        assert metadata['duration'] == pytest.approx(2, abs=0.1)
+
+        content, metadata = editor.preview_edit(
+            stream_file=filestreams[0],
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            height=240,
+            duration=3,
+            rotate=90,
+            position=5
+        )
+        assert metadata['mimetype'] == 'image/png'
+        assert metadata['width'] == 136
+        assert metadata['height'] == 240
+
+
+def test_compose_edits():
+    edits = [
+        {'trim': {'start': 2, 'end': 12}, 'trim_mode': 'copy'},
+        {'crop': {'x': 0, 'y': 0, 'width': 640, 'height': 480}},
+        {'trim': {'start': 1, 'end': 5}, 'trim_mode': 'accurate', 'rotate': 90},
+        {'scale': 301},
+    ]
+    # trims are relative to the previous edits
+    assert compose_edits(edits[:1]) == {'trim': {'start': 2, 'end': 12}, 'trim_mode': 'copy'}
+    assert compose_edits(edits) == {
+        'trim': {'start': 3, 'end': 7},
+        'trim_mode': 'accurate',
+        'filters': [
+            {'crop': {'x': 0, 'y': 0, 'width': 640, 'height': 480}},
+            {'rotate': 90},
+            {'scale': 301},
+        ]
+    }
+    metadata = reduce(apply_edit, edits, {'width': 1280, 'height': 720, 'duration': 15.0})
+    assert metadata == {'width': 300, 'height': 400, 'duration': 4}
+    # half of 58.5 is rounded once to 29 as ffmpeg does, not 58.5 to 59 and then to 60
+    assert apply_edit({'width': 1280, 'height': 720}, {'scale': 104}) == {'width': 104, 'height': 58}
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_filters(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+    edits = [
+        {'crop': {'x': 0, 'y': 0, 'width': 640, 'height': 480}},
+        {'trim': {'start': 1, 'end': 5}, 'trim_mode': 'accurate', 'rotate': 90},
+        {'scale': 300},
+    ]
+
+    with test_app.app_context():
+        # edits are rendered in one pass
+        content, metadata = editor.edit_video(
+            stream_file=filestreams[0],
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            **compose_edits(edits)
+        )
+        expected = reduce(apply_edit, edits, {'width': 1280, 'height': 720, 'duration': 15.0})
+        assert metadata['width'] == expected['width']
+        assert metadata['height'] == expected['height']
+        assert metadata['duration'] == pytest.approx(expected['duration'], abs=0.1)
+
+
+def test_normalize_changes():
+    assert normalize_changes({'trim': {'start': 2, 'end': 10.0001}, 'trim_mode': 'copy', 'rotate': -90}) == \
+        normalize_changes({'trim': {'start': 2.0, 'end': 10}, 'trim_mode': 'copy', 'filters': [{'rotate': 270}]}) == \
+        {'trim': {'start': 2.0, 'end': 10.0}, 'trim_mode': 'copy', 'filters': [{'rotate': 270}]}
+    crop = {'x': 0, 'y': 0, 'width': 2, 'height': 2}
+    assert normalize_changes({'scale': 641, 'filters': [{'rotate': 0, 'crop': crop}]}) == \
+        {'filters': [{'scale': 640}, {'crop': crop}]}
+    assert normalize_changes({'crop': None, 'rotate': None, 'scale': None}) == {}
+
+
+def test_ffmpeg_video_editor_encode_options(test_app):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        assert editor._get_encode_options('h264', 'draft') == (
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '28', '-force_key_frames', 'expr:gte(t,n_forced*2)'
+        )
+        assert editor._get_encode_options('vp9', 'draft', speed_only=True) == (
+            '-deadline', 'realtime', '-cpu-used', '8', '-row-mt', '1'
+        )
+        assert editor._get_encode_options('h264') == editor._get_encode_options('h264', 'standard')
+        # codec without a profile
+        assert editor._get_encode_options('mpeg4') == ('-preset', test_app.config['FFMPEG_PRESET'])
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_encoding_tier(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        content, metadata, keyframe_index = editor.edit_video(
+            stream_file=filestreams[0],
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            trim={'start': 2, 'end': 10},
+            crop={'width': 640, 'height': 480, 'x': 0, 'y': 0},
+            encoding_tier='draft',
+            keyframe_index=True
+        )
+        assert metadata['codec_name'] == 'h264'
+        assert metadata['duration'] == pytest.approx(8, abs=0.1)
+        # keyframe interval of the profile
+        timestamps = keyframe_index.timestamps
+        assert max(b - a for a, b in zip(timestamps, timestamps[1:])) <= 2.05
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_decode_audio(test_app, filestreams):
+    editor = FFMPEGVideoEditor()
+
+    with test_app.app_context():
+        pcm = editor.decode_audio(
+            stream_file=filestreams[0],
+            filename='test_ffmpeg_video_editor_sample.mp4',
+            sample_rate=8000
+        )
+        # 15 seconds of 16-bit mono samples
+        assert len(pcm) == pytest.approx(15 * 8000 * 2, rel=0.02)
+
+        # video without audio stream
+        with mock.patch.object(editor, '_get_streams', return_value=({'codec_type': 'video'}, None)):
+            assert editor.decode_audio(filestreams[0], 'test_ffmpeg_video_editor_sample.mp4', 8000) is None
+
+
+def test_waveform_peaks():
+    np = pytest.importorskip('numpy')
+    from videoserver.lib.video_editor.waveform import compute_peaks, pack_peaks
+
+    samples = np.array([0, 300, -300, 1000, -32768, 32767, 5, 5, 7], dtype='<i2')
+    peaks = compute_peaks(samples.tobytes(), samples_per_peak=2, levels=3, bits=16)
+    assert [level.tolist() for level in peaks] == [
+        [[0, 300], [-300, 1000], [-32768, 32767], [5, 5], [7, 7]],
+        [[-300, 1000], [-32768, 32767], [7, 7]],
+        [[-32768, 32767], [7, 7]],
+    ]
+    # 8-bit peaks keep the high byte
+    assert compute_peaks(samples.tobytes(), 2, 1, bits=8)[0].tolist() == [[0, 1], [-2, 3], [-128, 127], [0, 0], [0, 0]]
+    assert [level.tolist() for level in compute_peaks(b'', 2, 2)] == [[], []]
+
+    blob, levels = pack_peaks(peaks, samples_per_peak=2, bits=16)
+    assert levels == [
+        {'samples_per_peak': 2, 'offset': 0, 'length': 5},
+        {'samples_per_peak': 4, 'offset': 20, 'length': 3},
+        {'samples_per_peak': 8, 'offset': 32, 'length': 2},
+    ]
+    assert len(blob) == 40
+    assert blob[20:24] == struct.pack('<hh', -300, 1000)
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_ffmpeg_video_editor_scratch(test_app, filestreams, tmp_path):
+    editor = FFMPEGVideoEditor()
+    test_app.config['SCRATCH_DIR'] = str(tmp_path / 'video')
+    test_app.config['SCRATCH_SMALL_DIR'] = str(tmp_path / 'small')
+
+    with test_app.app_context():
+        video_root, small_root = scratch_root(), scratch_root(small=True)
+        with scratch_job():
+            # generator is closed before all thumbnails are read
+            thumbnails = editor.capture_timeline_thumbnails(filestreams[0], 'sample.mp4', 15, 5)
+            next(thumbnails)
+            thumbnails.close()
+            assert os.listdir(os.path.dirname(create_temp_file(b'abc')))
+            assert not os.listdir(scratch_dir(small=True))
+            assert len(os.listdir(video_root)) == len(os.listdir(small_root)) == 1
+        # job directories are removed with leaked files
+        assert os.listdir(video_root) == os.listdir(small_root) == []
+
+        test_app.config['SCRATCH_MIN_FREE'] = shutil.disk_usage(video_root).free + 1
+        with scratch_job(), pytest.raises(ScratchSpaceError):
+            editor.get_meta(filestreams[0])
+        test_app.config['SCRATCH_MIN_FREE'] = 0
+
+        # directories of processes which are not running and partially removed ones are swept
+        hostname = socket.gethostname()
+        alive = f'{hostname}-{os.getpid()}-abc'
+        # directories of other hosts are kept however old they are
+        kept = sorted((alive, f'other{hostname}-1-abc', f'other{hostname}-1-abc.trash', 'unknown'))
+        for name in (*kept, f'{hostname}-999999999-abc', f'{hostname}-{os.getpid()}-def.trash'):
+            os.makedirs(os.path.join(video_root, name))
+            os.utime(os.path.join(video_root, name), (0, 0))
+        assert sweep_scratch() == 2
+        assert sorted(os.listdir(video_root)) == kept
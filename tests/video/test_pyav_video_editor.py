@@ -0,0 +1,76 @@
+import pytest
+
+from videoserver.lib.video_editor import get_video_editor
+from videoserver.lib.video_editor.ffmpeg import FFMPEGVideoEditor
+
+av = pytest.importorskip('av')
+
+from videoserver.lib.video_editor.pyav import PyAVVideoEditor  # noqa
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_pyav_video_editor_get_meta(test_app, filestreams):
+    test_app.config['METADATA_CACHE_ENABLED'] = False
+    editor = PyAVVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        assert isinstance(get_video_editor('pyav'), PyAVVideoEditor)
+
+        metadata, keyframe_index = editor.get_meta(mp4_stream, keyframe_index=True)
+        # the same metadata and keyframes as ffprobe reports
+        ffmpeg_metadata, ffmpeg_keyframe_index = FFMPEGVideoEditor().get_meta(mp4_stream, keyframe_index=True)
+        assert metadata == ffmpeg_metadata
+        assert keyframe_index.timestamps == ffmpeg_keyframe_index.timestamps
+        assert keyframe_index.positions == ffmpeg_keyframe_index.positions
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_pyav_video_editor_capture_timeline_thumbnails(test_app, filestreams):
+    editor = PyAVVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        filename = 'test_pyav_video_editor_sample.mp4'
+        thumbnails = list(editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 10))
+
+        assert len(thumbnails) == 10
+        for thumbnail, meta in thumbnails:
+            assert thumbnail.startswith(b'\x89PNG')
+            assert meta['codec_name'] == 'png'
+            assert meta['mimetype'] == 'image/png'
+            assert meta['width'] == 89
+            assert meta['height'] == 50
+            assert meta['size'] == len(thumbnail)
+
+        # keyframes only
+        thumbnails = list(editor.capture_timeline_thumbnails(mp4_stream, filename, 15, 10, fast=True))
+        assert [(meta['width'], meta['height']) for _, meta in thumbnails] == [(89, 50)] * 10
+
+
+@pytest.mark.parametrize('filestreams', [('sample_0.mp4',)], indirect=True)
+def test_pyav_video_editor_capture_thumbnail(test_app, filestreams):
+    editor = PyAVVideoEditor()
+    mp4_stream = filestreams[0]
+
+    with test_app.app_context():
+        filename = 'test_pyav_video_editor_sample.mp4'
+        thumbnail, meta = editor.capture_thumbnail(
+            stream_file=mp4_stream,
+            filename=filename,
+            duration=15,
+            position=5,
+            crop={'width': 720, 'height': 360, 'x': 0, 'y': 0},
+            rotate=90
+        )
+
+        assert thumbnail.startswith(b'\x89PNG')
+        assert meta['codec_name'] == 'png'
+        assert meta['mimetype'] == 'image/png'
+        assert meta['width'] == 360
+        assert meta['height'] == 720
+
+        # position beyond the end
+        thumbnail, meta = editor.capture_thumbnail(mp4_stream, filename, 15, 15)
+        assert meta['width'] == 1280
+        assert meta['height'] == 720